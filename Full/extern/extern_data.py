@@ -168,7 +168,9 @@ extern_data = {
                              "@MODULE_NAME@" : "module_name",
                              "@PREFIX_NAME@" : "prefix_name",
                              "@DATAIN_WIDTH@" : "input_width(data_in)",
+                             "@SLOT_WIDTH@" : "input_width(slot)",
                              "@RESULT_WIDTH@" : "output_width(result)",
+                             "@DUMP_WIDTH@" : "output_width(buckets)",
                              "@BUCKET_INDEX_WIDTH@" : "output_width(empty_buckets)",
                              "@BUCKET_CONTENT_WIDTH@" : "annotation(HyperLogLogBucketContentWidth)"}
 },
@@ -178,6 +180,7 @@ extern_data = {
                              "@MODULE_NAME@" : "module_name",
                              "@PREFIX_NAME@" : "prefix_name",
                              "@DATAIN_WIDTH@" : "input_width(newVal)",
+                             "@SLOT_WIDTH@" : "input_width(slot)",
                              "@RESULT_SHORT_WIDTH@" : "output_width(result_pkt_count)"}
 }
 
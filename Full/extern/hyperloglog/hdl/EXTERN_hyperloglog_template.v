@@ -39,6 +39,12 @@
  *
  * - BUCKET_INDEX_WIDTH must be at least 4 (remember that HLL is precise for cardinalities >= (5/2)*m 
  * - HASH_WIDTH can be at maximum 24 --> we could have BUCKET_INDEX_WIDTH = 4 and RARITY_HASH_WIDTH = 16
+ * - OP_READ_RESET returns the same result as OP_READ and clears every bucket right after
+ *   reading it (read-first BRAM): the updates queued behind it go to the next interval
+ * - 2**SLOT_WIDTH independent sketches share the rarity BRAM: the slot input selects
+ *   the sketch updated, read or reset by a request (BRAM address = {slot, bucket index})
+ * - OP_READ with dump = 1 returns the raw content of DUMP_BUCKETS buckets, starting from
+ *   bucket_base (wrapping around the sketch): bucket bucket_base+i is in buckets[4i+3:4i]
  *
  */
 
@@ -52,12 +58,15 @@ module @MODULE_NAME@
     parameter DATAIN_WIDTH          = @DATAIN_WIDTH@,
     parameter BUCKET_INDEX_WIDTH    = @BUCKET_INDEX_WIDTH@,
     parameter BUCKET_CONTENT_WIDTH  = @BUCKET_CONTENT_WIDTH@,
+    parameter SLOT_WIDTH            = @SLOT_WIDTH@,
+    parameter DUMP_WIDTH            = @DUMP_WIDTH@,
+    parameter DUMP_BUCKETS          = DUMP_WIDTH / BUCKET_CONTENT_WIDTH,
     parameter RARITY_HASH_WIDTH     = (2**BUCKET_CONTENT_WIDTH)-1,
     parameter HASH_WIDTH            = BUCKET_INDEX_WIDTH + RARITY_HASH_WIDTH,
     parameter OP_WIDTH              = 2,
-    parameter INPUT_WIDTH           = DATAIN_WIDTH + OP_WIDTH + 1,
+    parameter INPUT_WIDTH           = DATAIN_WIDTH + SLOT_WIDTH + 1 + BUCKET_INDEX_WIDTH + OP_WIDTH + 1,
     parameter RESULT_WIDTH          = @RESULT_WIDTH@,
-    parameter OUTPUT_WIDTH          = RESULT_WIDTH + BUCKET_INDEX_WIDTH
+    parameter OUTPUT_WIDTH          = RESULT_WIDTH + BUCKET_INDEX_WIDTH + DUMP_WIDTH
 )
 (
     // Data Path I/O
@@ -76,6 +85,9 @@ module @MODULE_NAME@
     // Signals
     wire                                statefulValid_fifo; 
     wire    [DATAIN_WIDTH-1:0]          data_fifo;
+    wire    [SLOT_WIDTH-1:0]            slot_fifo;
+    wire                                dump_fifo;
+    wire    [BUCKET_INDEX_WIDTH-1:0]    bucket_base_fifo;
     wire    [OP_WIDTH-1:0]              opCode_fifo;
     wire    empty_fifo;
     wire    full_fifo;
@@ -89,7 +101,7 @@ module @MODULE_NAME@
     request_fifo
     (
        // Outputs
-       .dout                           ({statefulValid_fifo, data_fifo, opCode_fifo}),
+       .dout                           ({statefulValid_fifo, data_fifo, slot_fifo, dump_fifo, bucket_base_fifo, opCode_fifo}),
        .full                           (full_fifo),
        .nearly_full                    (),
        .prog_full                      (),
@@ -106,12 +118,13 @@ module @MODULE_NAME@
     // Signals
     reg                                 we_bram;
     reg  [BUCKET_INDEX_WIDTH-1:0]       addr_in_bram, addr_in_bram_r, addr_in_bram_r_next;
+    reg  [SLOT_WIDTH-1:0]               slot_bram, slot_r, slot_r_next;
     reg  [BUCKET_CONTENT_WIDTH-1:0]     data_in_bram;
     wire [BUCKET_CONTENT_WIDTH-1:0]     data_out_bram;
     // Instantiation
     true_dp_bram_readfirst
     #(
-        .L2_DEPTH(BUCKET_INDEX_WIDTH),
+        .L2_DEPTH(SLOT_WIDTH+BUCKET_INDEX_WIDTH),
         .WIDTH(BUCKET_CONTENT_WIDTH)
     ) rarity_bram
     (
@@ -119,7 +132,7 @@ module @MODULE_NAME@
         // data plane R/W interface
         .we2               (we_bram),
         .en2               (1'b1),
-        .addr2             (addr_in_bram),
+        .addr2             ({slot_bram, addr_in_bram}),
         .din2              (data_in_bram),
         .rst2              (rst),
         .regce2            (1'b1),
@@ -127,7 +140,7 @@ module @MODULE_NAME@
 
         .we1               (1'b0),
         .en1               (1'b0),
-        .addr1             ({(BUCKET_INDEX_WIDTH){1'b0}}),
+        .addr1             ({(SLOT_WIDTH+BUCKET_INDEX_WIDTH){1'b0}}),
         .din1              ({(BUCKET_CONTENT_WIDTH){1'b0}}),
         .rst1              (rst),
         .regce1            (1'b0),
@@ -172,18 +185,23 @@ module @MODULE_NAME@
    localparam OP_READ      = 2'd0;
    localparam OP_UPDATE    = 2'd1;
    localparam OP_RESET     = 2'd2;
+   localparam OP_READ_RESET = 2'd3;
    // States
    localparam StIdle        = 3'd0;
    localparam StHllUpdate   = 3'd1;
    localparam StComputeSum  = 3'd2;
    localparam StWriteResult = 3'd3;
    localparam StReset       = 3'd4;
+   localparam StDump        = 3'd5;
    // Signals
    reg  [2:0]                      state_r, state_r_next;
    reg  [1:0]                      cycle_cnt_r, cycle_cnt_r_next;
    reg  [RARITY_HASH_WIDTH-1:0]    reciprocal;
    reg  [OUTPUT_WIDTH-1:0]         result_r, result_r_next;
    reg  [BUCKET_INDEX_WIDTH-1:0]   empty_buckets_r, empty_buckets_r_next;
+   reg  [DUMP_WIDTH-1:0]           dump_r, dump_r_next;
+   reg  [$clog2(DUMP_BUCKETS+1)-1:0] dump_cnt_r, dump_cnt_r_next;
+   reg                             clear_r, clear_r_next;
    reg                             valid_out;  
    // Logic
    always @(*) begin
@@ -196,11 +214,16 @@ module @MODULE_NAME@
       we_bram = 0;
       addr_in_bram = addr_in_bram_r;
       addr_in_bram_r_next = addr_in_bram_r;
+      slot_bram = slot_r;
+      slot_r_next = slot_r;
       data_in_bram = 0; 
       // HLL Read Signals      
       reciprocal = 0;
+      clear_r_next = clear_r;
       result_r_next = result_r;
       empty_buckets_r_next = empty_buckets_r;     
+      dump_r_next = dump_r;
+      dump_cnt_r_next = dump_cnt_r;
       valid_out = 0;
       
 
@@ -211,6 +234,8 @@ module @MODULE_NAME@
             // reset the result register when returning to idle state
             result_r_next = 0;
             empty_buckets_r_next = 0;
+            dump_r_next = 0;
+            dump_cnt_r_next = 0;
             if (~empty_fifo) begin
                rd_en_fifo = 1;
                if (statefulValid_fifo) begin
@@ -220,12 +245,25 @@ module @MODULE_NAME@
                      // We save the rarity_hash value as input for the leading one position counter
                      addr_in_bram             = address_hash;
                      addr_in_bram_r_next      = address_hash;
+                     slot_bram                = slot_fifo;
+                     slot_r_next              = slot_fifo;
                      state_r_next = StHllUpdate;
-                  end else if (opCode_fifo == OP_READ) begin
+                  end else if (opCode_fifo == OP_READ && dump_fifo) begin
+                     // The first bucket is addressed in this cycle
+                     addr_in_bram             = bucket_base_fifo;
+                     addr_in_bram_r_next      = bucket_base_fifo + 1;
+                     slot_bram                = slot_fifo;
+                     slot_r_next              = slot_fifo;
+                     state_r_next = StDump;
+                  end else if (opCode_fifo == OP_READ || opCode_fifo == OP_READ_RESET) begin
+                     clear_r_next = (opCode_fifo == OP_READ_RESET);
+                     // The slot is registered: the BRAM still sees the last address in this cycle
                      addr_in_bram_r_next = 0;
+                     slot_r_next = slot_fifo;
                      state_r_next = StComputeSum;
                   end else if (opCode_fifo == OP_RESET) begin
                      addr_in_bram_r_next = 0;
+                     slot_r_next = slot_fifo;
                      state_r_next = StReset;
                   end else begin
                      valid_out = 1;
@@ -253,6 +291,11 @@ module @MODULE_NAME@
          StComputeSum: begin
             // We iteratively read from all the buckets
             addr_in_bram_r_next = addr_in_bram_r + 1;
+            if (clear_r) begin
+                // The BRAM returns the old content of the bucket being cleared
+                we_bram = 1'b1;
+                data_in_bram = RESED_WORD;
+            end
             if ( addr_in_bram_r == (2**BUCKET_INDEX_WIDTH - 1) ) begin
                 state_r_next = StWriteResult;
             end
@@ -283,6 +326,20 @@ module @MODULE_NAME@
             end
          end
          
+         StDump: begin
+            // Bucket bucket_base+i comes out of the BRAM when dump_cnt_r = i+1:
+            // shift it in from the MSBs, the first bucket ends up in the LSBs
+            addr_in_bram_r_next = addr_in_bram_r + 1;
+            dump_cnt_r_next = dump_cnt_r + 1;
+            if (dump_cnt_r >= 1) begin
+                dump_r_next = {data_out_bram, dump_r[DUMP_WIDTH-1:BUCKET_CONTENT_WIDTH]};
+            end
+            if (dump_cnt_r == DUMP_BUCKETS) begin
+                valid_out = 1;
+                state_r_next = StIdle;
+            end
+         end
+
          StReset: begin
             we_bram = 1'b1;
             data_in_bram = RESED_WORD;
@@ -308,16 +365,20 @@ module @MODULE_NAME@
    always @(posedge clk_lookup) begin
         // State Machine Registers
         cycle_cnt_r <= cycle_cnt_r_next;
+        clear_r <= clear_r_next;
         // BRAM Register
         addr_in_bram_r <= addr_in_bram_r_next;
+        slot_r <= slot_r_next;
         in_rarity_r <= rarity_hash;
         // Output registers
         result_r <= result_r_next;
         empty_buckets_r <= empty_buckets_r_next;
+        dump_r <= dump_r_next;
+        dump_cnt_r <= dump_cnt_r_next;
    end
    
    assign tuple_out_@EXTERN_NAME@_output_VALID = valid_out;
-   assign tuple_out_@EXTERN_NAME@_output_DATA  = {result_r_next,empty_buckets_r_next};
+   assign tuple_out_@EXTERN_NAME@_output_DATA  = {result_r_next,empty_buckets_r_next,dump_r_next};
 
 
 endmodule
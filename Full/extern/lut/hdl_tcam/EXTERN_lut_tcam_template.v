@@ -39,6 +39,7 @@
  * - removed the wrong CLEAR state and added clear feature 
  *   for ereasing rules (whithin SET_OP command) <- still to simulate/test
  * - removed the watchdog counter
+ * - the matching address is returned with the result (subnet classification)
  *
  */
 
@@ -53,7 +54,7 @@ module @MODULE_NAME@
     parameter ADDRESS_WIDTH = @ADDRESS_WIDTH@, 
     parameter OP_WIDTH = 2,
     parameter INPUT_WIDTH = 2*KEY_WIDTH + ADDRESS_WIDTH + VALUE_WIDTH + OP_WIDTH + 1,
-    parameter OUTPUT_WIDTH = VALUE_WIDTH+1
+    parameter OUTPUT_WIDTH = VALUE_WIDTH+ADDRESS_WIDTH+1
 )
 (
     // Data Path I/O
@@ -73,6 +74,10 @@ module @MODULE_NAME@
         [ADDRESS_WIDTH+VALUE_WIDTH+OP_WIDTH-1              : VALUE_WIDTH+OP_WIDTH                            ] : address_in
         [VALUE_WIDTH+OP_WIDTH-1                            : OP_WIDTH                                        ] : newValue_in
         [OP_WIDTH-1                                        : 0                                               ] : opCode_in
+   Tuple format for output:
+        [VALUE_WIDTH+ADDRESS_WIDTH                         : VALUE_WIDTH+ADDRESS_WIDTH                       ] : match_out
+        [VALUE_WIDTH+ADDRESS_WIDTH-1                       : ADDRESS_WIDTH                                   ] : result_out
+        [ADDRESS_WIDTH-1                                   : 0                                               ] : address_out
 */
 
 
@@ -168,6 +173,7 @@ module @MODULE_NAME@
    // state machine signals
    reg                         state_r, state_r_next;
    reg [VALUE_WIDTH-1:0]       result_out;
+   reg [ADDRESS_WIDTH-1:0]     address_out;
    reg                         match_out;
    reg                         valid_out;
    // Logic
@@ -188,6 +194,7 @@ module @MODULE_NAME@
       req_valid_cam = 0;
       // output signals
       result_out = 0;
+      address_out = 0;
       match_out = 0;
       valid_out = 0;
 
@@ -227,6 +234,7 @@ module @MODULE_NAME@
                 if(~res_null_cam) begin
                     match_out = ~res_null_cam;
                     result_out = res_data_cam;
+                    address_out = res_addr_cam;
                 end
             end
          end
@@ -243,7 +251,7 @@ module @MODULE_NAME@
    end
    
    assign tuple_out_@EXTERN_NAME@_output_VALID = valid_out;
-   assign tuple_out_@EXTERN_NAME@_output_DATA  = {match_out, result_out};
+   assign tuple_out_@EXTERN_NAME@_output_DATA  = {match_out, result_out, address_out};
 
 
 endmodule
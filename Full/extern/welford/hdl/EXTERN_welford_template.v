@@ -35,6 +35,9 @@
  *
  *  Welford Algorithm for iterative mean_r and varianceiance estimation.
  *  Added extension for an additional triggerable counter
+ *  The metrics of 2**SLOT_WIDTH independent slots are kept in distributed RAM:
+ *  the slot input selects the metrics updated, read or reset by a request
+ *  OP_READ_RESET returns the metrics of the slot and clears them in the same cycle
  *
  *  Descrioption: TODO
  *
@@ -47,8 +50,9 @@ module @MODULE_NAME@
 #(
 
     parameter DATAIN_WIDTH      = @DATAIN_WIDTH@,                   // For packet size 11 bits are enough
+    parameter SLOT_WIDTH        = @SLOT_WIDTH@,
     parameter OP_WIDTH          = 2,
-    parameter INPUT_WIDTH       = DATAIN_WIDTH + OP_WIDTH +1 /* syn_flag */ +1,
+    parameter INPUT_WIDTH       = DATAIN_WIDTH + SLOT_WIDTH + OP_WIDTH +1 /* syn_flag */ +1,
     parameter RES_SHORT_WIDTH   = @RESULT_SHORT_WIDTH@,
     //parameter RES_LONG_WIDTH    = @RESULT_LONG_WIDTH@,
     parameter OUTPUT_WIDTH      = 4*RES_SHORT_WIDTH //+ RES_LONG_WIDTH
@@ -67,6 +71,7 @@ module @MODULE_NAME@
      // Signals 
      wire                               statefulValid_fifo; 
      wire    [DATAIN_WIDTH-1:0]         newVal_fifo;
+     wire    [SLOT_WIDTH-1:0]           slot_fifo;
      wire    [OP_WIDTH-1:0]             opCode_fifo;
      wire                               syn_flag_fifo;    
      wire                               empty_fifo;
@@ -81,7 +86,7 @@ module @MODULE_NAME@
      request_fifo
      (
         // Outputs
-        .dout                           ({statefulValid_fifo, newVal_fifo, opCode_fifo, syn_flag_fifo}),
+        .dout                           ({statefulValid_fifo, newVal_fifo, slot_fifo, opCode_fifo, syn_flag_fifo}),
         .full                           (full_fifo),
         .nearly_full                    (),
         .prog_full                      (),
@@ -101,51 +106,59 @@ module @MODULE_NAME@
      
      
      //// Metric Distributed RAM
+     // Parameters
+     localparam     NUM_SLOTS = 2**SLOT_WIDTH;
      // Signals
-     reg            [RES_SHORT_WIDTH-1:0]                 syn_cnt_ram;
+     reg            [RES_SHORT_WIDTH-1:0]                 syn_cnt_ram [NUM_SLOTS-1:0];
      reg            [RES_SHORT_WIDTH-1:0]                 syn_cnt_din_ram;
      wire           [RES_SHORT_WIDTH-1:0]                 syn_cnt_dout_ram;
      reg                                                  syn_cnt_we_ram;
-     reg            [RES_SHORT_WIDTH-1:0]                 pkt_cnt_ram;
+     reg            [RES_SHORT_WIDTH-1:0]                 pkt_cnt_ram [NUM_SLOTS-1:0];
      reg            [RES_SHORT_WIDTH-1:0]                 pkt_cnt_din_ram;
      wire           [RES_SHORT_WIDTH-1:0]                 pkt_cnt_dout_ram;
      reg                                                  pkt_cnt_we_ram;
-     reg  signed    [DATAIN_WIDTH+SCALING:0]              mean_ram;     
+     reg  signed    [DATAIN_WIDTH+SCALING:0]              mean_ram [NUM_SLOTS-1:0];
      reg  signed    [DATAIN_WIDTH+SCALING:0]              mean_din_ram;
      wire signed    [DATAIN_WIDTH+SCALING:0]              mean_dout_ram;
      reg                                                  mean_we_ram;
-     reg  signed    [2*DATAIN_WIDTH+SCALING:0]            variance_ram;
+     reg  signed    [2*DATAIN_WIDTH+SCALING:0]            variance_ram [NUM_SLOTS-1:0];
      reg  signed    [2*DATAIN_WIDTH+SCALING:0]            variance_din_ram;
      wire signed    [2*DATAIN_WIDTH+SCALING:0]            variance_dout_ram;
      reg                                                  variance_we_ram;
+     // The request slot in the idle state, the registered slot while updating
+     reg            [SLOT_WIDTH-1:0]                      slot_r, slot_r_next;
+     wire           [SLOT_WIDTH-1:0]                      slot_ram;
      // Initialization
+     integer i;
      initial begin
-		syn_cnt_ram = 0;
-		pkt_cnt_ram = 0;
-		mean_ram = 0;
-		variance_ram = 0;
+        for (i = 0; i < NUM_SLOTS; i = i + 1) begin
+		    syn_cnt_ram[i] = 0;
+		    pkt_cnt_ram[i] = 0;
+		    mean_ram[i] = 0;
+		    variance_ram[i] = 0;
+		end
      end
      // Description
      always @(posedge clk_lookup) begin
         // Synchronous Update
 	    if (syn_cnt_we_ram) begin
-		    syn_cnt_ram <= syn_cnt_din_ram;
+		    syn_cnt_ram[slot_ram] <= syn_cnt_din_ram;
 	    end
 	    if (pkt_cnt_we_ram) begin
-		    pkt_cnt_ram <= pkt_cnt_din_ram;
+		    pkt_cnt_ram[slot_ram] <= pkt_cnt_din_ram;
 	    end
 	    if (mean_we_ram) begin
-		    mean_ram <= mean_din_ram;
+		    mean_ram[slot_ram] <= mean_din_ram;
 	    end
 	    if (variance_we_ram) begin
-		    variance_ram <= variance_din_ram;
+		    variance_ram[slot_ram] <= variance_din_ram;
 	    end
      end
      // Asynchronous Read
-     assign syn_cnt_dout_ram = syn_cnt_ram;
-     assign pkt_cnt_dout_ram = pkt_cnt_ram;
-     assign mean_dout_ram    = mean_ram;
-     assign variance_dout_ram      = variance_ram;
+     assign syn_cnt_dout_ram = syn_cnt_ram[slot_ram];
+     assign pkt_cnt_dout_ram = pkt_cnt_ram[slot_ram];
+     assign mean_dout_ram    = mean_ram[slot_ram];
+     assign variance_dout_ram      = variance_ram[slot_ram];
      
      
      //// Closest Power of 2 module
@@ -211,6 +224,7 @@ module @MODULE_NAME@
      localparam OP_READ      = 2'd0;
      localparam OP_UPDATE    = 2'd1;
      localparam OP_RESET     = 2'd2;
+     localparam OP_READ_RESET = 2'd3;
      // State Machine states
      localparam StIdle       = 2'd0;
      localparam StFindCP2    = 2'd1;
@@ -220,11 +234,13 @@ module @MODULE_NAME@
      reg    [1:0]   state_r,     state_r_next;
      reg            cycle_cnt_r, cycle_cnt_r_next;
      reg            valid_out;
+     assign slot_ram = (state_r == StIdle) ? slot_fifo : slot_r;
      // Logic                                                  
      always @(*) begin
          // Default FSM Signals
          state_r_next = state_r;
          cycle_cnt_r_next = cycle_cnt_r;
+         slot_r_next = slot_r;
          rd_en_fifo = 0;
          // Default Metric Updates
          syn_cnt_we_ram = 0;
@@ -258,6 +274,7 @@ module @MODULE_NAME@
                              syn_cnt_we_ram = syn_flag_fifo ? 1 : 0;
                              pkt_cnt_we_ram = 1;
                              delta1_next = scaledVal - mean_dout_ram[DATAIN_WIDTH+SCALING-1:0];
+                             slot_r_next = slot_fifo;
                              state_r_next = StFindCP2;
                          end else if (opCode_fifo == OP_RESET) begin
                              syn_cnt_we_ram = 1;
@@ -275,6 +292,21 @@ module @MODULE_NAME@
                              mean_out    = mean_dout_ram;
                              variance_out      = variance_dout_ram;
                              valid_out = 1;
+                         end else if (opCode_fifo == OP_READ_RESET) begin
+                             // Asynchronous read, the metrics are cleared at the end of the cycle
+                             syn_cnt_out = syn_cnt_dout_ram;
+                             pkt_cnt_out = pkt_cnt_dout_ram;
+                             mean_out    = mean_dout_ram;
+                             variance_out      = variance_dout_ram;
+                             syn_cnt_we_ram = 1;
+                             syn_cnt_din_ram = 0;
+                             pkt_cnt_we_ram = 1;
+                             pkt_cnt_din_ram = 0;
+                             mean_we_ram = 1;
+                             mean_din_ram = 0;
+                             variance_we_ram = 1;
+                             variance_din_ram = 0;
+                             valid_out = 1;
                          end else begin 
                              valid_out = 1;
                          end
@@ -326,6 +358,7 @@ module @MODULE_NAME@
      
      always @(posedge clk_lookup) begin
         cycle_cnt_r <= cycle_cnt_r_next;
+        slot_r <= slot_r_next;
         delta1 <= delta1_next;
         delta2 <= delta2_next;
         delta_prod_r <= delta_prod_next;
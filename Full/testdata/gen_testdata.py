@@ -33,70 +33,30 @@
 
 from southbound_headers import *
 from nf_sim_tools import *
-import random
-from collections import OrderedDict
+import random, sys
 import sss_sdnet_tuples
+import socket, struct
+import hll_model
+import welford_model
+from testdata_stream import TestdataStream, SnMTraffic
 
 ###########
 # pkt generation tools
 ###########
 
-pktsApplied = []
-pktsExpected = []
-
-# Pkt lists for SUME simulations
-nf_applied = OrderedDict()
-nf_applied[0] = []
-nf_applied[1] = []
-nf_applied[2] = []
-nf_applied[3] = []
-nf_expected = OrderedDict()
-nf_expected[0] = []
-nf_expected[1] = []
-nf_expected[2] = []
-nf_expected[3] = []
-
-nf_port_map = {"nf0":0b00000001, "nf1":0b00000100, "nf2":0b00010000, "nf3":0b01000000, "dma0":0b00000010, "none":0}
-nf_id_map = {"nf0":0, "nf1":1, "nf2":2, "nf3":3}
-
+# The packets are written as they come (testdata_stream.py)
 sss_sdnet_tuples.clear_tuple_files()
+stream = TestdataStream()
 
 def applyPkt(pkt, ingress, time):
-    pktsApplied.append(pkt)
-    sss_sdnet_tuples.sume_tuple_in['pkt_len'] = len(pkt)
-    sss_sdnet_tuples.sume_tuple_in['src_port'] = nf_port_map[ingress]
-    sss_sdnet_tuples.sume_tuple_expect['pkt_len'] = len(pkt)
-    sss_sdnet_tuples.sume_tuple_expect['src_port'] = nf_port_map[ingress]
-    pkt.time = time
-    nf_applied[nf_id_map[ingress]].append(pkt)
+    stream.apply(pkt, ingress, time)
 
 def expPkt(pkt, egress):
-    pktsExpected.append(pkt)
-    sss_sdnet_tuples.sume_tuple_expect['dst_port'] = nf_port_map[egress]
-    sss_sdnet_tuples.write_tuples()
-    if egress in ["nf0","nf1","nf2","nf3"]:
-        nf_expected[nf_id_map[egress]].append(pkt)
-    elif egress == 'bcast':
-        nf_expected[0].append(pkt)
-        nf_expected[1].append(pkt)
-        nf_expected[2].append(pkt)
-        nf_expected[3].append(pkt)
+    stream.expect(pkt, egress)
 
 
 def write_pcap_files():
-    wrpcap("src.pcap", pktsApplied)
-    wrpcap("dst.pcap", pktsExpected)
-
-    for i in nf_applied.keys():
-        if (len(nf_applied[i]) > 0):
-            wrpcap('nf{0}_applied.pcap'.format(i), nf_applied[i])
-
-    for i in nf_expected.keys():
-        if (len(nf_expected[i]) > 0):
-            wrpcap('nf{0}_expected.pcap'.format(i), nf_expected[i])
-
-    for i in nf_applied.keys():
-        print "nf{0}_applied times: ".format(i), [p.time for p in nf_applied[i]]
+    stream.close()
 
 #####################
 # generate testdata #
@@ -344,41 +304,59 @@ expPkt(pkt, "nf3")
 
 
 # TCP traffic
-# Traffic on port 1
+# Traffic on port 1: the ip_list test, or SNM_COUNT random packets
+# generated on the fly (python gen_testdata.py <count>)
+SNM_COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 0
 HEADER_SIZE = 54
-for i in range(len(ip_list)):
-    if (i%5 == 0):
-        pkt = Ether(dst=MAC1, src=MAC2) / IP(dst=ip_list[i], src='10.45.216.75') / TCP(sport=port_list[i], dport=dport1, flags='S')
-    else:
-        pkt = Ether(dst=MAC1, src=MAC2) / IP(dst=ip_list[i], src='10.45.216.75') / TCP(sport=port_list[i], dport=dport1, flags=0)
-    pkt = pad_pkt(pkt, size_list[i]+HEADER_SIZE)
-    applyPkt(pkt,"nf3",pkt_cnt)
-    pkt_cnt += 1
-    expPkt(pkt, "none")
+if SNM_COUNT:
+    traffic = SnMTraffic(SNM_COUNT, dport1, eth_dst=MAC1, eth_src=MAC2)
+    stream.time = pkt_cnt
+    stream.run(traffic.steps())
+    pkt_cnt = stream.time
+    query_time = pkt_cnt
+else:
+    for i in range(len(ip_list)):
+        if (i%5 == 0):
+            pkt = Ether(dst=MAC1, src=MAC2) / IP(dst=ip_list[i], src='10.45.216.75') / TCP(sport=port_list[i], dport=dport1, flags='S')
+        else:
+            pkt = Ether(dst=MAC1, src=MAC2) / IP(dst=ip_list[i], src='10.45.216.75') / TCP(sport=port_list[i], dport=dport1, flags=0)
+        pkt = pad_pkt(pkt, size_list[i]+HEADER_SIZE)
+        applyPkt(pkt,"nf3",pkt_cnt)
+        pkt_cnt += 1
+        expPkt(pkt, "none")
+    query_time = len(ip_list)
 
 
 #####################
 ### Check Metrics ###
 #####################
 
+# Expected replies from the extern reference models
+if SNM_COUNT:
+    dst_ip_card, src_ports_card, counters = traffic.replies()
+else:
+    dst_ip_card = hll_model.hll_reply([struct.unpack('!I', socket.inet_aton(ip))[0] for ip in ip_list], datain_width=hll_model.IP_ADDR_WIDTH)
+    src_ports_card = hll_model.hll_reply(port_list[:len(ip_list)], datain_width=hll_model.TCP_PORT_WIDTH)
+    counters = welford_model.welford_reply(size_list[:len(ip_list)], [i%5 == 0 for i in range(len(ip_list))])
+
 pkt = Ether(dst=MAC3, src=SERVER_MAC) / IP(dst=SBI_DEST_IP , src=CONTROLLER_IP) / Southbound(ControllerID=CONTROLLER_ID , SwitchID=31) / SouthboundMetric(metricID=DST_IP_CARD)
 pkt = pad_pkt(pkt, 300)
-applyPkt(pkt,"nf3",len(ip_list)+1)
-pkt = Ether(dst=MAC3, src=SERVER_MAC) / IP(dst=SBI_DEST_IP , src=CONTROLLER_IP) / Southbound(ControllerID=CONTROLLER_ID , SwitchID=31, ACK=1) / SouthboundMetric(metricID=DST_IP_CARD, result1 = 257312)
+applyPkt(pkt,"nf3",query_time+1)
+pkt = Ether(dst=MAC3, src=SERVER_MAC) / IP(dst=SBI_DEST_IP , src=CONTROLLER_IP) / Southbound(ControllerID=CONTROLLER_ID , SwitchID=31, ACK=1) / SouthboundMetric(metricID=DST_IP_CARD, result1=dst_ip_card[0], result2=dst_ip_card[1])
 pkt = pad_pkt(pkt, 300)
 expPkt(pkt, "nf3")
 
 pkt = Ether(dst=MAC3, src=SERVER_MAC) / IP(dst=SBI_DEST_IP , src=CONTROLLER_IP) / Southbound(ControllerID=CONTROLLER_ID , SwitchID=31) / SouthboundMetric(metricID=SRC_PORTS_CARD)
 pkt = pad_pkt(pkt, 300)
-applyPkt(pkt,"nf3",len(ip_list)+2)
-pkt = Ether(dst=MAC3, src=SERVER_MAC) / IP(dst=SBI_DEST_IP , src=CONTROLLER_IP) / Southbound(ControllerID=CONTROLLER_ID , SwitchID=31, ACK=1) / SouthboundMetric(metricID=SRC_PORTS_CARD, result1 = 291336, result2=1)
+applyPkt(pkt,"nf3",query_time+2)
+pkt = Ether(dst=MAC3, src=SERVER_MAC) / IP(dst=SBI_DEST_IP , src=CONTROLLER_IP) / Southbound(ControllerID=CONTROLLER_ID , SwitchID=31, ACK=1) / SouthboundMetric(metricID=SRC_PORTS_CARD, result1=src_ports_card[0], result2=src_ports_card[1])
 pkt = pad_pkt(pkt, 300)
 expPkt(pkt, "nf3")
 
 pkt = Ether(dst=MAC3, src=SERVER_MAC) / IP(dst=SBI_DEST_IP , src=CONTROLLER_IP) / Southbound(ControllerID=CONTROLLER_ID , SwitchID=31) / SouthboundMetric(metricID=COUNTERS)
 pkt = pad_pkt(pkt, 300)
-applyPkt(pkt,"nf3",len(ip_list)+3)
-pkt = Ether(dst=MAC3, src=SERVER_MAC) / IP(dst=SBI_DEST_IP , src=CONTROLLER_IP) / Southbound(ControllerID=CONTROLLER_ID , SwitchID=31, ACK=1) / SouthboundMetric( metricID=COUNTERS, result1=160, result2=800, result3=473, result4=20580 )  # std = result4<<2 (we use 20 bits instead of 22)
+applyPkt(pkt,"nf3",query_time+3)
+pkt = Ether(dst=MAC3, src=SERVER_MAC) / IP(dst=SBI_DEST_IP , src=CONTROLLER_IP) / Southbound(ControllerID=CONTROLLER_ID , SwitchID=31, ACK=1) / SouthboundMetric( metricID=COUNTERS, result1=counters[0], result2=counters[1], result3=counters[2], result4=counters[3] )  # std = result4<<2 (we use 20 bits instead of 22)
 pkt = pad_pkt(pkt, 300)
 expPkt(pkt, "nf3")
 
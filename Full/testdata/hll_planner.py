@@ -0,0 +1,225 @@
+#
+# Copyright (c) 2022 Mario Patetta, Conservatoire National des Arts et Metiers
+# All rights reserved.
+#
+# SBI_engine is free software: you can redistribute it and/or modify it under the terms of
+# the GNU Affero General Public License as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# SBI_engine is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+#
+# HyperLogLog parameter sweep and planner (BUCKET_INDEX_WIDTH and
+# BUCKET_CONTENT_WIDTH of SnM_metrics.p4).
+#
+# Every (index width, content width) pair the extern can be built with is run
+# through the bit-accurate model (hll_model.py) on synthetic key sets
+# (synth_traffic.py, several seeds per cardinality) and on the src IP, dst IP
+# and src port sets of real traces. The estimate is the one of the controller
+# (snm_pipeline.hll_cardinality) on the wrapped RESULT_SHORT-bit reply. Each
+# pair gets:
+#   rms_error / max_error   relative error of the estimates
+#   sources                 rms error of each cardinality / trace key set:
+#                           a wrapped sum fails the small sets, narrow
+#                           buckets saturate on the large ones (inf: the
+#                           reciprocals of the saturated buckets sum to 0)
+#   result_bits             width of the sum of 2**index_width reciprocals:
+#                           above RESULT_SHORT the reply wraps when most
+#                           buckets are small
+#   bram_bits / bram18      rarity BRAM of the three HLL externs, all the
+#                           SKETCH_INDEX_WIDTH sketch slots included
+#   read_latency            cycles from the request to the READ reply: input
+#                           FIFO, StIdle, the 2**index_width StComputeSum
+#                           sweep and two StWriteResult cycles, i.e.
+#                           2**BUCKET_INDEX_WIDTH + 4 (132 with the current
+#                           widths: the @Xilinx_MaxLatency(36) of
+#                           SnM_metrics.p4 is below it). READ is the longest
+#                           operation.
+# The plan is the pair with the fewest BRAM bits (then the lowest latency)
+# whose sum fits in the RESULT_SHORT-bit reply and whose rms and max errors
+# are within the budget; its #defines and extern annotations are printed. A
+# wrapping pair is never planned, even when its errors on the sets happen to
+# be within the budget: its reply is ambiguous.
+#
+# Usage: python hll_planner.py [--budget 0.1] [--cardinalities 10,100,1000] [--trials N] [<trace.pcap> ...]
+#
+
+import json, argparse
+import numpy as np
+
+import hll_model, snm_pipeline, synth_traffic
+
+INDEX_WIDTHS        = range(4, 11)
+CONTENT_WIDTHS      = (2, 3, 4)
+CARDINALITIES       = (10, 100, 1000, 10**4, 10**5, 10**6)
+TRIALS              = 3
+BUDGET              = 0.1
+RESULT_SHORT        = 20
+HLL_DUMP_WIDTH      = 80
+SKETCH_INDEX_WIDTH  = snm_pipeline.SKETCH_INDEX_WIDTH
+HLL_EXTERNS         = 3
+FIFO_LATENCY        = 1
+# BRAM18 aspect ratios (depth, width)
+BRAM18_SHAPES       = ((16384, 1), (8192, 2), (4096, 4), (2048, 9), (1024, 18), (512, 36))
+
+
+def infeasible(index_width, content_width):
+    # Why the extern cannot be built with these widths, None if it can
+    hash_width = index_width + hll_model.rarity_hash_width(content_width)
+    if hash_width > hll_model.MULT_WORD_SIZE:
+        return "HASH_WIDTH {0} > {1}-bit multiplier word".format(hash_width, hll_model.MULT_WORD_SIZE)
+    if int(np.ceil(np.log2(hll_model.rarity_hash_width(content_width)))) > content_width:
+        return "leading one position does not fit in a bucket"
+    if HLL_DUMP_WIDTH < content_width:
+        return "bucket wider than the dump"
+    return None
+
+
+def result_bits(index_width, content_width):
+    # Bits of the largest sum: every bucket empty
+    largest = (1 << index_width) * (1 << (hll_model.rarity_hash_width(content_width) - 1))
+    return int(largest).bit_length()
+
+
+def latencies(index_width, content_width):
+    # Cycles from the request to the reply of each operation (EXTERN_hyperloglog_template.v)
+    dump_buckets = HLL_DUMP_WIDTH // content_width
+    return {'update':   FIFO_LATENCY + 1 + 2,
+            'read':     FIFO_LATENCY + 1 + 2**index_width + 2,
+            'reset':    FIFO_LATENCY + 1 + 2**index_width,
+            'dump':     FIFO_LATENCY + 1 + dump_buckets + 1}
+
+
+def bram_bits(index_width, content_width, slot_width=SKETCH_INDEX_WIDTH):
+    return HLL_EXTERNS * 2**(slot_width + index_width) * content_width
+
+
+def bram18(index_width, content_width, slot_width=SKETCH_INDEX_WIDTH):
+    # BRAM18 primitives of the three rarity BRAMs
+    depth = 2**(slot_width + index_width)
+    per_extern = min(-(-depth // shape_depth) * -(-content_width // shape_width) for shape_depth, shape_width in BRAM18_SHAPES)
+    return HLL_EXTERNS * per_extern
+
+
+def estimate(keys, datain_width, index_width, content_width):
+    # Controller estimate of the reply of a sketch fed with keys
+    hll = hll_model.HyperLogLogModel(datain_width, index_width, content_width, RESULT_SHORT)
+    hll.update(keys)
+    result, empty_buckets = hll.read()
+    if result == 0:
+        if np.count_nonzero(hll.buckets == 0) == hll.num_buckets:
+            # Every bucket empty: the sum of an empty sketch wrapped to 0,
+            # which the controller takes for the reset reply
+            return 0.0
+        # The sum of a non-empty sketch wrapped to 0
+        return float('inf')
+    return snm_pipeline.hll_cardinality(result, empty_buckets, index_width, content_width)
+
+
+def synthetic_sets(cardinalities=CARDINALITIES, trials=TRIALS, seed=0):
+    # (source, datain width, keys): random IPv4 and tcp port sets
+    for cardinality in cardinalities:
+        for trial in range(trials):
+            rng = np.random.default_rng([seed, cardinality, trial])
+            source = 'synthetic:{0}'.format(cardinality)
+            yield (source, hll_model.IP_ADDR_WIDTH, synth_traffic.population(rng, cardinality))
+            if cardinality <= synth_traffic.SOURCE_PORTS:
+                yield (source, hll_model.TCP_PORT_WIDTH, synth_traffic.population(rng, cardinality, None))
+
+
+def trace_sets(paths, dport=None):
+    # The src IP, dst IP and src port sets of the TCP packets of traces (to dport)
+    for path in paths:
+        packets = snm_pipeline.read_pcap(path)
+        selected = packets['is_tcp'] if dport is None else packets['is_tcp'] & (packets['dport'] == dport)
+        packets = snm_pipeline.select(packets, selected)
+        for name, width in (('src', hll_model.IP_ADDR_WIDTH), ('dst', hll_model.IP_ADDR_WIDTH),
+                            ('sport', hll_model.TCP_PORT_WIDTH)):
+            keys = np.unique(packets[name])
+            if len(keys):
+                yield (path + ":" + name, width, keys)
+
+
+def configurations(index_widths=INDEX_WIDTHS, content_widths=CONTENT_WIDTHS):
+    return [(index_width, content_width) for content_width in content_widths for index_width in index_widths
+            if infeasible(index_width, content_width) is None]
+
+
+def sweep(sets, configs):
+    # One row per configuration: resources and the relative errors over the
+    # sets, and the rms error of each source (synthetic cardinality or trace)
+    sets = list(sets)
+    rows = []
+    for index_width, content_width in configs:
+        errors = []
+        by_source = {}
+        for source, datain_width, keys in sets:
+            exact = len(np.unique(keys))
+            errors.append((estimate(keys, datain_width, index_width, content_width) - exact) / float(exact))
+            by_source.setdefault(source, []).append(errors[-1])
+        errors = np.array(errors)
+        rows.append({'index_width':     index_width,
+                     'content_width':   content_width,
+                     'rms_error':       float(np.sqrt(np.mean(errors ** 2))),
+                     'max_error':       float(np.max(np.abs(errors))),
+                     'result_bits':     result_bits(index_width, content_width),
+                     'wraps':           result_bits(index_width, content_width) > RESULT_SHORT,
+                     'bram_bits':       bram_bits(index_width, content_width),
+                     'bram18':          bram18(index_width, content_width),
+                     'read_latency':    latencies(index_width, content_width)['read'],
+                     'sources':         dict((source, float(np.sqrt(np.mean(np.square(values)))))
+                                             for source, values in by_source.items())})
+    return rows
+
+
+def plan(rows, budget=BUDGET):
+    # Cheapest row whose reply does not wrap, within the error budget, None if there is none
+    within = [row for row in rows if not row['wraps'] and row['rms_error'] <= budget and row['max_error'] <= budget]
+    if not within:
+        return None
+    return min(within, key=lambda row: (row['bram_bits'], row['read_latency']))
+
+
+def p4_snippet(index_width, content_width):
+    # SnM_metrics.p4 lines of a configuration
+    latency = latencies(index_width, content_width)['read']
+    lines = ["#define BUCKET_INDEX_WIDTH      {0}".format(index_width),
+             "#define BUCKET_CONTENT_WIDTH    {0}".format(content_width),
+             "",
+             "@HyperLogLogBucketContentWidth(BUCKET_CONTENT_WIDTH)",
+             "@Xilinx_MaxLatency({0}) // 2**BUCKET_INDEX_WIDTH +4".format(latency)]
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HyperLogLog width sweep and planner")
+    parser.add_argument('pcaps', nargs='*', help="traces whose key sets join the synthetic ones")
+    parser.add_argument('--budget', type=float, default=BUDGET, help="largest rms and max relative error")
+    parser.add_argument('--cardinalities', default=','.join(str(c) for c in CARDINALITIES))
+    parser.add_argument('--trials', type=int, default=TRIALS)
+    parser.add_argument('--dport', type=int, default=None, help="only the packets of the traces to this port")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help="one JSON line per configuration")
+    args = parser.parse_args()
+
+    cardinalities = [int(float(value)) for value in args.cardinalities.split(",")]
+    sets = list(synthetic_sets(cardinalities, args.trials, args.seed)) + list(trace_sets(args.pcaps, args.dport))
+    rows = sweep(sets, configurations())
+    for row in rows:
+        if args.json:
+            print(json.dumps(row, sort_keys=True))
+        else:
+            print("B={index_width:2d} C={content_width}  rms={rms_error:7.3f}  max={max_error:8.3f}  "
+                  "result={result_bits:2d}b{wrap}  bram={bram_bits:8d}b ({bram18:3d} BRAM18)  "
+                  "read={read_latency:4d} cycles".format(wrap="*" if row['wraps'] else " ", **row))
+    best = plan(rows, args.budget)
+    if best is None:
+        print("No configuration within a {0} relative error".format(args.budget))
+    else:
+        print("\n" + p4_snippet(best['index_width'], best['content_width']))
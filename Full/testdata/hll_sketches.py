@@ -0,0 +1,184 @@
+#
+# Copyright (c) 2022 Mario Patetta, Conservatoire National des Arts et Metiers
+# All rights reserved.
+#
+# SBI_engine is free software: you can redistribute it and/or modify it under the terms of
+# the GNU Affero General Public License as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# SBI_engine is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+#
+# Controller-side store of raw HyperLogLog sketches.
+#
+# read_sketch() dumps the 2**BUCKET_INDEX_WIDTH buckets of a sketch with the
+# *_BUCKETS metrics (HLL_DUMP_BUCKETS buckets per reply). SketchStore keeps
+# the sketches as rows of a uint8 matrix, keyed by any tuple, e.g.
+# (metric_id, tcp_port, date, subnet, switch_id). Sketches of the same hash
+# function are merged with an element-wise max: the union of the measured
+# sets, so weekly, per-/8 or multi-switch cardinalities come from the stored
+# sketches without replaying the traces. On disk, two buckets share a byte.
+#
+# Usage: python hll_sketches.py <sketches.npz>
+#
+
+import os, sys, json, asyncio
+import numpy as np
+
+from southbound_headers import *
+sys.path.append(os.path.expandvars('../../Simple/hw_test/'))
+from sb_controller import SBITimeout
+
+BUCKET_INDEX_WIDTH      = 7
+BUCKET_CONTENT_WIDTH    = 4
+NUM_BUCKETS             = 2**BUCKET_INDEX_WIDTH
+RESULT_WIDTH            = 20
+DUMP_ATTEMPTS           = 4
+SETTLE_TIMEOUTS         = 4                                         # wait before a new dump, in controller timeouts
+
+# Dump metric of each cardinality metric
+BUCKETS_METRIC = {SRC_IP_CARD: SRC_IP_BUCKETS, DST_IP_CARD: DST_IP_BUCKETS, SRC_PORTS_CARD: SRC_PORTS_BUCKETS}
+
+
+def unpack_reply(results):
+    # (result1, .., result4) of a *_BUCKETS reply -> HLL_DUMP_BUCKETS buckets
+    word = 0
+    for result in reversed(results[:4]):
+        word = (word << RESULT_WIDTH) | result
+    return np.array([(word >> (BUCKET_CONTENT_WIDTH * i)) & (2**BUCKET_CONTENT_WIDTH - 1)
+                     for i in range(HLL_DUMP_BUCKETS)], dtype=np.uint8)
+
+
+async def read_sketch(controller, metric_id, attempts=DUMP_ATTEMPTS, **kwargs):
+    # The buckets of a cardinality metric (sb_controller.SBIController), e.g.
+    # read_sketch(controller, SRC_IP_CARD, subnet=1, slot=0)
+    # The base bucket goes in result1, which the switch overwrites: the
+    # requests of a dump share one match key and the controller pairs them
+    # with their ACKs in order only. A retransmitted request could then take
+    # the late ACK of the previous one, so the requests are sent one at a
+    # time and never retransmitted. On a timeout the whole dump starts again,
+    # once the late ACK of the abandoned request had the time to arrive while
+    # nothing waits for it (the controller drops it as unmatched).
+    for attempt in range(attempts):
+        try:
+            replies = []
+            for base in range(0, NUM_BUCKETS, HLL_DUMP_BUCKETS):
+                replies.append(await controller.query(BUCKETS_METRIC[metric_id], result1=base, retries=0, **kwargs))
+            return np.concatenate([unpack_reply(reply) for reply in replies])[:NUM_BUCKETS]
+        except SBITimeout:
+            if attempt == attempts - 1:
+                raise
+            await asyncio.sleep(controller.timeout * SETTLE_TIMEOUTS)
+
+
+def estimate(buckets):
+    # HyperLogLog estimate of each row (HyperLogLogResult() of SnM_test_receive.py)
+    buckets = np.atleast_2d(np.asarray(buckets, dtype=np.uint8))
+    m = buckets.shape[1]
+    am = 0.7213 / (1 + (1.079 / m))
+    estimate = am * m**2 / np.sum(np.ldexp(1.0, -buckets.astype(np.int64)), axis=1)
+    empty = np.count_nonzero(buckets == 0, axis=1)
+    # Linear counting for low cardinalities
+    small = (estimate < 2.5 * m) & (empty != 0)
+    estimate[small] = m * np.log(float(m) / empty[small])
+    estimate[empty == m] = 0
+    return estimate
+
+
+def pack_nibbles(buckets):
+    return (buckets[:, 0::2] | (buckets[:, 1::2] << BUCKET_CONTENT_WIDTH)).astype(np.uint8)
+
+
+def unpack_nibbles(packed):
+    buckets = np.empty((packed.shape[0], 2 * packed.shape[1]), dtype=np.uint8)
+    buckets[:, 0::2] = packed & (2**BUCKET_CONTENT_WIDTH - 1)
+    buckets[:, 1::2] = packed >> BUCKET_CONTENT_WIDTH
+    return buckets
+
+
+class SketchStore(object):
+
+    def __init__(self, num_buckets=NUM_BUCKETS):
+        self.num_buckets = num_buckets
+        self.keys = []
+        self.index = {}
+        self.buckets = np.zeros((0, num_buckets), dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return tuple(key) in self.index
+
+    def add(self, key, buckets):
+        # Store a sketch, max-merged with the one already stored under key
+        key = tuple(key)
+        buckets = np.asarray(buckets, dtype=np.uint8)
+        if key in self.index:
+            row = self.index[key]
+            np.maximum(self.buckets[row], buckets, out=self.buckets[row])
+            return
+        if len(self.keys) == len(self.buckets):
+            grown = np.zeros((max(16, 2 * len(self.buckets)), self.num_buckets), dtype=np.uint8)
+            grown[:len(self.buckets)] = self.buckets
+            self.buckets = grown
+        self.index[key] = len(self.keys)
+        self.buckets[len(self.keys)] = buckets
+        self.keys.append(key)
+
+    def get(self, key):
+        return self.buckets[self.index[tuple(key)]]
+
+    def merge(self, keys):
+        # Union of the sketches of keys (an iterable of keys, or a predicate on a key)
+        if callable(keys):
+            keys = [key for key in self.keys if keys(key)]
+        rows = [self.index[tuple(key)] for key in keys]
+        if not rows:
+            return np.zeros(self.num_buckets, dtype=np.uint8)
+        return np.max(self.buckets[rows], axis=0)
+
+    def group(self, by):
+        # {by(key): union of the sketches of the keys mapped to it}
+        if not self.keys:
+            return {}
+        groups = [by(key) for key in self.keys]
+        names = sorted(set(groups), key=repr)
+        group_id = dict((name, i) for i, name in enumerate(names))
+        ids = np.array([group_id[group] for group in groups])
+        order = np.argsort(ids, kind='stable')
+        first = np.searchsorted(ids[order], np.arange(len(names)))
+        merged = np.maximum.reduceat(self.buckets[:len(self.keys)][order], first, axis=0)
+        return dict(zip(names, merged))
+
+    def cardinalities(self, by=None):
+        # {key (or by(key)): estimate}
+        if by is None:
+            return dict(zip(self.keys, estimate(self.buckets[:len(self.keys)]).tolist()))
+        groups = self.group(by)
+        return dict(zip(groups, estimate(np.array(list(groups.values()))).tolist()))
+
+    def save(self, path):
+        np.savez_compressed(path, keys=np.array(json.dumps(self.keys)),
+                            buckets=pack_nibbles(self.buckets[:len(self.keys)]))
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        buckets = unpack_nibbles(data['buckets'])
+        store = cls(buckets.shape[1])
+        for key, row in zip(json.loads(str(data['keys'])), buckets):
+            store.add(key, row)
+        return store
+
+
+if __name__ == "__main__":
+    store = SketchStore.load(sys.argv[1])
+    for key, cardinality in sorted(store.cardinalities().items(), key=repr):
+        print(key, "{0:.1f}".format(cardinality))
@@ -0,0 +1,151 @@
+#
+# Copyright (c) 2022 Mario Patetta, Conservatoire National des Arts et Metiers
+# All rights reserved.
+#
+# SBI_engine is free software: you can redistribute it and/or modify it under the terms of
+# the GNU Affero General Public License as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# SBI_engine is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+#
+# Trace-scale check of the routing tables before they are pushed.
+#
+# The tables are loaded in the RoutingStage model of snm_pipeline.py (SBI cam,
+# dstIP / srcIP tcams, srcPort / dstPort cams, with the precedence of the
+# routing decision) and whole traces, or arrays of (srcIP, dstIP, sport,
+# dport) tuples, are routed by chunks of CHUNK packets. route_counts() returns
+# a Counter:
+#   packets         packets routed (Southbound frames bounced by the switch excluded)
+#   nf0 .. nf3      packets sent on each interface (a multicast counts on each)
+#   egress_0bXXXX   packets of each 4-bit egress port
+#   dropped         packets with egress port NONE, either
+#   no_route        without a match in any table, or
+#   blacklisted     matched, the last match routing to NONE: a dstPort entry
+#                   to NONE drops the port whatever the IP tables say
+#                   (gen_testdata.py blacklists tcp port 2322 this way)
+#   unmatched_X     packets without a match in table X (sbi: among the
+#                   Southbound frames in transit, counted in sb_transit)
+#   bounced         Southbound frames addressed to the switch (switch_id)
+# The counts of several traces add up; rates() gives the unmatched rates.
+#
+# Usage: python routing_check.py [--dst-routes routes.csv] [--src-routes routes.csv]
+#                                [--dst-port 2322=none] [--src-port P=nf1] [--sbi ID=nf3]
+#                                [--switch-id N] <trace.pcap> [<trace.pcap> ...]
+#
+
+import time, argparse, ipaddress, collections
+import numpy as np
+
+import snm_pipeline, tcam_compiler
+
+CHUNK           = 1 << 20
+INTERFACES      = (('nf0', 0b0001), ('nf1', 0b0010), ('nf2', 0b0100), ('nf3', 0b1000))
+TABLES          = ('sbi', 'dst_ip', 'src_ip', 'src_port', 'dst_port')
+
+
+def tuples(src, dst, sport, dport, is_tcp=True):
+    # Packets (see snm_pipeline.read_pcap) of arrays of integer tuples
+    src = np.asarray(src, dtype=np.uint32)
+    return {'src':      src,
+            'dst':      np.asarray(dst, dtype=np.uint32),
+            'sport':    np.asarray(sport, dtype=np.uint32),
+            'dport':    np.asarray(dport, dtype=np.uint32),
+            'is_tcp':   np.broadcast_to(np.asarray(is_tcp, dtype=bool), src.shape)}
+
+
+def load_tables(pipeline, dst_entries=(), src_entries=(), src_ports=None, dst_ports=None, sbi=None):
+    # IP tcam entries of tcam_compiler.compile_routes, cam tables {key: port}
+    # (sbi keys {ACK, SwitchID}) written from address 0
+    for table, entries in ((pipeline.dst_ip_table, dst_entries), (pipeline.src_ip_table, src_entries)):
+        for entry in entries:
+            table.update(entry['address'], int(ipaddress.IPv4Address(entry['key'])), entry['port'], entry['mask'])
+    for table, cam in ((pipeline.src_port_table, src_ports), (pipeline.dst_port_table, dst_ports), (pipeline.sbi_table, sbi)):
+        for address, key in enumerate(sorted(cam or {})):
+            table.update(address, key, cam[key])
+
+
+def route_counts(pipeline, packets, switch_id=None, chunk=CHUNK):
+    # Routing Counter of the packets, CHUNK at a time
+    counts = collections.Counter()
+    for start in range(0, len(packets['src']), chunk):
+        part = dict((name, values[start:start + chunk]) for name, values in packets.items())
+        if 'is_sb' in part:
+            addressed = part['is_sb'] & ((part['sbi_key'] & 0xff) == switch_id) if switch_id is not None else \
+                        np.zeros(len(part['src']), dtype=bool)
+            counts['bounced'] += int(np.count_nonzero(addressed))
+            part = snm_pipeline.select(part, ~addressed)
+            counts['sb_transit'] += int(np.count_nonzero(part['is_sb']))
+        egress, subnet, matches = pipeline.routing_decision(part)
+        counts['packets'] += len(egress)
+        for port, n in zip(*np.unique(egress, return_counts=True)):
+            counts['egress_0b{0:04b}'.format(port)] += int(n)
+        for name, bit in INTERFACES:
+            counts[name] += int(np.count_nonzero(egress & bit))
+        matched = np.zeros(len(egress), dtype=bool)
+        for name, match in matches.items():
+            matched |= match
+            scope = part['is_sb'] if name == 'sbi' else True
+            counts['unmatched_' + name] += int(np.count_nonzero(~match & scope))
+        dropped = egress == 0
+        counts['dropped'] += int(np.count_nonzero(dropped))
+        counts['no_route'] += int(np.count_nonzero(dropped & ~matched))
+        counts['blacklisted'] += int(np.count_nonzero(dropped & matched))
+    return counts
+
+
+def rates(counts):
+    # {table: unmatched rate}, and the drop rate
+    result = {}
+    for name in TABLES:
+        total = counts['sb_transit'] if name == 'sbi' else counts['packets']
+        if total:
+            result[name] = counts['unmatched_' + name] / float(total)
+    if counts['packets']:
+        result['dropped'] = counts['dropped'] / float(counts['packets'])
+    return result
+
+
+def cam_option(values):
+    # {key: port} of KEY=PORT options
+    cam = {}
+    for value in values:
+        key, port = value.split("=")
+        cam[int(key, 0)] = tcam_compiler.parse_port(port)
+    return cam
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Route traces through the RoutingStage model")
+    parser.add_argument('pcaps', nargs='+')
+    parser.add_argument('--dst-routes', default=None, help="dstIP routes CSV (tcam_compiler.py)")
+    parser.add_argument('--src-routes', default=None, help="srcIP routes CSV (tcam_compiler.py)")
+    parser.add_argument('--dst-port', action='append', default=[], help="dstPort cam entry TCP_PORT=PORT")
+    parser.add_argument('--src-port', action='append', default=[], help="srcPort cam entry TCP_PORT=PORT")
+    parser.add_argument('--sbi', action='append', default=[], help="SBI cam entry KEY=PORT, KEY is {ACK, SwitchID}")
+    parser.add_argument('--switch-id', type=int, default=None, help="ID of the switch: its Southbound frames are bounced")
+    args = parser.parse_args()
+
+    pipeline = snm_pipeline.SnMPipeline()
+    routes = [tcam_compiler.compile_routes(tcam_compiler.read_routes(path)) if path else []
+              for path in (args.dst_routes, args.src_routes)]
+    load_tables(pipeline, routes[0], routes[1], cam_option(args.src_port), cam_option(args.dst_port), cam_option(args.sbi))
+    counts = collections.Counter()
+    elapsed = 0.0
+    for path in args.pcaps:
+        packets = snm_pipeline.read_pcap(path)
+        start = time.time()
+        counts += route_counts(pipeline, packets, args.switch_id)
+        elapsed += time.time() - start
+    for name in sorted(counts):
+        print("{0:<20} {1}".format(name, counts[name]))
+    for name, rate in sorted(rates(counts).items()):
+        print("{0:<20} {1:.4%}".format(name + " rate", rate))
+    if elapsed > 0:
+        print("{0:.0f} packets/s".format(counts['packets'] / elapsed))
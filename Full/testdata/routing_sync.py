@@ -0,0 +1,251 @@
+#
+# Copyright (c) 2022 Mario Patetta, Conservatoire National des Arts et Metiers
+# All rights reserved.
+#
+# SBI_engine is free software: you can redistribute it and/or modify it under the terms of
+# the GNU Affero General Public License as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# SBI_engine is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+#
+# Incremental routing table sync.
+#
+# ShadowTable mirrors one routing table of the switch (SBI cam, dstIP/srcIP
+# tcams, srcPort/dstPort cams): the entry written at every address. sync()
+# brings the switch to a desired table {key: port} with only the writes that
+# differ, in an order where every lookup returns either its old or its new
+# result while the writes go on:
+#   1. adds, most specific entry first, at free addresses that keep the
+#      priority order (highest matching address wins) against the old
+#      entries still in place
+#   2. modifies (same key, new port), in place
+#   3. deletes, least specific entry first
+# The tables have no per-entry delete: a deleted entry is parked, i.e.
+# overwritten with PARKED_KEY and port NONE (0.0.0.0/32 as in snm_subnets.py;
+# key 0 on the cams, tcp port 0 and SwitchID 0 are never routed). Every write
+# is confirmed with a check request on its key (a delete on the deleted key),
+# whose port and check_match must be those of the shadow. When no free
+# address keeps the priority order, sync() raises TableFull before any write:
+# rewriting the table in place would overwrite entries other keys still
+# fall back on, and the caller decides (e.g. aggregate the routes with
+# tcam_compiler.py). There is no LUT_RESET: it clears the whole tcam, the S&M
+# subnet entries above the addresses of the shadow included.
+#
+# The subnet entries (snm_subnets.py) are not managed by the shadow, but they
+# answer the check requests of the keys they cover: reserve() gives them to
+# the shadow of each IP table, whose lookups then see them.
+#
+# The tcam entries are prefixes: a key is (network, mask) with the mask bits
+# don't care bits, as in tcam_compiler.py; the cam keys are integers, the
+# SBI key being {ACK, SwitchID}.
+#
+#   shadows = routing_shadows()
+#   await sync(sbi, shadows['dst_ip'], ip_routes({"10.0.0.0/8": NF1}))
+#
+
+import ipaddress, collections
+
+from southbound_headers import *
+import tcam_compiler
+
+IP_ADDRESS_WIDTH    = 7
+ID_ADDRESS_WIDTH    = 4
+TCP_ADDRESS_WIDTH   = 4
+IP_WIDTH            = 32
+PARKED_KEY          = 0
+
+# Write operation: kind is 'add', 'modify' or 'delete'
+Op = collections.namedtuple('Op', ['kind', 'address', 'key', 'port'])
+
+
+class SyncError(Exception):
+    pass
+
+
+class TableFull(Exception):
+    pass
+
+
+def ip_routes(routes):
+    # Desired tcam table {(network, mask): port} of a route set (see tcam_compiler.py)
+    return dict(((network, tcam_compiler.IP_MASK & ~tcam_compiler.prefix_mask(length)), port)
+                for (network, length), port in tcam_compiler.aggregate(routes).items())
+
+
+def care_bits(key):
+    network, mask = key
+    return IP_WIDTH - bin(mask).count('1')
+
+
+def contains(outer, inner):
+    # outer matches every address inner matches, and more
+    return outer[1] != inner[1] and (outer[1] & inner[1]) == inner[1] and ((outer[0] ^ inner[0]) & ~outer[1]) == 0
+
+
+class ShadowTable(object):
+
+    def __init__(self, layer, address_width, ternary=False, addresses=None):
+        self.layer = layer
+        self.ternary = ternary
+        self.addresses = list(addresses if addresses is not None else range(2**address_width))
+        # address -> (key, port) of every written entry, parked ones included
+        self.entries = {}
+        # key -> address of the live entries
+        self.index = {}
+        # address -> (key, port) of the entries written by others (S&M subnets)
+        self.reserved = {}
+        self.stats = collections.Counter()
+
+    def parked(self):
+        return (PARKED_KEY, 0) if self.ternary else PARKED_KEY
+
+    def matches(self, entry_key, key):
+        if self.ternary:
+            return ((entry_key[0] ^ key) & ~entry_key[1]) == 0
+        return entry_key == key
+
+    def reserve(self, entries):
+        # Entries (key, mask, port, address) other tools write at addresses out
+        # of the shadow, e.g. snm_subnets.subnet_entries()
+        self.reserved.clear()
+        for entry in entries:
+            if entry['address'] in self.addresses:
+                raise ValueError("address {0} belongs to the shadow".format(entry['address']))
+            key = int(ipaddress.IPv4Address(entry['key'])) if self.ternary else entry['key']
+            self.reserved[entry['address']] = ((key, entry['mask']) if self.ternary else key, entry['port'])
+
+    # LUT_READ as the switch does it: (match, port)
+    def lookup(self, key):
+        entries = dict(self.entries)
+        entries.update(self.reserved)
+        for address in sorted(entries, reverse=True):
+            entry_key, port = entries[address]
+            if self.matches(entry_key, key):
+                return (1, port)
+        return (0, 0)
+
+    def probe(self, key):
+        # Address looked up to check an entry
+        return key[0] if self.ternary else key
+
+    def live(self):
+        return dict((key, self.entries[address][1]) for key, address in self.index.items())
+
+    def apply(self, op):
+        # Shadow update of a write the switch acknowledged
+        old = self.entries.get(op.address)
+        if old is not None and self.index.get(old[0]) == op.address:
+            del self.index[old[0]]
+        self.entries[op.address] = (op.key, op.port)
+        if op.kind != 'delete':
+            self.index[op.key] = op.address
+
+    def free(self, taken):
+        return [address for address in self.addresses if address not in taken]
+
+    def place(self, key, taken):
+        # Free address keeping the priority order against the entries of taken
+        # (address -> key), None when there is none
+        candidates = self.free(taken)
+        if not self.ternary:
+            return candidates[0] if candidates else None
+        low = max([address for address, other in taken.items() if contains(other, key)] + [-1])
+        high = min([address for address, other in taken.items() if contains(key, other)] + [2**IP_ADDRESS_WIDTH])
+        candidates = [address for address in candidates if low < address < high]
+        if not candidates:
+            return None
+        # The middle of the interval leaves room on both sides
+        middle = (max(low, self.addresses[0] - 1) + min(high, self.addresses[-1] + 1)) / 2.0
+        return min(candidates, key=lambda address: abs(address - middle))
+
+    def plan(self, desired):
+        # Ordered writes from the shadow to desired {key: port}, TableFull when
+        # an add cannot be placed
+        live = self.live()
+        adds = [key for key in desired if key not in live]
+        modifies = [key for key in desired if key in live and live[key] != desired[key]]
+        deletes = [key for key in live if key not in desired]
+        if self.ternary:
+            adds.sort(key=care_bits, reverse=True)
+            deletes.sort(key=care_bits)
+        # The old entries stay in place until the deletes
+        taken = dict((address, key) for key, address in self.index.items())
+        ops = []
+        for key in adds:
+            address = self.place(key, taken)
+            if address is None:
+                raise TableFull("no address for {0} in {1}".format(key, self.layer.__name__))
+            taken[address] = key
+            ops.append(Op('add', address, key, desired[key]))
+        ops += [Op('modify', self.index[key], key, desired[key]) for key in modifies]
+        ops += [Op('delete', self.index[key], self.parked(), NONE) for key in deletes]
+        return ops
+
+    def key_fields(self, key):
+        if self.layer is SouthboundSBIRouting:
+            return {'key_h': key >> 8, 'key_l': key & 0xff}
+        if self.ternary:
+            return {'key': str(ipaddress.IPv4Address(key[0])), 'mask': key[1]}
+        return {'key': key}
+
+    def fields(self, op):
+        # Layer fields of a write
+        fields = self.key_fields(op.key)
+        fields.update({'port': op.port, 'address': op.address, 'check': 0})
+        return fields
+
+    async def confirm(self, controller, key):
+        # Check request on key: the switch must answer what the shadow says
+        fields = self.key_fields(key)
+        if self.ternary:
+            fields['mask'] = 0
+        message = await controller.request(self.layer, check=1, **fields)
+        match, port = self.lookup(self.probe(key))
+        if message.fields['check_match'] != match or (match and message.fields['port'] != port):
+            raise SyncError("{0} {1}: switch answers match={2} port={3}, shadow match={4} port={5}".format(
+                self.layer.__name__, fields, message.fields['check_match'], message.fields['port'], match, port))
+
+
+def routing_shadows(ip_addresses=None, dst_subnets=(), src_subnets=()):
+    # Shadow of every routing table; the IP tables leave the S&M subnet
+    # addresses out, and see the subnet entries installed there
+    # (snm_subnets.subnet_entries of each table)
+    if ip_addresses is None:
+        ip_addresses = range(SUBNET_ADDRESS_BASE)
+    shadows = {'sbi':      ShadowTable(SouthboundSBIRouting, ID_ADDRESS_WIDTH),
+               'dst_ip':   ShadowTable(SouthboundDstIPRouting, IP_ADDRESS_WIDTH, ternary=True, addresses=ip_addresses),
+               'src_ip':   ShadowTable(SouthboundSrcIPRouting, IP_ADDRESS_WIDTH, ternary=True, addresses=ip_addresses),
+               'src_port': ShadowTable(SouthboundSrcPortRouting, TCP_ADDRESS_WIDTH),
+               'dst_port': ShadowTable(SouthboundDstPortRouting, TCP_ADDRESS_WIDTH)}
+    shadows['dst_ip'].reserve(dst_subnets)
+    shadows['src_ip'].reserve(src_subnets)
+    return shadows
+
+
+async def sync(controller, shadow, desired, verify=True):
+    # Write the differences between the shadow and desired {key: port}
+    # (sb_controller.SBIController); returns the count of each kind of write.
+    # TableFull, before any write, when desired does not fit
+    ops = shadow.plan(desired)
+    counts = collections.Counter()
+    for op in ops:
+        # A delete is checked on the key it removes, which must get the next
+        # matching entry (nothing to check on an address without a live entry)
+        old = shadow.entries.get(op.address)
+        probe = op.key
+        if op.kind == 'delete':
+            probe = old[0] if old is not None and shadow.index.get(old[0]) == op.address else None
+        await controller.request(shadow.layer, **shadow.fields(op))
+        shadow.apply(op)
+        counts[op.kind] += 1
+        if verify and probe is not None:
+            await shadow.confirm(controller, probe)
+    shadow.stats.update(counts)
+    return counts
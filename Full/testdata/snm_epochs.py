@@ -0,0 +1,90 @@
+#
+# Copyright (c) 2022 Mario Patetta, Conservatoire National des Arts et Metiers
+# All rights reserved.
+#
+# SBI_engine is free software: you can redistribute it and/or modify it under the terms of
+# the GNU Affero General Public License as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# SBI_engine is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+#
+# Continuous S&M monitoring with double-buffered sketches.
+#
+# Every sketch exists in two banks and the data plane writes the bank of the
+# current epoch (the DstPort_Stage epoch register). At the end of an epoch,
+# rotate() points the data plane to the other bank with a SetEpoch message,
+# then reads the frozen bank with plain queries and clears it with RESET: no
+# packet is lost between two epochs and the four metrics of an epoch (and the
+# *_BUCKETS dumps, several replies per sketch) describe the same packets.
+# The frozen bank is left cleared for the next swap.
+#
+# The epoch is written, not toggled, so a retransmitted SetEpoch is harmless.
+# Nothing writes the frozen bank, so its READs and RESETs can be retransmitted
+# as well; READ_AND_RESET is not used, the controller never retransmits it
+# and one lost ACK would lose the epoch.
+#
+#   async with SBIController(IFACE, MAC3, SERVER_MAC, CONTROLLER_ID, SWITCH_ID) as sbi:
+#       await run_epochs(sbi, 60, on_epoch, slots=[0, 1], subnets=[0])
+#
+
+import time, asyncio
+
+from southbound_headers import *
+
+# The metrics read by query_all() of sb_controller.SBIController
+METRICS = (SRC_IP_CARD, DST_IP_CARD, SRC_PORTS_CARD, COUNTERS)
+
+
+async def set_epoch(controller, epoch):
+    # Bank written by the data plane (sb_controller.SBIController)
+    await controller.request(SouthboundSetEpoch, epoch=epoch & 1)
+
+
+async def read_bank(controller, bank, slots=(0,), subnets=(0,)):
+    # {(subnet, slot): [result tuple of each metric]} of a frozen bank, then cleared
+    keys = [(subnet, slot) for subnet in subnets for slot in slots]
+    replies = await asyncio.gather(*[controller.query_all(bank=bank, subnet=subnet, slot=slot)
+                                     for subnet, slot in keys])
+    await clear_bank(controller, bank, slots, subnets)
+    return dict(zip(keys, replies))
+
+
+async def clear_bank(controller, bank, slots=(0,), subnets=(0,)):
+    # RESET of every metric of a bank the data plane does not write, with the
+    # retransmits of the controller (reset() sends once)
+    await asyncio.gather(*[controller.request(SouthboundMetric, metricID=metric_id, reset=1,
+                                              bank=bank, subnet=subnet, slot=slot)
+                           for metric_id in METRICS for subnet in subnets for slot in slots])
+
+
+async def rotate(controller, epoch, slots=(0,), subnets=(0,)):
+    # Start epoch + 1 and return the results of epoch
+    await set_epoch(controller, epoch + 1)
+    return await read_bank(controller, epoch & 1, slots, subnets)
+
+
+async def run_epochs(controller, period, on_epoch, slots=(0,), subnets=(0,), count=None):
+    # Rotates every period seconds and calls on_epoch(epoch, end time, results)
+    # (a coroutine function or a plain function). Epochs are scheduled on the
+    # monotonic clock, so the time spent reading does not shift the next ones.
+    await clear_bank(controller, 0, slots, subnets)
+    await clear_bank(controller, 1, slots, subnets)
+    await set_epoch(controller, 0)
+    epoch = 0
+    deadline = time.monotonic()
+    while count is None or epoch < count:
+        deadline += period
+        await asyncio.sleep(max(0, deadline - time.monotonic()))
+        end = time.time()
+        results = await rotate(controller, epoch, slots, subnets)
+        ret = on_epoch(epoch, end, results)
+        if asyncio.iscoroutine(ret):
+            await ret
+        epoch += 1
@@ -0,0 +1,520 @@
+#
+# Copyright (c) 2022 Mario Patetta, Conservatoire National des Arts et Metiers
+# All rights reserved.
+#
+# SBI_engine is free software: you can redistribute it and/or modify it under the terms of
+# the GNU Affero General Public License as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# SBI_engine is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+#
+# Offline software emulation of TopPipe (split_and_merge_full.p4).
+#
+# SnMPipeline keeps the switch state (routing tables, S&M ports LUT, sketch
+# state through the bit-accurate extern models) and processes whole arrays of
+# packets at once: RoutingStage gives the egress port of every packet, and the
+# packets whose dst port is in the S&M ports LUT update the three HLL stages
+# and Counters_Stage in their slot. Packets are read from pcaps the way TopParser sees them:
+# IPv4 only, fixed 20-byte IP header, TCP when ip.protocol == 6, Southbound
+# frames (ip.protocol == 144) routed by the SBI cam.
+# The match address of the IP tables also gives the S&M subnet of a packet
+# (see snm_subnets.py): a slot has one sketch set per subnet.
+#
+# emulate_campaign() runs the reset / replay / query cycle of
+# SnM_test_send.py for every (port, date, subnet) job of campaign.py, one day
+# per worker process, and returns the rows SnM_test_receive.py writes: the
+# jobs of the dates a port is not active on (MIN_DAYS, WINDOW) get no
+# traffic and give zero rows, as on the switch. With slots > 1,
+# a replay measures that many ports at once. With in_switch_subnets, the
+# subnets of the day are installed in the IP tables and one replay of the
+# whole day gives the rows of the nine subnets.
+# Every sketch exists in two banks: packets update the bank of the current
+# epoch (set_epoch), the metrics are queried in any bank.
+#
+# Usage: python snm_pipeline.py [--slots N] [--in-switch-subnets] [--ports P ...] <path_to_pcaps> <subnets_20xx.csv> <port_list.csv>
+#
+
+import os, sys, csv, mmap, struct, ipaddress, argparse, multiprocessing
+import numpy as np
+
+import hll_model, welford_model
+# The job table of the campaign of SnM_test_send.py
+sys.path.append(os.path.expandvars('../../Simple/hw_test/'))
+import campaign
+from snm_subnets import SUBNETS, read_subnets, subnet_entries
+
+# Metric IDs
+SRC_IP_CARD     = 0
+DST_IP_CARD     = 1
+SRC_PORTS_CARD  = 2
+COUNTERS        = 3
+METRICS         = (SRC_IP_CARD, DST_IP_CARD, SRC_PORTS_CARD, COUNTERS)
+SRC_IP_BUCKETS      = 4
+DST_IP_BUCKETS      = 5
+SRC_PORTS_BUCKETS   = 6
+BUCKETS_METRICS     = {SRC_IP_BUCKETS: SRC_IP_CARD, DST_IP_BUCKETS: DST_IP_CARD, SRC_PORTS_BUCKETS: SRC_PORTS_CARD}
+
+# my_variables.p4 / SBI_engine.p4
+IPV4_TYPE           = 0x0800
+TCP_TYPE            = 6
+SOUTHBOUND_TYPE     = 144
+SYN_MASK            = 0x02
+RESULT_SHORT        = 20
+IP_KEY_WIDTH        = 32
+TCP_KEY_WIDTH       = 16
+SBI_KEY_WIDTH       = 9
+IP_ADDRESS_WIDTH    = 7
+TCP_ADDRESS_WIDTH   = 4
+ID_ADDRESS_WIDTH    = 4
+SnM_PORTS_INDEX_WIDTH = 3
+SnM_SLOTS           = 2**SnM_PORTS_INDEX_WIDTH
+SUBNET_INDEX_WIDTH  = 4
+SUBNET_ADDRESS_BASE = 96
+SKETCH_INDEX_WIDTH  = 8
+
+# pcap file format
+PCAP_GLOBAL_HDR     = 24
+PCAP_RECORD_HDR     = 16
+
+# Cams looked up through a dense table of all their keys
+DENSE_KEY_WIDTH     = 16
+
+
+class LutTable(object):
+    # lut_cam / lut_tcam extern: mask bits are don't care (tcam_line_array.v),
+    # the highest matching address wins (tcam_priority_encoder.v).
+    # A lookup does not go through the entries one by one: the cam keys index
+    # a dense table of the winning address of every key, and the tcam entries
+    # are grouped by mask, each group being an exact match on the care bits
+    # (a binary search in its sorted keys), the highest address over the
+    # groups winning.
+
+    def __init__(self, key_width, address_width, ternary=True):
+        self.key_width = key_width
+        self.address_width = address_width
+        self.ternary = ternary
+        size = 1 << address_width
+        self.key = np.zeros(size, dtype=np.uint64)
+        self.xmask = np.zeros(size, dtype=np.uint64)
+        self.port = np.zeros(size, dtype=np.uint8)
+        self.active = np.zeros(size, dtype=bool)
+        self.compiled = None
+
+    # LUT_UPDATE
+    def update(self, address, key, port, mask=0):
+        address &= (1 << self.address_width) - 1
+        self.key[address] = key & ((1 << self.key_width) - 1)
+        self.xmask[address] = (mask & ((1 << self.key_width) - 1)) if self.ternary else 0
+        self.port[address] = port
+        self.active[address] = True
+        self.compiled = None
+
+    # LUT_RESET
+    def reset(self):
+        self.active[:] = False
+        self.compiled = None
+
+    def compile(self):
+        # Dense table (cam keys up to DENSE_KEY_WIDTH bits) or [(care bits,
+        # sorted keys, address of each key)], the highest address kept
+        # when several entries have the same key
+        key_mask = np.uint64((1 << self.key_width) - 1)
+        entries = np.nonzero(self.active)[0]
+        if not self.ternary and self.key_width <= DENSE_KEY_WIDTH:
+            dense = np.full(1 << self.key_width, -1, dtype=np.int16)
+            # Increasing addresses: the last write of a key is the highest address
+            dense[self.key[entries].astype(np.int64)] = entries
+            return dense
+        groups = []
+        for xmask in np.unique(self.xmask[entries]):
+            group = entries[self.xmask[entries] == xmask]
+            care = ~xmask & key_mask
+            keys = self.key[group] & care
+            order = np.lexsort((group, keys))
+            keys, group = keys[order], group[order]
+            last = np.append(keys[1:] != keys[:-1], True)
+            groups.append((care, keys[last], group[last].astype(np.int16)))
+        return groups
+
+    # Matching address of every key, -1 without a match
+    def match_address(self, keys):
+        if self.compiled is None:
+            self.compiled = self.compile()
+        keys = np.asarray(keys, dtype=np.uint64) & np.uint64((1 << self.key_width) - 1)
+        if isinstance(self.compiled, np.ndarray):
+            return self.compiled[keys.astype(np.int64)]
+        best = np.full(keys.shape, -1, dtype=np.int16)
+        for care, entry_keys, addresses in self.compiled:
+            masked = keys & care
+            i = np.minimum(np.searchsorted(entry_keys, masked), len(entry_keys) - 1)
+            hit = entry_keys[i] == masked
+            np.maximum(best, np.where(hit, addresses[i], -1), out=best)
+        return best
+
+    # LUT_READ on an array of keys: returns (match, port, match address)
+    def lookup(self, keys):
+        best = self.match_address(keys)
+        match = best >= 0
+        address = np.where(match, best, 0).astype(np.uint8)
+        port = np.where(match, self.port[address], 0).astype(np.uint8)
+        return match, port, address
+
+
+def sketch_index(bank, subnet, slot):
+    # {bank, subnet, slot}
+    return ((bank & 1) << (SUBNET_INDEX_WIDTH + SnM_PORTS_INDEX_WIDTH)) | \
+           ((subnet & (2**SUBNET_INDEX_WIDTH - 1)) << SnM_PORTS_INDEX_WIDTH) | (slot & (SnM_SLOTS - 1))
+
+
+class SnMPipeline(object):
+
+    def __init__(self):
+        self.sbi_table = LutTable(SBI_KEY_WIDTH, ID_ADDRESS_WIDTH, ternary=False)
+        self.dst_ip_table = LutTable(IP_KEY_WIDTH, IP_ADDRESS_WIDTH)
+        self.src_ip_table = LutTable(IP_KEY_WIDTH, IP_ADDRESS_WIDTH)
+        self.src_port_table = LutTable(TCP_KEY_WIDTH, TCP_ADDRESS_WIDTH, ternary=False)
+        self.dst_port_table = LutTable(TCP_KEY_WIDTH, TCP_ADDRESS_WIDTH, ternary=False)
+        self.snm_ports_table = LutTable(TCP_KEY_WIDTH, SnM_PORTS_INDEX_WIDTH, ternary=False)
+        self.epoch = 0
+        # One sketch set per (bank, subnet, slot): sketch index {bank, subnet, slot}
+        self.src_ip_hll = hll_model.HyperLogLogModel(datain_width=hll_model.IP_ADDR_WIDTH, slot_width=SKETCH_INDEX_WIDTH)
+        self.dst_ip_hll = hll_model.HyperLogLogModel(datain_width=hll_model.IP_ADDR_WIDTH, slot_width=SKETCH_INDEX_WIDTH)
+        self.src_port_hll = hll_model.HyperLogLogModel(datain_width=hll_model.TCP_PORT_WIDTH, slot_width=SKETCH_INDEX_WIDTH)
+        # The welford sketches are independent words of distributed RAM
+        self.welfords = [welford_model.WelfordModel() for sketch in range(2**SKETCH_INDEX_WIDTH)]
+        self.hlls = {SRC_IP_CARD: self.src_ip_hll, DST_IP_CARD: self.dst_ip_hll, SRC_PORTS_CARD: self.src_port_hll}
+
+    # DstPort_Stage LUT update (SouthboundSetSnmPort)
+    def set_snm_port(self, port, slot=0):
+        self.snm_ports_table.update(slot, port, slot)
+
+    # DstPort_Stage LUT reset (SouthboundSetSnmPort with reset=1)
+    def reset_snm_ports(self):
+        self.snm_ports_table.reset()
+
+    # DstPort_Stage epoch register (SouthboundSetEpoch)
+    def set_epoch(self, epoch):
+        self.epoch = epoch & 1
+
+    # Subnet entries of a day (see snm_subnets.subnet_entries) in both IP
+    # tables, given the route set installed in each
+    def install_subnets(self, cells, dst_routes, src_routes):
+        for table, routes in ((self.dst_ip_table, dst_routes), (self.src_ip_table, src_routes)):
+            for entry in subnet_entries(cells, routes):
+                table.update(entry['address'], int(ipaddress.IPv4Address(entry['key'])), entry['port'], entry['mask'])
+
+    # Metric stages on a SouthboundMetric: returns (result1, result2, result3, result4).
+    # base is the result1 field of the request (first bucket of a *_BUCKETS query).
+    def metric(self, metric_id, reset=0, slot=0, subnet=0, base=0, read_reset=0, bank=0):
+        slot = sketch_index(bank, subnet, slot)
+        if metric_id in BUCKETS_METRICS:
+            hll = self.hlls[BUCKETS_METRICS[metric_id]]
+            if reset:
+                hll.reset(slot)
+                return (0, 0, 0, 0)
+            buckets = hll.dump(slot, base & (hll.num_buckets - 1))
+            return tuple((buckets >> (RESULT_SHORT * i)) & (2**RESULT_SHORT - 1) for i in range(4))
+        if metric_id in self.hlls:
+            hll = self.hlls[metric_id]
+            if reset:
+                hll.reset(slot)
+                return (0, 0, 0, 0)
+            result, empty_buckets = hll.read_reset(slot) if read_reset else hll.read(slot)
+            return (result, empty_buckets, 0, 0)
+        if metric_id == COUNTERS:
+            if reset:
+                self.welfords[slot].reset()
+                return (0, 0, 0, 0)
+            return self.welfords[slot].read_reset() if read_reset else self.welfords[slot].read()
+        return (0, 0, 0, 0)
+
+    def reset_all(self, slot=0, subnet=0, bank=0):
+        for metric_id in METRICS:
+            self.metric(metric_id, reset=1, slot=slot, subnet=subnet, bank=bank)
+
+    def query_all(self, slot=0, subnet=0, read_reset=0, bank=0):
+        return [self.metric(metric_id, slot=slot, subnet=subnet, read_reset=read_reset, bank=bank) for metric_id in METRICS]
+
+    # RoutingStage on data plane packets: returns the 4-bit egress port (0: dropped)
+    def route(self, packets):
+        return self.classify(packets)[0]
+
+    # RoutingStage: returns (egress port, S&M subnet) of every packet. A match at
+    # a subnet address of the IP tables sets the subnet, srcIP over dstIP.
+    def classify(self, packets):
+        return self.routing_decision(packets)[:2]
+
+    # RoutingStage with the match of every table: returns (egress port, S&M
+    # subnet, {table: match}). The SBI cam routes the Southbound frames in
+    # transit (packets 'is_sb' and 'sbi_key', {ACK, SwitchID}) over the data
+    # plane tables, dstIP < srcIP < srcPort < dstPort, the later one overriding.
+    def routing_decision(self, packets):
+        egress = np.zeros(len(packets['src']), dtype=np.uint8)
+        subnet = np.zeros(len(packets['src']), dtype=np.uint8)
+        matches = {}
+        # The TCP fields of non-TCP packets are read as 0
+        sport = np.where(packets['is_tcp'], packets['sport'], 0)
+        dport = np.where(packets['is_tcp'], packets['dport'], 0)
+        for name, table, keys in (('dst_ip', self.dst_ip_table, packets['dst']), ('src_ip', self.src_ip_table, packets['src']),
+                                  ('src_port', self.src_port_table, sport), ('dst_port', self.dst_port_table, dport)):
+            match, port, address = table.lookup(keys)
+            if table is self.dst_ip_table or table is self.src_ip_table:
+                in_subnet = match & (address >= SUBNET_ADDRESS_BASE)
+                subnet = np.where(in_subnet, address & (2**SUBNET_INDEX_WIDTH - 1), subnet)
+                # Subnet entries routed to NONE only classify
+                match = match & ~(in_subnet & (port == 0))
+            egress = np.where(match, port, egress)
+            matches[name] = match
+        if 'sbi_key' in packets:
+            match, port = self.sbi_table.lookup(packets['sbi_key'])[:2]
+            match &= packets['is_sb']
+            egress = np.where(match, port, egress)
+            matches['sbi'] = match
+        return egress, subnet, matches
+
+    # TopPipe on an array of data plane packets (see read_pcap)
+    def process(self, packets):
+        egress, subnet = self.classify(packets)
+        match, slot = self.snm_ports_table.lookup(packets['dport'])[:2]
+        selected = packets['is_tcp'] & match
+        if np.any(selected):
+            slot = sketch_index(self.epoch, subnet[selected].astype(np.int64), slot[selected])
+            # payload_len = ip.totalLen - 40 on 16 bits
+            payload_len = (packets['total_len'][selected].astype(np.int64) - 40) & 0xffff
+            syn_flag = (packets['flags'][selected] & SYN_MASK) != 0
+            src, dst, sport = packets['src'][selected], packets['dst'][selected], packets['sport'][selected]
+            # Sketches are updated one after the other, the one of the last
+            # packet last: the HLL BRAMs are left on the address of that packet
+            slots = [value for value in np.unique(slot).tolist() if value != slot[-1]] + [int(slot[-1])]
+            for value in slots:
+                in_slot = slot == value
+                self.src_ip_hll.update(src[in_slot], value)
+                self.dst_ip_hll.update(dst[in_slot], value)
+                self.src_port_hll.update(sport[in_slot], value)
+                self.welfords[value].update(payload_len[in_slot], syn_flag[in_slot])
+        return egress
+
+
+def read_pcap(path):
+    # Data plane fields of the packets TopParser accepts (IPv4 over Ethernet)
+    with open(path, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic = struct.unpack('<I', buf[:4])[0]
+            endian = '<' if magic in (0xa1b2c3d4, 0xa1b23c4d) else '>'
+            record = struct.Struct(endian + 'IIII')
+            offsets = []
+            caplens = []
+            offset = PCAP_GLOBAL_HDR
+            while offset + PCAP_RECORD_HDR <= len(buf):
+                caplen = record.unpack_from(buf, offset)[2]
+                if offset + PCAP_RECORD_HDR + caplen > len(buf):
+                    break
+                offsets.append(offset + PCAP_RECORD_HDR)
+                caplens.append(caplen)
+                offset += PCAP_RECORD_HDR + caplen
+            start = np.array(offsets, dtype=np.int64)
+            caplen = np.array(caplens, dtype=np.int64)
+            data = np.frombuffer(buf, dtype=np.uint8)
+            last = len(data) - 1
+
+            def field(offset, size):
+                value = np.zeros(len(start), dtype=np.uint32)
+                for i in range(size):
+                    value = (value << 8) | data[np.minimum(start + offset + i, last)]
+                return value
+
+            # Ethernet (14) + fixed IPv4 header (20) + TCP
+            is_ip = (field(12, 2) == IPV4_TYPE) & (caplen >= 34)
+            packets = {
+                'is_ip':        is_ip,
+                'is_tcp':       is_ip & (field(23, 1) == TCP_TYPE) & (caplen >= 48),
+                'total_len':    field(16, 2),
+                'src':          field(26, 4),
+                'dst':          field(30, 4),
+                'sport':        field(34, 2),
+                'dport':        field(36, 2),
+                'flags':        field(47, 1),
+                'is_sb':        is_ip & (field(23, 1) == SOUTHBOUND_TYPE) & (caplen >= 38),
+                # SBI cam key {ACK, SwitchID}
+                'sbi_key':      ((field(37, 1) >> 7) << 8) | field(35, 1),
+            }
+            del data
+        finally:
+            buf.close()
+    # Frames with another ether type are rejected by the parser
+    return dict((name, values[is_ip]) for name, values in packets.items())
+
+
+def select(packets, mask):
+    return dict((name, values[mask]) for name, values in packets.items())
+
+
+def subnet_mask(packets, cell):
+    # tcpdump "net A or net B": src or dst in one of the prefixes
+    match = np.zeros(len(packets['src']), dtype=bool)
+    for subnet in cell.split("|"):
+        n = ipaddress.ip_network(subnet, False)
+        mask = np.uint32(int(n.netmask))
+        network = np.uint32(int(n.network_address))
+        match |= ((packets['src'] & mask) == network) | ((packets['dst'] & mask) == network)
+    return match
+
+
+# HyperLogLogResult() of SnM_test_receive.py, for the parameters of this design
+def hll_cardinality(result, empty_buckets, bucket_index_width=hll_model.BUCKET_INDEX_WIDTH,
+                    bucket_content_width=hll_model.BUCKET_CONTENT_WIDTH):
+    m = 2 ** bucket_index_width
+    am = 0.7213 / (1 + (1.079 / m))
+    K = am * (m ** 2)
+    down_scale = 2.0 ** (-(hll_model.rarity_hash_width(bucket_content_width) - 1))
+    if (result, empty_buckets) == hll_model.HyperLogLogModel(bucket_index_width=bucket_index_width,
+                                                             bucket_content_width=bucket_content_width).read():
+        # Cardinality = 0: the reply of a reset sketch (wrapped sum and empty_buckets)
+        return 0
+    estimate = K / (result * down_scale)
+    if estimate < 2.5 * m and empty_buckets != 0:
+        # Linear counting for low cardinalities
+        estimate = m * np.log(float(m) / empty_buckets)
+    return estimate
+
+
+def receiver_row(date, subnet, replies):
+    # Row of SnM_test_receive.py from the four metric replies
+    syn_count, pkt_count, mean, m2 = replies[COUNTERS]
+    if pkt_count <= 1:
+        return [date, subnet, 0, 0, 0, 0, 0, 0, 0]
+    cards = [hll_cardinality(replies[metric_id][0], replies[metric_id][1]) for metric_id in (SRC_IP_CARD, DST_IP_CARD, SRC_PORTS_CARD)]
+    size_std = welford_model.reply_statistics(replies[COUNTERS])[1]
+    return [date, subnet] + cards + [syn_count, pkt_count, mean, size_std]
+
+
+def run_slots(packets, tcp_ports, pipeline=None):
+    # Reset, replay and query with one port per slot: returns the four metric
+    # replies of every port
+    if pipeline is None:
+        pipeline = SnMPipeline()
+    for slot, tcp_port in enumerate(tcp_ports):
+        pipeline.set_snm_port(tcp_port, slot)
+        pipeline.reset_all(slot)
+    pipeline.process(packets)
+    return [pipeline.query_all(slot) for slot in range(len(tcp_ports))]
+
+
+def run_job(packets, tcp_port, pipeline=None):
+    # Reset, replay and query: returns the four metric replies
+    return run_slots(packets, [tcp_port], pipeline)[0]
+
+
+def no_packets():
+    return dict((name, np.zeros(0, dtype=bool if name.startswith('is_') else np.uint32))
+                for name in ('is_ip', 'is_tcp', 'total_len', 'src', 'dst', 'sport', 'dport', 'flags'))
+
+
+def run_subnets(packets, tcp_ports, subnet_cells, pipeline=None):
+    # Install the subnets, reset, replay once and query: returns the four metric
+    # replies of every (port, subnet name)
+    if pipeline is None:
+        pipeline = SnMPipeline()
+    # No routes in the tables of the pipeline: the subnet entries only classify
+    pipeline.install_subnets(subnet_cells, {}, {})
+    for slot, tcp_port in enumerate(tcp_ports):
+        pipeline.set_snm_port(tcp_port, slot)
+        for subnet in range(len(SUBNETS) + 1):
+            pipeline.reset_all(slot, subnet)
+    pipeline.process(packets)
+    return dict(((tcp_port, name), pipeline.query_all(slot, i + 1))
+                for slot, tcp_port in enumerate(tcp_ports) for i, name in enumerate(SUBNETS))
+
+
+def idle_row(date, subnet):
+    # Row of a job without replay: the query finds the sketches reset by the
+    # previous one (pkt_count = 0)
+    return [date, subnet, 0, 0, 0, 0, 0, 0, 0]
+
+
+def emulate_day(args):
+    # One worker: all the (port, subnet) jobs of a day, slots ports per replay.
+    # As in SnM_test_send.py, only the jobs whose replay flag is set get
+    # traffic (replay: (port, subnet) matrix of the day); a missing trace
+    # replays nothing, the queries then return the reset state.
+    pcap_path, date, ports, replay, subnet_cells, slots, in_switch_subnets = args
+    replay = np.asarray(replay, dtype=bool)
+    packets = read_pcap(pcap_path) if replay.any() and os.path.exists(pcap_path) else no_packets()
+    rows = []
+    for first in range(0, len(ports), slots):
+        tcp_ports = ports[first:first + slots]
+        port_replay = replay[first:first + slots]
+        active = [tcp_port for tcp_port, flags in zip(tcp_ports, port_replay) if flags.any()]
+        port_packets = select(packets, packets['is_tcp'] & np.isin(packets['dport'], active))
+        if in_switch_subnets:
+            replies = run_subnets(port_packets, tcp_ports, subnet_cells)
+            for i, subnet in enumerate(SUBNETS):
+                for tcp_port, flags in zip(tcp_ports, port_replay):
+                    rows.append((tcp_port, receiver_row(date, subnet, replies[(tcp_port, subnet)]) if flags[i]
+                                 else idle_row(date, subnet)))
+            continue
+        for i, (subnet, cell) in enumerate(zip(SUBNETS, subnet_cells)):
+            job_ports = [tcp_port for tcp_port, flags in zip(tcp_ports, port_replay) if flags[i]]
+            if job_ports:
+                job_packets = select(port_packets, np.isin(port_packets['dport'], job_ports) & subnet_mask(port_packets, cell))
+            else:
+                job_packets = no_packets()
+            for tcp_port, flags, replies in zip(tcp_ports, port_replay, run_slots(job_packets, tcp_ports)):
+                rows.append((tcp_port, receiver_row(date, subnet, replies) if flags[i] else idle_row(date, subnet)))
+    return rows
+
+
+def emulate_campaign(path_to_pcaps, jobs, subnets, processes=None, slots=1, in_switch_subnets=False):
+    # {tcp_port: [rows]} for the job table of campaign.compile_jobs() (the
+    # jobs of every port, in order), days run in parallel
+    if not 1 <= slots <= SnM_SLOTS:
+        raise ValueError("slots must be between 1 and {0}".format(SnM_SLOTS))
+    per_date = len(SUBNETS)
+    ports = sorted(set(jobs['port'].tolist()), key=jobs['port'].tolist().index)
+    if len(jobs) % (len(ports) * per_date):
+        raise ValueError("the job table does not hold every (date, subnet) of its ports")
+    per_port = len(jobs) // len(ports)
+    replay = jobs['replay'].reshape(len(ports), per_port // per_date, per_date)
+    days = [(os.path.join(path_to_pcaps, str(jobs['pcap_name'][i]) + ".pcap"), str(jobs['date'][i]), ports, replay[:, d],
+             subnets[jobs['date'][i]], slots, in_switch_subnets) for d, i in enumerate(range(0, per_port, per_date))]
+    results = dict((tcp_port, []) for tcp_port in ports)
+    pool = multiprocessing.Pool(processes)
+    try:
+        for day_rows in pool.imap(emulate_day, days):
+            for tcp_port, row in day_rows:
+                results[tcp_port].append(row)
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Emulate the S&M measurement campaign offline")
+    parser.add_argument('path_to_pcaps')
+    parser.add_argument('subnets_csv')
+    parser.add_argument('port_list_csv')
+    parser.add_argument('--ports', type=int, nargs='+', default=None, help="only the jobs of these ports")
+    parser.add_argument('--slots', type=int, default=1, help="ports measured per replay (S&M slots)")
+    parser.add_argument('--in-switch-subnets', action='store_true', help="classify the subnets in the IP tables, one replay per day")
+    args = parser.parse_args()
+    year = int(os.path.splitext(os.path.basename(args.subnets_csv))[0].split('_')[-1])
+    jobs = campaign.compile_jobs(args.port_list_csv, args.subnets_csv, year)
+    if args.ports is not None:
+        jobs = jobs[np.isin(jobs['port'], args.ports)]
+    results = emulate_campaign(args.path_to_pcaps, jobs, read_subnets(args.subnets_csv), slots=args.slots,
+                               in_switch_subnets=args.in_switch_subnets)
+    header = ['Date','Subnet','Src IP Card', 'Dst IP Card', 'Src Port Card', 'SYN Count', 'Pkt Count', 'Mean Size', 'Size Std Dev']
+    for tcp_port, rows in results.items():
+        with open('results_' + str(tcp_port) + '.csv', 'w') as f1:
+            writer = csv.writer(f1)
+            writer.writerow(header)
+            writer.writerows(rows)
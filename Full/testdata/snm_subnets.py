@@ -0,0 +1,125 @@
+#
+# Copyright (c) 2022 Mario Patetta, Conservatoire National des Arts et Metiers
+# All rights reserved.
+#
+# SBI_engine is free software: you can redistribute it and/or modify it under the terms of
+# the GNU Affero General Public License as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# SBI_engine is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+#
+# In-switch subnet classification for the S&M module.
+#
+# The subnets of a day (one row of subnets_20xx.csv) are installed in the top
+# entries of the dstIP and srcIP routing tcams: prefix k of subnet i goes to
+# address SUBNET_ADDRESS_BASE + k*2**SUBNET_INDEX_WIDTH + i, and the match
+# address of a packet selects the sketch set of subnet i (subnetA is 1, 0 gets
+# the packets out of every subnet). The whole day is then replayed once and
+# the metrics of each subnet are queried with SouthboundMetric(subnet=i).
+#
+# The subnet entries have the highest addresses: a packet of a subnet matches
+# its entry instead of the route of the same table, so the entry carries the
+# port of that route (the route set of the table is given, as in
+# tcam_compiler.py). Without a covering route, or with a route to NONE, the
+# entry is routed to NONE, which SBI_engine.p4 takes as classification only:
+# the table then takes no part in the routing decision, as without a match
+# (a srcIP route to NONE covering a subnet stops overriding the dstIP table).
+# A route nested in a subnet prefix with another port would be shadowed by
+# the entry: the subnet is refused.
+#
+# The tcams have no per-entry delete: the addresses a day does not use are
+# parked on 0.0.0.0/32, so that the prefixes of the previous day stop matching.
+#
+
+import csv, ipaddress, asyncio
+
+from southbound_headers import *
+import tcam_compiler
+
+SUBNETS = ['subnetA', 'subnetB', 'subnetC', 'subnetD', 'subnetE', 'subnetF','subnetG', 'subnetH', 'subnetI']
+
+PARKED_KEY = "0.0.0.0"
+IP_WIDTH   = 32
+
+
+def read_subnets(path):
+    # date (MMDD string) -> 9 subnet cells, None when empty (first line is the header)
+    subnets = {}
+    with open(path, 'r') as f:
+        reader = csv.reader(f)
+        next(reader)
+        for row in reader:
+            cells = [cell if cell else None for cell in row[1:len(SUBNETS) + 1]]
+            subnets['{0:04d}'.format(int(row[0]))] = cells + [None] * (len(SUBNETS) - len(cells))
+    return subnets
+
+
+def subnet_index(name):
+    return SUBNETS.index(name) + 1
+
+
+def subnet_address(index, prefix=0):
+    return SUBNET_ADDRESS_BASE + (prefix << SUBNET_INDEX_WIDTH) + index
+
+
+def subnet_port(table, network, length):
+    # Port of the route covering a subnet prefix in a table (tcam_compiler.normalize),
+    # NONE without one; ValueError when the entry would shadow a nested route
+    key = (network, length) if (network, length) in table else tcam_compiler.covering(table, network, length)
+    port = table[key] if key is not None else NONE
+    for (route, route_length), route_port in table.items():
+        if route_length > length and (route & tcam_compiler.prefix_mask(length)) == network and route_port != port:
+            raise ValueError("{0}/{1} (port {2}) would be shadowed by the subnet {3}/{4}".format(
+                ipaddress.IPv4Address(route), route_length, route_port, ipaddress.IPv4Address(network), length))
+    return port
+
+
+def subnet_entries(cells, routes):
+    # Routing table fields (key, mask, port, address) of the subnet entries of a
+    # day, for every subnet address (parked when unused), in the table of the
+    # route set routes ({prefix: port}, [(prefix, port)], {} for no routes).
+    # The mask bits are don't care bits: the host part of the prefix.
+    table = tcam_compiler.normalize(routes)
+    entries = []
+    for i, cell in enumerate(cells):
+        prefixes = cell.split("|") if cell else []
+        if len(prefixes) > SUBNET_PREFIXES:
+            raise ValueError("{0}: at most {1} prefixes per subnet".format(cell, SUBNET_PREFIXES))
+        for k in range(SUBNET_PREFIXES):
+            entry = {'key': PARKED_KEY, 'mask': 0, 'port': NONE, 'address': subnet_address(i + 1, k)}
+            if k < len(prefixes):
+                n = ipaddress.ip_network(prefixes[k], False)
+                entry['key'] = str(n.network_address)
+                entry['mask'] = (1 << (IP_WIDTH - n.prefixlen)) - 1
+                entry['port'] = subnet_port(table, int(n.network_address), n.prefixlen)
+            entries.append(entry)
+    return entries
+
+
+async def install_subnets(controller, cells, dst_routes, src_routes):
+    # Write the subnet entries of a day in both IP tables (sb_controller.SBIController),
+    # given the route set installed in each
+    await asyncio.gather(*[controller.write_route(layer, **entry)
+                           for layer, routes in ((SouthboundDstIPRouting, dst_routes), (SouthboundSrcIPRouting, src_routes))
+                           for entry in subnet_entries(cells, routes)])
+
+
+async def query_subnets(controller, slot=0):
+    # {subnet name: [result tuple of each metric]} for the S&M slot
+    replies = await asyncio.gather(*[controller.query(metric_id, subnet=subnet_index(name), slot=slot)
+                                     for name in SUBNETS
+                                     for metric_id in (SRC_IP_CARD, DST_IP_CARD, SRC_PORTS_CARD, COUNTERS)])
+    return dict((name, replies[4 * i:4 * i + 4]) for i, name in enumerate(SUBNETS))
+
+
+async def reset_subnets(controller, slot=0):
+    await asyncio.gather(*[controller.reset(metric_id, subnet=subnet_index(name), slot=slot)
+                           for name in SUBNETS
+                           for metric_id in (SRC_IP_CARD, DST_IP_CARD, SRC_PORTS_CARD, COUNTERS)])
@@ -28,6 +28,7 @@ SRC_PORT_ROUTING_TYPE   = 0x04
 METRIC_TYPE             = 0x05
 SNM_PORT_TYPE           = 0x06
 SET_ID_TYPE             = 0x07
+SET_EPOCH_TYPE          = 0x08
 ALIVE_SWITCH_TYPE       = 0x50
 
 # Port ID
@@ -42,6 +43,26 @@ SRC_IP_CARD     = 0
 DST_IP_CARD     = 1
 SRC_PORTS_CARD  = 2
 COUNTERS        = 3
+# Raw HLL buckets: result1 of the request holds the index of the first bucket,
+# the reply carries HLL_DUMP_BUCKETS 4-bit buckets in result1..result4 (first in the LSBs)
+SRC_IP_BUCKETS      = 4
+DST_IP_BUCKETS      = 5
+SRC_PORTS_BUCKETS   = 6
+HLL_DUMP_BUCKETS    = 20
+
+# S&M slots (SnM_PORTS_INDEX_WIDTH)
+SNM_SLOT_WIDTH  = 3
+SNM_SLOTS       = 2**SNM_SLOT_WIDTH
+
+# S&M subnets: the top entries of the IP routing tables, two prefixes per subnet
+# (subnet = address % 2**SUBNET_INDEX_WIDTH), subnet 0 gets the packets out of every subnet
+SUBNET_INDEX_WIDTH  = 4
+SUBNET_ADDRESS_BASE = 96
+SUBNET_PREFIXES     = 2
+
+# S&M epochs: two banks of sketches, the data plane writes the one of the
+# current epoch (SouthboundSetEpoch), SouthboundMetric(bank=) selects the bank to query
+SNM_BANKS       = 2
 
 
 class Southbound(Packet):
@@ -49,7 +70,7 @@ class Southbound(Packet):
     fields_desc = [
 		BitField("ControllerID",0,8),
 		BitField("SwitchID",0,8),
-		ByteEnumField("SBtype", ALIVE_SWITCH_TYPE, {SBI_ROUTING_TYPE:"SBI_ROUTING_TYPE", DST_IP_ROUTING_TYPE:"DST_IP_ROUTING_TYPE", SRC_IP_ROUTING_TYPE:"SRC_IP_ROUTING_TYPE", DST_PORT_ROUTING_TYPE:"DST_PORT_ROUTING_TYPE", SRC_PORT_ROUTING_TYPE:"SRC_PORT_ROUTING_TYPE", METRIC_TYPE:"METRIC_TYPE", SNM_PORT_TYPE:"SNM_PORT_TYPE", SET_ID_TYPE:"SET_ID_TYPE"}),
+		ByteEnumField("SBtype", ALIVE_SWITCH_TYPE, {SBI_ROUTING_TYPE:"SBI_ROUTING_TYPE", DST_IP_ROUTING_TYPE:"DST_IP_ROUTING_TYPE", SRC_IP_ROUTING_TYPE:"SRC_IP_ROUTING_TYPE", DST_PORT_ROUTING_TYPE:"DST_PORT_ROUTING_TYPE", SRC_PORT_ROUTING_TYPE:"SRC_PORT_ROUTING_TYPE", METRIC_TYPE:"METRIC_TYPE", SNM_PORT_TYPE:"SNM_PORT_TYPE", SET_ID_TYPE:"SET_ID_TYPE", SET_EPOCH_TYPE:"SET_EPOCH_TYPE"}),
 		BitField("ACK",0,1),
 		BitField("length",4,7),
     ]
@@ -147,14 +168,19 @@ class SouthboundMetric(Packet):
     name = "SouthboundMetric"
     fields_desc = [
         BitField("reset",0,1),
-        BitEnumField("metricID", 0, 7, {SRC_IP_CARD:"SRC_IP_CARD", DST_IP_CARD:"DST_IP_CARD", SRC_PORTS_CARD:"SRC_PORTS_CARD", COUNTERS:"COUNTERS"}),
+        BitField("read_reset",0,1),                                          # Read and reset in one request
+        BitEnumField("metricID", 0, 6, {SRC_IP_CARD:"SRC_IP_CARD", DST_IP_CARD:"DST_IP_CARD", SRC_PORTS_CARD:"SRC_PORTS_CARD", COUNTERS:"COUNTERS",
+                                            SRC_IP_BUCKETS:"SRC_IP_BUCKETS", DST_IP_BUCKETS:"DST_IP_BUCKETS", SRC_PORTS_BUCKETS:"SRC_PORTS_BUCKETS"}),
+        BitField("subnet",0,SUBNET_INDEX_WIDTH),                             # S&M subnet sketch set
+        BitField("bank",0,1),                                                # S&M epoch bank
+        BitField("slot",0,SNM_SLOT_WIDTH),                                   # S&M slot
         BitField("result1",0,20),
         BitField("result2",0,20),
         BitField("result3",0,20),
         BitField("result4",0,20),
     ]
     def mysummary(self):
-        return self.sprintf(" snm_port=%snm_port% reset=%reset% metricID=%metricID% result1=%result1% result2=%result2% result3=%result3% result4=%result4%")
+        return self.sprintf("reset=%reset% read_reset=%read_reset% metricID=%metricID% subnet=%subnet% bank=%bank% slot=%slot% result1=%result1% result2=%result2% result3=%result3% result4=%result4%")
 
 bind_layers(Southbound, SouthboundMetric, SBtype=METRIC_TYPE, length=4+12)
 
@@ -162,11 +188,14 @@ class SouthboundSetSnmPort(Packet):
     name = "SouthboundSetSnmPort"
     fields_desc = [
         BitField("port",0,16),
+        BitField("slot",0,SNM_SLOT_WIDTH),
+        BitField("reset",0,1),
+        BitField("unused",0,4),
     ]
     def mysummary(self):
-        return self.sprintf("port=%port%")
+        return self.sprintf("port=%port% slot=%slot% reset=%reset%")
 
-bind_layers(Southbound, SouthboundSetSnmPort, SBtype=SNM_PORT_TYPE, length=4+2)
+bind_layers(Southbound, SouthboundSetSnmPort, SBtype=SNM_PORT_TYPE, length=4+3)
 
 class SouthboundSetID(Packet):
     name = "SouthboundSetID"
@@ -178,6 +207,17 @@ class SouthboundSetID(Packet):
 
 bind_layers(Southbound, SouthboundSetID, SBtype=SET_ID_TYPE, length=4+1)
 
+class SouthboundSetEpoch(Packet):
+    name = "SouthboundSetEpoch"
+    fields_desc = [
+        BitField("epoch",0,1),                                               # Bank written by the data plane
+        BitField("unused",0,7),
+    ]
+    def mysummary(self):
+        return self.sprintf("epoch=%epoch%")
+
+bind_layers(Southbound, SouthboundSetEpoch, SBtype=SET_EPOCH_TYPE, length=4+1)
+
 
 
 
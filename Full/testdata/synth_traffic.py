@@ -0,0 +1,236 @@
+#
+# Copyright (c) 2022 Mario Patetta, Conservatoire National des Arts et Metiers
+# All rights reserved.
+#
+# SBI_engine is free software: you can redistribute it and/or modify it under the terms of
+# the GNU Affero General Public License as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# SBI_engine is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+#
+# Seeded synthetic TCP traffic with ground truth, for sketch accuracy benchmarks.
+#
+# synthesize() draws count TCP packets to one destination port, as the
+# packet arrays of snm_pipeline.read_pcap. The src IP, dst IP and src port of
+# a packet come from populations of exactly the requested cardinalities
+# (every key appears at least once, so count >= cardinality), drawn with a
+# Zipf skew (0: uniform). SYN packets come with probability syn_ratio; the
+# payload sizes follow a size distribution:
+#   uniform:LOW:HIGH        bimodal:SMALL:LARGE:P_LARGE
+#   fixed:SIZE              lognormal:MU:SIGMA
+# (clipped to [0, MAX_PAYLOAD]).
+#
+# ground_truth() gives the exact metrics of the packets, expected_replies()
+# the SBI replies of the switch (the S&M pipeline of snm_pipeline.py with
+# dport measured in slot 0), estimates() what the controller makes of them.
+# write_pcap() writes the packets as zero-padded frames, to replay them.
+#
+# The benchmark sweeps the three cardinalities together and writes one JSON
+# line per cardinality: exact value, estimate and relative error of each
+# metric.
+#
+# Usage: python synth_traffic.py [--cardinalities 10,100,1000] [--packets-per-key N] [--zipf S]
+#                                [--syn-ratio R] [--sizes uniform:0:1460] [--seed N] [--pcap out.pcap]
+#
+
+import sys, json, struct, argparse, ipaddress
+import numpy as np
+
+import hll_model, welford_model, snm_pipeline
+
+MAX_PAYLOAD     = 1460
+SOURCE_PORTS    = 2**16
+HEADER_SIZE     = 54                                                # Ether + IP + TCP
+SYN_FLAG        = 0x02
+ACK_FLAG        = 0x10
+# Frame fields: scapy defaults, as testdata_stream.tcp_frame
+ETH_DST         = "11:11:11:11:11:11"
+ETH_SRC         = "22:22:22:22:22:22"
+IP_ID           = 1
+IP_TTL          = 64
+TCP_WINDOW      = 8192
+CARDINALITIES   = (10, 100, 1000, 10**4, 10**5, 10**6, 10**7)
+
+METRIC_NAMES    = {snm_pipeline.SRC_IP_CARD: 'src_ip_card', snm_pipeline.DST_IP_CARD: 'dst_ip_card',
+                   snm_pipeline.SRC_PORTS_CARD: 'src_ports_card'}
+
+
+def population(rng, cardinality, network='0.0.0.0/0', low=0):
+    # cardinality distinct keys of a network (or of [low, 2**16) with network None), in random order
+    if network is None:
+        return (low + rng.permutation(SOURCE_PORTS - low)[:cardinality]).astype(np.uint32)
+    n = ipaddress.ip_network(network, False)
+    if cardinality > n.num_addresses:
+        raise ValueError("{0} keys in {1}".format(cardinality, n))
+    base, size = int(n.network_address), n.num_addresses
+    keys = np.zeros(0, dtype=np.uint64)
+    while len(keys) < cardinality:
+        draw = rng.integers(0, size, int((cardinality - len(keys)) * 1.1) + 16, dtype=np.uint64)
+        keys = np.unique(np.concatenate((keys, draw)))
+    return (base + rng.permutation(keys)[:cardinality]).astype(np.uint32)
+
+
+def zipf_draw(rng, keys, count, skew):
+    # count keys, each one at least once, the others with a Zipf(skew) popularity
+    if count < len(keys):
+        raise ValueError("{0} packets cannot carry {1} keys".format(count, len(keys)))
+    extra = count - len(keys)
+    if skew > 0:
+        cdf = np.cumsum(1.0 / np.arange(1, len(keys) + 1) ** skew)
+        index = np.searchsorted(cdf, rng.random(extra) * cdf[-1])
+    else:
+        index = rng.integers(0, len(keys), extra)
+    return rng.permutation(np.concatenate((keys, keys[index])))
+
+
+def payload_sizes(rng, count, spec):
+    # Payload lengths of a size distribution spec (see above)
+    kind, args = spec.split(":")[0], [float(value) for value in spec.split(":")[1:]]
+    if kind == 'uniform':
+        sizes = rng.integers(int(args[0]), int(args[1]) + 1, count)
+    elif kind == 'fixed':
+        sizes = np.full(count, int(args[0]))
+    elif kind == 'bimodal':
+        sizes = np.where(rng.random(count) < args[2], int(args[1]), int(args[0]))
+    elif kind == 'lognormal':
+        sizes = np.rint(rng.lognormal(args[0], args[1], count))
+    else:
+        raise ValueError("unknown size distribution " + spec)
+    return np.clip(sizes, 0, MAX_PAYLOAD).astype(np.uint32)
+
+
+def synthesize(count, dport, src_ips, dst_ips, src_ports, zipf=0.0, syn_ratio=0.2, sizes='uniform:0:1460',
+               src_net='0.0.0.0/0', dst_net='10.0.0.0/8', seed=0):
+    # Packet arrays (snm_pipeline.read_pcap) of count TCP packets to dport
+    rng = np.random.default_rng(seed)
+    payload = payload_sizes(rng, count, sizes)
+    syn = rng.random(count) < syn_ratio
+    return {'is_ip':        np.ones(count, dtype=bool),
+            'is_tcp':       np.ones(count, dtype=bool),
+            'total_len':    payload + 40,
+            'src':          zipf_draw(rng, population(rng, src_ips, src_net), count, zipf),
+            'dst':          zipf_draw(rng, population(rng, dst_ips, dst_net), count, zipf),
+            'sport':        zipf_draw(rng, population(rng, src_ports, None), count, zipf),
+            'dport':        np.full(count, dport, dtype=np.uint32),
+            'flags':        np.where(syn, SYN_FLAG, ACK_FLAG).astype(np.uint32)}
+
+
+def payload_len(packets):
+    return (packets['total_len'].astype(np.int64) - 40) & 0xffff
+
+
+def ground_truth(packets):
+    count, mean, std = welford_model.exact_welford(payload_len(packets))
+    return {'src_ip_card':      len(np.unique(packets['src'])),
+            'dst_ip_card':      len(np.unique(packets['dst'])),
+            'src_ports_card':   len(np.unique(packets['sport'])),
+            'packets':          count,
+            'syn':              int(np.count_nonzero(packets['flags'] & SYN_FLAG)),
+            'mean':             mean,
+            'std':              std}
+
+
+def expected_replies(packets, dport, pipeline=None):
+    # {metric ID: (result1, .., result4)} the switch answers after a reset, the
+    # packets, and a query of each metric in slot 0
+    if pipeline is None:
+        pipeline = snm_pipeline.SnMPipeline()
+    pipeline.set_snm_port(dport)
+    pipeline.reset_all()
+    pipeline.process(packets)
+    return dict(zip(snm_pipeline.METRICS, pipeline.query_all()))
+
+
+def estimates(replies):
+    # The metrics of the replies, as in the ground truth
+    result = dict((name, snm_pipeline.hll_cardinality(*replies[metric_id][:2])) for metric_id, name in METRIC_NAMES.items())
+    counters = replies[snm_pipeline.COUNTERS]
+    result['syn'], result['packets'] = counters[0], counters[1]
+    result['mean'], result['std'] = welford_model.reply_statistics(counters)
+    return result
+
+
+def checksum(words):
+    # One's complement sum of the rows of a matrix of 16-bit words
+    total = words.astype(np.uint64).sum(axis=1)
+    while np.any(total >> 16):
+        total = (total & 0xffff) + (total >> 16)
+    return (~total & 0xffff).astype(np.uint16)
+
+
+def headers(packets):
+    # Ether / IP / TCP headers of the packets, as a (count, HEADER_SIZE) uint8 matrix
+    count = len(packets['src'])
+    eth = np.frombuffer(bytes.fromhex(ETH_DST.replace(':', '') + ETH_SRC.replace(':', '') + '0800'), dtype=np.uint8)
+    ip = np.zeros((count, 10), dtype='>u2')
+    ip[:, 0] = 0x4500
+    ip[:, 1] = packets['total_len']
+    ip[:, 2] = IP_ID
+    ip[:, 4] = (IP_TTL << 8) | snm_pipeline.TCP_TYPE
+    ip[:, 6], ip[:, 7] = packets['src'] >> 16, packets['src'] & 0xffff
+    ip[:, 8], ip[:, 9] = packets['dst'] >> 16, packets['dst'] & 0xffff
+    ip[:, 5] = checksum(ip)
+    tcp = np.zeros((count, 10), dtype='>u2')
+    tcp[:, 0], tcp[:, 1] = packets['sport'], packets['dport']
+    tcp[:, 6] = (5 << 12) | packets['flags']
+    tcp[:, 7] = TCP_WINDOW
+    # The zero payload does not change the checksum, only the length
+    pseudo = np.stack((ip[:, 6], ip[:, 7], ip[:, 8], ip[:, 9], np.full(count, snm_pipeline.TCP_TYPE),
+                       packets['total_len'] - 20), axis=1)
+    tcp[:, 8] = checksum(np.concatenate((pseudo.astype(np.uint64), tcp.astype(np.uint64)), axis=1))
+    return np.concatenate((np.broadcast_to(eth, (count, 14)), ip.view(np.uint8).reshape(count, 20),
+                           tcp.view(np.uint8).reshape(count, 20)), axis=1)
+
+
+def write_pcap(path, packets, chunk=1 << 16):
+    # Zero-padded frames, one microsecond apart
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+        for start in range(0, len(packets['src']), chunk):
+            part = dict((name, values[start:start + chunk]) for name, values in packets.items())
+            frames = headers(part)
+            for i, (row, total_len) in enumerate(zip(frames, part['total_len'].tolist())):
+                size = 14 + total_len
+                f.write(struct.pack('<IIII', (start + i) // 10**6, (start + i) % 10**6, size, size))
+                f.write(row.tobytes())
+                f.write(b'\x00' * (size - HEADER_SIZE))
+
+
+def relative_errors(truth, estimate):
+    return dict((name, (estimate[name] - truth[name]) / float(truth[name]) if truth[name] else 0.0)
+                for name in truth)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sketch accuracy against cardinality on synthetic traffic")
+    parser.add_argument('--cardinalities', default=','.join(str(c) for c in CARDINALITIES))
+    parser.add_argument('--packets-per-key', type=float, default=2.0)
+    parser.add_argument('--dport', type=int, default=72)
+    parser.add_argument('--zipf', type=float, default=0.0)
+    parser.add_argument('--syn-ratio', type=float, default=0.2)
+    parser.add_argument('--sizes', default='uniform:0:1460')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--pcap', default=None, help="write the traffic of the last cardinality")
+    args = parser.parse_args()
+
+    for cardinality in [int(float(value)) for value in args.cardinalities.split(",")]:
+        count = max(int(cardinality * args.packets_per_key), cardinality)
+        packets = synthesize(count, args.dport, cardinality, cardinality, min(cardinality, SOURCE_PORTS),
+                             args.zipf, args.syn_ratio, args.sizes, seed=args.seed)
+        truth = ground_truth(packets)
+        replies = expected_replies(packets, args.dport)
+        estimate = estimates(replies)
+        record = {'cardinality': cardinality, 'packets': count, 'zipf': args.zipf, 'truth': truth,
+                  'estimate': estimate, 'relative_error': relative_errors(truth, estimate),
+                  'replies': dict((metric_id, list(reply)) for metric_id, reply in replies.items())}
+        sys.stdout.write(json.dumps(record, sort_keys=True) + "\n")
+        sys.stdout.flush()
+    if args.pcap:
+        write_pcap(args.pcap, packets)
@@ -0,0 +1,195 @@
+#
+# Copyright (c) 2022 Mario Patetta, Conservatoire National des Arts et Metiers
+# All rights reserved.
+#
+# SBI_engine is free software: you can redistribute it and/or modify it under the terms of
+# the GNU Affero General Public License as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# SBI_engine is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+#
+# Prefix-aggregating compiler for the dstIP / srcIP routing tcams.
+#
+# A route set (prefix -> 4-bit port bitmap, longest prefix match) is reduced
+# to fewer tcam entries with the same lookup result for every address:
+#   - two sibling prefixes with the same port become their parent prefix
+#   - a prefix with the port of its nearest covering prefix is dropped
+# until neither applies. The matching entry at the highest address wins
+# (tcam_priority_encoder.v), so the entries are written from the shortest
+# prefix, at the first address, to the longest one. Addresses without a
+# route do not match any entry, as before the compilation.
+#
+# By default the entries stay below SUBNET_ADDRESS_BASE, the addresses of the
+# S&M subnets (snm_subnets.py). A table is installed with one frame per
+# address below it: the entries, then the unused addresses parked on
+# 0.0.0.0/32 with port NONE, so that the entries of the previous table stop
+# matching. There is no table reset: LUT_RESET clears the whole tcam, the
+# subnet entries included (reset=True does it anyway, the subnets must then
+# be installed again).
+#
+# Routes CSV: prefix,port with port a bitmap or nf0..nf3 names joined by "|"
+#   10.0.0.0/8,nf1
+#   10.1.0.0/16,nf1|nf2
+#
+# Usage: python tcam_compiler.py [--src] [--capacity N] [--pcap frames.pcap] <routes.csv>
+#
+
+import csv, argparse, ipaddress, asyncio
+
+from southbound_headers import *
+import sb_codec
+
+IP_WIDTH        = 32
+IP_MASK         = 2**IP_WIDTH - 1
+PORT_NAMES      = {'none': NONE, 'nf0': NF0, 'nf1': NF1, 'nf2': NF2, 'nf3': NF3}
+IP_TABLES       = {'dst': SouthboundDstIPRouting, 'src': SouthboundSrcIPRouting}
+PARKED_KEY      = "0.0.0.0"
+
+
+def parse_port(value):
+    # 4-bit port bitmap from an int or nf0..nf3 names joined by "|"
+    value = str(value).strip().lower()
+    if value.isdigit():
+        return int(value)
+    port = 0
+    for name in value.split("|"):
+        port |= PORT_NAMES[name.strip()]
+    return port
+
+
+def read_routes(path):
+    # [(prefix, port)] (first line is the header)
+    with open(path, 'r') as f:
+        reader = csv.reader(f)
+        next(reader)
+        return [(row[0].strip(), parse_port(row[1])) for row in reader if row]
+
+
+def normalize(routes):
+    # {(network, prefix length): port} from (prefix, port) pairs or a {prefix: port} dict
+    if isinstance(routes, dict):
+        routes = routes.items()
+    table = {}
+    for prefix, port in routes:
+        n = ipaddress.ip_network(prefix, False)
+        key = (int(n.network_address), n.prefixlen)
+        if table.get(key, port) != port:
+            raise ValueError("{0}: routed to both {1} and {2}".format(n, table[key], port))
+        table[key] = port
+    return table
+
+
+def prefix_mask(length):
+    # Network bits of a prefix length
+    return IP_MASK & ~((1 << (IP_WIDTH - length)) - 1)
+
+
+def covering(table, network, length):
+    # Nearest prefix of the table strictly covering (network, length), None if there is none
+    for parent in range(length - 1, -1, -1):
+        key = (network & prefix_mask(parent), parent)
+        if key in table:
+            return key
+    return None
+
+
+def aggregate(routes):
+    # Smallest {(network, prefix length): port} found by merging the siblings
+    # and dropping the redundant nested prefixes, with the same LPM result
+    table = normalize(routes)
+    changed = True
+    while changed:
+        changed = False
+        # Siblings with the same port make their parent: the parent entry, if
+        # any, was shadowed by the two of them
+        for network, length in sorted(table, key=lambda key: -key[1]):
+            if length == 0 or (network, length) not in table:
+                continue
+            sibling = (network ^ (1 << (IP_WIDTH - length)), length)
+            if table.get(sibling) == table[(network, length)]:
+                port = table.pop((network, length))
+                del table[sibling]
+                table[(network & prefix_mask(length - 1), length - 1)] = port
+                changed = True
+        # Nested prefixes with the port of their nearest covering prefix
+        for network, length in sorted(table, key=lambda key: key[1]):
+            cover = covering(table, network, length)
+            if cover is not None and table[cover] == table[(network, length)]:
+                del table[(network, length)]
+                changed = True
+    return table
+
+
+def compile_routes(routes, capacity=SUBNET_ADDRESS_BASE, first=0):
+    # Tcam entries (key, mask, port, address) of a route set, longest prefixes
+    # at the highest addresses. The mask bits are don't care bits.
+    table = aggregate(routes)
+    if len(table) > capacity:
+        raise ValueError("{0} entries after aggregation, the table has {1}".format(len(table), capacity))
+    entries = []
+    for address, (network, length) in enumerate(sorted(table, key=lambda key: (key[1], key[0])), first):
+        entries.append({'key': str(ipaddress.IPv4Address(network)), 'mask': IP_MASK & ~prefix_mask(length),
+                        'port': table[(network, length)], 'address': address})
+    return entries
+
+
+def lookup(entries, key):
+    # Port of the tcam entries for an address, None without a match
+    key = int(ipaddress.IPv4Address(key))
+    port = None
+    for entry in sorted(entries, key=lambda entry: entry['address']):
+        if ((key ^ int(ipaddress.IPv4Address(entry['key']))) & ~entry['mask'] & IP_MASK) == 0:
+            port = entry['port']
+    return port
+
+
+def park(entries, capacity=SUBNET_ADDRESS_BASE, first=0):
+    # The entries, and the addresses of [first, first + capacity) they leave
+    # unused parked on 0.0.0.0/32
+    used = set(entry['address'] for entry in entries)
+    return list(entries) + [{'key': PARKED_KEY, 'mask': 0, 'port': NONE, 'address': address}
+                            for address in range(first, first + capacity) if address not in used]
+
+
+def route_frames(entries, codec, header, layer=SouthboundDstIPRouting, reset=False, capacity=SUBNET_ADDRESS_BASE, first=0):
+    # SBI frames installing the entries (sb_codec.FrameCodec) over the
+    # addresses of the table, or after a reset of the whole tcam
+    rows = [{'reset': 1}] + entries if reset else park(entries, capacity, first)
+    return codec.encode_batch(layer, [dict(row, check=0) if 'reset' not in row else row for row in rows], header)
+
+
+async def install_routes(controller, entries, layer=SouthboundDstIPRouting, reset=False, capacity=SUBNET_ADDRESS_BASE, first=0):
+    # Write the entries over the addresses of the table (sb_controller.SBIController),
+    # or after a reset of the whole tcam
+    if reset:
+        await controller.request(layer, reset=1)
+    else:
+        entries = park(entries, capacity, first)
+    await asyncio.gather(*[controller.write_route(layer, **entry) for entry in entries])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile a route set into dstIP/srcIP tcam entries")
+    parser.add_argument('routes_csv')
+    parser.add_argument('--src', action='store_true', help="srcIP table (default: dstIP)")
+    parser.add_argument('--capacity', type=int, default=SUBNET_ADDRESS_BASE)
+    parser.add_argument('--switch-id', type=int, default=1)
+    parser.add_argument('--pcap', default=None, help="write the SBI frames to a pcap")
+    args = parser.parse_args()
+    routes = read_routes(args.routes_csv)
+    entries = compile_routes(routes, args.capacity)
+    for entry in entries:
+        print("{address:3d}  {key:>15}  mask=0x{mask:08x}  port=0b{port:04b}".format(**entry))
+    print("{0} routes -> {1} entries".format(len(routes), len(entries)))
+    if args.pcap:
+        codec = sb_codec.FrameCodec(Ether() / IP())
+        frames = route_frames(entries, codec, {'SwitchID': args.switch_id}, IP_TABLES['src' if args.src else 'dst'],
+                              capacity=args.capacity)
+        wrpcap(args.pcap, [Ether(frame) for frame in frames])
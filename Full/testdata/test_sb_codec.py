@@ -0,0 +1,52 @@
+#
+# Copyright (c) 2022 Mario Patetta, Conservatoire National des Arts et Metiers
+# All rights reserved.
+#
+# SBI_engine is free software: you can redistribute it and/or modify it under the terms of
+# the GNU Affero General Public License as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# SBI_engine is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+#
+# Cross-check of sb_codec against the scapy layers of southbound_headers.py.
+#
+# Usage: python -m pytest test_sb_codec.py
+#
+
+import random
+import pytest
+
+from sb_codec import *
+
+LAYERS = sorted(LAYOUTS, key=lambda cls: cls.__name__)
+
+
+@pytest.mark.parametrize('cls', LAYERS, ids=[cls.__name__ for cls in LAYERS])
+def test_codec_matches_scapy(cls):
+    cross_check(cls, random.Random(cls.__name__), rounds=100)
+
+
+@pytest.mark.parametrize('cls', LAYERS, ids=[cls.__name__ for cls in LAYERS])
+def test_encode_batch_matches_encode(cls):
+    rng = random.Random(cls.__name__)
+    codec = FrameCodec(reference_lower())
+    header = {'ControllerID': 1, 'SwitchID': 1}
+    rows = [random_fields(LAYOUTS[cls], rng) for i in range(8)]
+    assert codec.encode_batch(cls, rows, header) == [codec.encode(cls, header, row) for row in rows]
+
+
+def test_decode_ignores_other_frames():
+    lower = reference_lower()
+    assert FrameCodec.decode(bytes(Ether() / IP() / TCP())) is None
+    assert FrameCodec.decode(b'\x00' * 10) is None
+    # A bare Southbound header decodes without a layer
+    message = FrameCodec.decode(bytes(lower.copy() / Southbound(ControllerID=1, SwitchID=2, ACK=1)))
+    assert message.layer is None
+    assert (message.header['ControllerID'], message.header['SwitchID'], message.header['ACK']) == (1, 2, 1)
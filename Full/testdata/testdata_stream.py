@@ -0,0 +1,247 @@
+#
+# Copyright (c) 2022 Mario Patetta, Conservatoire National des Arts et Metiers
+# All rights reserved.
+#
+# SBI_engine is free software: you can redistribute it and/or modify it under the terms of
+# the GNU Affero General Public License as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# SBI_engine is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+#
+# Streaming writer of the SUME simulation stimuli (gen_testdata.py).
+#
+# TestdataStream writes every applied / expected packet to its pcaps as soon
+# as it is given: src.pcap, dst.pcap, and the nf<i>_applied.pcap /
+# nf<i>_expected.pcap of the interfaces that see packets, created on their
+# first packet. The lines sss_sdnet_tuples.write_tuples() appends to the
+# tuple files go through a TupleBuffer and reach the files TUPLE_BATCH
+# tuples at a time, instead of two file opens per packet. A test is a
+# generator of (applied, ingress, expected, egress) steps given to run(), so
+# nothing grows with the number of packets.
+#
+# SnMTraffic generates the S&M data plane traffic of a test and updates the
+# reference models (hll_model.py, welford_model.py) batch by batch for the
+# expected Metric replies.
+#
+#   stream = TestdataStream()
+#   traffic = SnMTraffic(10**6, dport=72)
+#   stream.run(traffic.steps())
+#   dst_ip_card, src_ports_card, counters = traffic.replies()
+#   ...
+#   stream.close()
+#
+
+import random, socket, struct, binascii, collections
+
+from scapy.all import Ether, PcapWriter
+import sss_sdnet_tuples
+import hll_model
+import welford_model
+
+NF_PORT_MAP     = {"nf0":0b00000001, "nf1":0b00000100, "nf2":0b00010000, "nf3":0b01000000, "dma0":0b00000010, "none":0}
+NF_ID_MAP       = {"nf0":0, "nf1":1, "nf2":2, "nf3":3}
+TUPLE_BATCH     = 4096
+TRAFFIC_BATCH   = 4096
+HEADER_SIZE     = 54                                                # Ether + IP + TCP
+SYN_FLAG        = 0x02
+# scapy defaults of the IP / TCP fields
+IP_ID           = 1
+IP_TTL          = 64
+TCP_WINDOW      = 8192
+TCP_TYPE        = 6
+
+
+class TupleBuffer(object):
+    # Stands for open() in sss_sdnet_tuples: the appends are kept in memory
+    # and written to the files by flush()
+
+    def __init__(self, batch=TUPLE_BATCH):
+        self.batch = batch
+        self.chunks = collections.OrderedDict()
+        self.pending = 0
+
+    def __call__(self, name, mode='r'):
+        if 'a' not in mode:
+            self.flush()
+            return open(name, mode)
+        return BufferedFile(self, name)
+
+    def write(self, name, data):
+        self.chunks.setdefault(name, []).append(data)
+
+    # One more tuple: written every batch tuples
+    def tick(self):
+        self.pending += 1
+        if self.pending >= self.batch:
+            self.flush()
+
+    def flush(self):
+        for name, chunks in self.chunks.items():
+            with open(name, 'a') as f:
+                f.write(''.join(chunks))
+        self.chunks.clear()
+        self.pending = 0
+
+
+class BufferedFile(object):
+
+    def __init__(self, buffer, name):
+        self.buffer = buffer
+        self.name = name
+
+    def write(self, data):
+        self.buffer.write(self.name, data)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class TestdataStream(object):
+
+    def __init__(self, batch=TUPLE_BATCH):
+        self.src = PcapWriter("src.pcap")
+        self.dst = PcapWriter("dst.pcap")
+        # nf id -> PcapWriter, opened on the first packet of the interface
+        self.applied = {}
+        self.expected = {}
+        self.counts = collections.Counter()
+        self.times = {}
+        self.time = 0
+        self.tuples = TupleBuffer(batch)
+        sss_sdnet_tuples.open = self.tuples
+
+    def writer(self, writers, name, nf):
+        if nf not in writers:
+            writers[nf] = PcapWriter('nf{0}_{1}.pcap'.format(nf, name))
+        return writers[nf]
+
+    def apply(self, pkt, ingress, time=None):
+        # The next packet of run() comes one tick later
+        if time is None:
+            time = self.time
+        self.time = time + 1
+        sss_sdnet_tuples.sume_tuple_in['pkt_len'] = len(pkt)
+        sss_sdnet_tuples.sume_tuple_in['src_port'] = NF_PORT_MAP[ingress]
+        sss_sdnet_tuples.sume_tuple_expect['pkt_len'] = len(pkt)
+        sss_sdnet_tuples.sume_tuple_expect['src_port'] = NF_PORT_MAP[ingress]
+        pkt.time = time
+        self.src.write(pkt)
+        nf = NF_ID_MAP[ingress]
+        self.writer(self.applied, 'applied', nf).write(pkt)
+        self.counts['nf{0}_applied'.format(nf)] += 1
+        first, last = self.times.get(nf, (time, time))
+        self.times[nf] = (min(first, time), max(last, time))
+
+    def expect(self, pkt, egress):
+        self.dst.write(pkt)
+        sss_sdnet_tuples.sume_tuple_expect['dst_port'] = NF_PORT_MAP[egress]
+        sss_sdnet_tuples.write_tuples()
+        self.tuples.tick()
+        if egress in NF_ID_MAP:
+            nfs = [NF_ID_MAP[egress]]
+        elif egress == 'bcast':
+            nfs = sorted(NF_ID_MAP.values())
+        else:
+            nfs = []
+        for nf in nfs:
+            self.writer(self.expected, 'expected', nf).write(pkt)
+            self.counts['nf{0}_expected'.format(nf)] += 1
+
+    def run(self, steps):
+        # Apply and expect every (applied, ingress, expected, egress) step
+        for applied, ingress, expected, egress in steps:
+            self.apply(applied, ingress)
+            self.expect(expected, egress)
+
+    def close(self):
+        self.tuples.flush()
+        del sss_sdnet_tuples.open
+        for writer in [self.src, self.dst] + list(self.applied.values()) + list(self.expected.values()):
+            writer.close()
+        for nf in sorted(self.times):
+            print("nf{0}_applied: {1} packets, times {2}..{3}".format(nf, self.counts['nf{0}_applied'.format(nf)], *self.times[nf]))
+
+
+def int2ip(address):
+    return socket.inet_ntoa(struct.pack('!I', address))
+
+
+def checksum(data):
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack('!{0}H'.format(len(data) // 2), data))
+    while total >> 16:
+        total = (total & 0xffff) + (total >> 16)
+    return ~total & 0xffff
+
+
+def tcp_frame(eth_dst, eth_src, src, dst, sport, dport, flags, size):
+    # Bytes of pad_pkt(Ether() / IP() / TCP(), size) with the scapy defaults,
+    # built without scapy (src and dst are integers)
+    ip_len = size - 14
+    ip = struct.pack('!BBHHHBBHII', 0x45, 0, ip_len, IP_ID, 0, IP_TTL, TCP_TYPE, 0, src, dst)
+    ip = ip[:10] + struct.pack('!H', checksum(ip)) + ip[12:]
+    tcp = struct.pack('!HHIIBBHHH', sport, dport, 0, 0, 5 << 4, flags, TCP_WINDOW, 0, 0)
+    # The zero padding does not change the checksum, only the length
+    pseudo = struct.pack('!IIBBH', src, dst, 0, TCP_TYPE, ip_len - 20)
+    tcp = tcp[:16] + struct.pack('!H', checksum(pseudo + tcp)) + tcp[18:]
+    ether = binascii.unhexlify(eth_dst.replace(':', '')) + binascii.unhexlify(eth_src.replace(':', '')) + struct.pack('!H', 0x0800)
+    return ether + ip + tcp + b'\x00' * (size - HEADER_SIZE)
+
+
+class SnMTraffic(object):
+    # count TCP packets from src to dport, random dst address in 10.0.0.0/8,
+    # sport and payload size, one SYN every syn_period packets. The packets
+    # are routed to egress and measured by the S&M stages.
+
+    def __init__(self, count, dport, src='10.45.216.75', ingress='nf3', egress='none', syn_period=5,
+                 max_size=1000, eth_dst="11:11:11:11:11:11", eth_src="22:22:22:22:22:22", seed=0, batch=TRAFFIC_BATCH):
+        self.count = count
+        self.dport = dport
+        self.src = src
+        self.ingress = ingress
+        self.egress = egress
+        self.syn_period = syn_period
+        self.max_size = max_size
+        self.eth_dst = eth_dst
+        self.eth_src = eth_src
+        self.seed = seed
+        self.batch = batch
+        self.dst_ip_hll = hll_model.HyperLogLogModel(datain_width=hll_model.IP_ADDR_WIDTH)
+        self.src_port_hll = hll_model.HyperLogLogModel(datain_width=hll_model.TCP_PORT_WIDTH)
+        self.welford = welford_model.WelfordModel()
+
+    def steps(self):
+        rng = random.Random(self.seed)
+        src = struct.unpack('!I', socket.inet_aton(self.src))[0]
+        for start in range(0, self.count, self.batch):
+            n = min(self.batch, self.count - start)
+            dst = [(10 << 24) | rng.randrange(1 << 24) for i in range(n)]
+            sport = [rng.randrange(1 << 16) for i in range(n)]
+            size = [rng.randrange(self.max_size) for i in range(n)]
+            syn = [(start + i) % self.syn_period == 0 for i in range(n)]
+            self.dst_ip_hll.update(dst)
+            self.src_port_hll.update(sport)
+            self.welford.update(size, syn)
+            for i in range(n):
+                # Dissected from its bytes, the packet is not built again by every writer
+                pkt = Ether(tcp_frame(self.eth_dst, self.eth_src, src, dst[i], sport[i], self.dport,
+                                      SYN_FLAG if syn[i] else 0, size[i] + HEADER_SIZE))
+                yield (pkt, self.ingress, pkt, self.egress)
+
+    # Expected (DST_IP_CARD, SRC_PORTS_CARD, COUNTERS) replies once the steps are exhausted
+    def replies(self):
+        return self.dst_ip_hll.read(), self.src_port_hll.read(), self.welford.read()
@@ -0,0 +1,146 @@
+#
+# Copyright (c) 2022 Mario Patetta, Conservatoire National des Arts et Metiers
+# All rights reserved.
+#
+# SBI_engine is free software: you can redistribute it and/or modify it under the terms of
+# the GNU Affero General Public License as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# SBI_engine is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+#
+# Bit-accurate reference model of the welford + SYN counter extern
+# (extern/welford/hdl/EXTERN_welford_template.v, closest_power_of_two.v).
+#
+# The counters and the closest-power-of-two shifts are computed on whole
+# NumPy arrays; only the fixed-point mean/variance recurrence is iterated.
+# As for the hyperloglog model, the extern request FIFO is assumed to be
+# drained between two data plane updates.
+#
+# Replies follow concatenate.v:
+#   result_mean = integer part of the running mean
+#   result_m2   = running (population) variance / 4, i.e. std = sqrt(result_m2 << 2)
+#
+
+import numpy as np
+
+# Default parameters, as set in SnM_metrics.p4 / my_variables.p4
+PKT_SIZE_WIDTH          = 11
+RESULT_SHORT            = 20
+
+MULT_WORD_SIZE          = 18                                        # DSP48E1 has a 24x18 multiplier
+
+
+def closest_power_of_two(pkt_count, input_width=RESULT_SHORT):
+    # closest_power_of_two.v: log2 of the power of two closest to pkt_count
+    # (ties round down), 0 when pkt_count <= 1
+    pkt_count = np.asarray(pkt_count, dtype=np.int64)
+    mask = (1 << input_width) - 1
+    hamming_weight = np.frexp(pkt_count.astype(np.float64))[1].astype(np.int64)
+    next_pow = (np.int64(1) << hamming_weight) & mask
+    prev_pow = next_pow >> 1
+    round_up = ((next_pow - pkt_count) & mask) < ((pkt_count - prev_pow) & mask)
+    shift = np.where(round_up, hamming_weight, hamming_weight - 1)
+    shift = np.where(hamming_weight > 1, shift, 0)
+    return shift & ((1 << int(np.ceil(np.log2(input_width)))) - 1)
+
+
+class WelfordModel(object):
+
+    def __init__(self, datain_width=PKT_SIZE_WIDTH, result_short_width=RESULT_SHORT):
+        if datain_width > MULT_WORD_SIZE:
+            raise ValueError("DATAIN_WIDTH = {0} exceeds the {1}-bit multiplier word".format(datain_width, MULT_WORD_SIZE))
+        self.datain_width = datain_width
+        self.result_short_width = result_short_width
+        self.scaling = MULT_WORD_SIZE - datain_width
+        self.reset()
+
+    # WELF_OP_RESET
+    def reset(self):
+        self.syn_cnt = 0
+        self.pkt_cnt = 0
+        self.mean = 0                                               # signed [DATAIN_WIDTH+SCALING:0]
+        self.variance = 0                                           # signed [2*DATAIN_WIDTH+SCALING:0]
+
+    # WELF_OP_UPDATE on arrays of payload lengths (ip.totalLen - 40) and SYN flags
+    def update(self, payload_len, syn_flag=None):
+        payload_len = np.atleast_1d(np.asarray(payload_len, dtype=np.int64))
+        if payload_len.size == 0:
+            return
+        if syn_flag is None:
+            syn_flag = np.zeros(payload_len.size, dtype=bool)
+        syn_flag = np.atleast_1d(np.asarray(syn_flag, dtype=bool))
+        if syn_flag.size != payload_len.size:
+            raise ValueError("payload_len and syn_flag must have the same length")
+
+        cnt_mask = (1 << self.result_short_width) - 1
+        # newVal = payload_len[10:0], upscaled to the multiplier word
+        scaled_val = (payload_len & ((1 << self.datain_width) - 1)) << self.scaling
+        # The shift only depends on the (already incremented) pkt counter
+        pkt_cnt = (self.pkt_cnt + np.arange(1, payload_len.size + 1, dtype=np.int64)) & cnt_mask
+        shift = closest_power_of_two(pkt_cnt, self.result_short_width)
+
+        # Mean and variance stay within [0, 2**(DATAIN_WIDTH+SCALING)) and
+        # [0, 2**(2*DATAIN_WIDTH+SCALING)): the signed RAM words never wrap.
+        # delta_prod_r[2*MULT_WORD_SIZE -: 2*DATAIN_WIDTH+SCALING+1] is delta1*delta2 >> SCALING
+        scaling = self.scaling
+        mean = self.mean
+        variance = self.variance
+        for x, s in zip(scaled_val.tolist(), shift.tolist()):
+            delta1 = x - mean
+            mean += delta1 >> s
+            variance += (((delta1 * (x - mean)) >> scaling) - variance) >> s
+        self.mean = mean
+        self.variance = variance
+
+        self.syn_cnt = (self.syn_cnt + int(np.count_nonzero(syn_flag))) & cnt_mask
+        self.pkt_cnt = int(pkt_cnt[-1])
+
+    # WELF_OP_READ: returns (result_syn_count, result_pkt_count, result_mean, result_m2)
+    def read(self):
+        res_mask = (1 << self.result_short_width) - 1
+        mean_out = (self.mean >> self.scaling) & ((1 << self.datain_width) - 1)
+        variance_out = (self.variance >> (2 * self.datain_width + self.scaling - self.result_short_width)) & res_mask
+        return (self.syn_cnt, self.pkt_cnt, mean_out, variance_out)
+
+    # WELF_OP_READ_RESET
+    def read_reset(self):
+        reply = self.read()
+        self.reset()
+        return reply
+
+
+# Expected COUNTERS reply to a query issued after resetting the extern and applying the packets
+def welford_reply(payload_len, syn_flag=None, datain_width=PKT_SIZE_WIDTH, result_short_width=RESULT_SHORT):
+    welford = WelfordModel(datain_width, result_short_width)
+    welford.update(payload_len, syn_flag)
+    return welford.read()
+
+
+# Exact floating point statistics of the same (truncated) values: (count, mean, std)
+def exact_welford(payload_len, datain_width=PKT_SIZE_WIDTH):
+    values = np.asarray(payload_len, dtype=np.int64) & ((1 << datain_width) - 1)
+    if values.size == 0:
+        return (0, 0.0, 0.0)
+    return (values.size, float(np.mean(values)), float(np.std(values)))
+
+
+# Mean and standard deviation carried by a COUNTERS reply
+def reply_statistics(reply):
+    return (float(reply[2]), float(reply[3] << 2) ** 0.5)
+
+
+# Absolute and relative error of a COUNTERS reply against exact statistics
+def reply_error(reply, payload_len, datain_width=PKT_SIZE_WIDTH):
+    count, mean, std = exact_welford(payload_len, datain_width)
+    hw_mean, hw_std = reply_statistics(reply)
+    error = {'mean_abs': hw_mean - mean, 'std_abs': hw_std - std}
+    error['mean_rel'] = error['mean_abs'] / mean if mean else 0.0
+    error['std_rel'] = error['std_abs'] / std if std else 0.0
+    return error
@@ -39,6 +39,8 @@
  *
  * - BUCKET_INDEX_WIDTH must be at least 4 (remember that HLL is precise for cardinalities >= (5/2)*m 
  * - HASH_WIDTH can be at maximum 24 --> we could have BUCKET_INDEX_WIDTH = 4 and RARITY_HASH_WIDTH = 16
+ * - OP_READ_RESET returns the same result as OP_READ and clears every bucket right after
+ *   reading it (read-first BRAM): the updates queued behind it go to the next interval
  *
  */
 
@@ -172,6 +174,7 @@ module @MODULE_NAME@
    localparam OP_READ      = 2'd0;
    localparam OP_UPDATE    = 2'd1;
    localparam OP_RESET     = 2'd2;
+   localparam OP_READ_RESET = 2'd3;
    // States
    localparam StIdle        = 3'd0;
    localparam StHllUpdate   = 3'd1;
@@ -184,6 +187,7 @@ module @MODULE_NAME@
    reg  [RARITY_HASH_WIDTH-1:0]    reciprocal;
    reg  [OUTPUT_WIDTH-1:0]         result_r, result_r_next;
    reg  [BUCKET_INDEX_WIDTH-1:0]   empty_buckets_r, empty_buckets_r_next;
+   reg                             clear_r, clear_r_next;
    reg                             valid_out;  
    // Logic
    always @(*) begin
@@ -199,6 +203,7 @@ module @MODULE_NAME@
       data_in_bram = 0; 
       // HLL Read Signals      
       reciprocal = 0;
+      clear_r_next = clear_r;
       result_r_next = result_r;
       empty_buckets_r_next = empty_buckets_r;     
       valid_out = 0;
@@ -221,7 +226,8 @@ module @MODULE_NAME@
                      addr_in_bram             = address_hash;
                      addr_in_bram_r_next      = address_hash;
                      state_r_next = StHllUpdate;
-                  end else if (opCode_fifo == OP_READ) begin
+                  end else if (opCode_fifo == OP_READ || opCode_fifo == OP_READ_RESET) begin
+                     clear_r_next = (opCode_fifo == OP_READ_RESET);
                      addr_in_bram_r_next = 0;
                      state_r_next = StComputeSum;
                   end else if (opCode_fifo == OP_RESET) begin
@@ -253,6 +259,11 @@ module @MODULE_NAME@
          StComputeSum: begin
             // We iteratively read from all the buckets
             addr_in_bram_r_next = addr_in_bram_r + 1;
+            if (clear_r) begin
+                // The BRAM returns the old content of the bucket being cleared
+                we_bram = 1'b1;
+                data_in_bram = RESED_WORD;
+            end
             if ( addr_in_bram_r == (2**BUCKET_INDEX_WIDTH - 1) ) begin
                 state_r_next = StWriteResult;
             end
@@ -308,6 +319,7 @@ module @MODULE_NAME@
    always @(posedge clk_lookup) begin
         // State Machine Registers
         cycle_cnt_r <= cycle_cnt_r_next;
+        clear_r <= clear_r_next;
         // BRAM Register
         addr_in_bram_r <= addr_in_bram_r_next;
         in_rarity_r <= rarity_hash;
@@ -35,6 +35,7 @@
  *
  *  Welford Algorithm for iterative mean and variance estimation.
  *  Added extension for an additional triggerable counter
+ *  OP_READ_RESET returns the metrics a READ would return and clears them in the same cycle
  *
  *  Descrioption: TODO
  *
@@ -108,6 +109,11 @@ module @MODULE_NAME@
      reg  signed    [2*MULT_WORD_SMALL_SIZE:0]             m2_increment,   m2_increment_next;
      reg            [1:0]                                  state,          state_next;
      reg                                                   valid_out,      valid_out_next;
+     // OP_READ_RESET: the reply is taken from hold_tuple, the metrics are already cleared
+     reg                                                   hold,           hold_next;
+     reg            [OUTPUT_WIDTH-1:0]                     hold_tuple,     hold_tuple_next;
+     wire           [OUTPUT_WIDTH-1:0]                     live_tuple,     read_tuple;
+     wire signed    [RES_LONG_WIDTH+2*DELTA_SCALING:0]     m2_read = m2 + m2_increment;
      
      
      // bitwise log2 signals
@@ -150,6 +156,7 @@ module @MODULE_NAME@
      localparam OP_READ      = 2'd0;
      localparam OP_UPDATE    = 2'd1;
      localparam OP_RESET     = 2'd2;
+     localparam OP_READ_RESET = 2'd3;
      
      // State Machine
      always @(*) begin
@@ -157,6 +164,8 @@ module @MODULE_NAME@
          state_next = state;
          rd_en_fifo = 0;
          valid_out_next = 0;
+         hold_next = 0;
+         hold_tuple_next = hold_tuple;
          // Default Metric Updates
          syn_count_next = syn_count;             
          pkt_count_next = pkt_count;
@@ -184,6 +193,14 @@ module @MODULE_NAME@
                              mean_next = 0;
                              m2_next = 0;
                              valid_out_next = 1;
+                         end else if (opCode_fifo == OP_READ_RESET) begin
+                             hold_tuple_next = read_tuple;
+                             hold_next = 1;
+                             syn_count_next = 0;
+                             pkt_count_next = 0;
+                             mean_next = 0;
+                             m2_next = 0;
+                             valid_out_next = 1;
                          end else begin  // Including the case opCode_fifo == OP_READ
                              valid_out_next = 1;
                          end
@@ -218,6 +235,7 @@ module @MODULE_NAME@
          if (rst) begin
              state <= STAGE_ONE;
              valid_out <= 0;
+             hold <= 0;
              syn_count <= 0;
              pkt_count <= 0;
              mean <= 0;
@@ -229,6 +247,8 @@ module @MODULE_NAME@
          end else begin
              state <= state_next;
              valid_out <= valid_out_next;
+             hold <= hold_next;
+             hold_tuple <= hold_tuple_next;
              syn_count <= syn_count_next;
              pkt_count <= pkt_count_next;
              mean <= mean_next;
@@ -253,9 +273,26 @@ module @MODULE_NAME@
          .pkt_count(pkt_count),
          .mean(mean[DATAIN_WIDTH+SCALING-1:0]),
          .m2(m2),
-         .tuple_out(tuple_out_@EXTERN_NAME@_output_DATA)
+         .tuple_out(live_tuple)
      );
      
+     // The metrics a READ issued in this cycle would return
+     concatenate
+     #(
+         .SCALING(SCALING),
+         .RES_SHORT_WIDTH(RES_SHORT_WIDTH),
+         .RES_LONG_WIDTH(RES_LONG_WIDTH),
+         .OUTPUT_WIDTH(OUTPUT_WIDTH)
+     ) concatenate_read_inst (
+         .syn_count(syn_count),
+         .pkt_count(pkt_count),
+         .mean(mean[DATAIN_WIDTH+SCALING-1:0]),
+         .m2(m2_read),
+         .tuple_out(read_tuple)
+     );
+     
+     assign tuple_out_@EXTERN_NAME@_output_DATA = hold ? hold_tuple : live_tuple;
+     
      assign tuple_out_@EXTERN_NAME@_output_VALID = valid_out;    
      
  endmodule
@@ -31,16 +31,18 @@
 #
 
 
-import os, sys, re, cmd, subprocess, shlex, csv
-import numpy as np
-from threading import Thread
+import os, sys
 
 sys.path.append(os.path.expandvars('../../testdata/'))
 from southbound_headers import *
 from nf_sim_tools import *
+from sb_capture import *
+import results_sink
+import hll_estimator
+import campaign
 
 IFACE = "eth1"
-metric_map = {0:"SRC_IP_CARD", 1:"DST_IP_CARD", 2:"SRC_PORTS_CARD", 3:"COUNTERS",}
+CAPTURE_BACKEND = 'mmap'                # 'mmap' (TPACKET_V3 ring + BPF) or 'sniff' (scapy)
 
 DATES = ['0331', '0407', '0414', '0421', '0428', '0505', '0512', '0519', '0526', '0602', '0609', '0616', '0622',
          '0630', '0707', '0714', '0721', '0728', '0804', '0811', '0818', '0825', '0901', '0908', '0915' ,'0922',
@@ -51,106 +53,151 @@ SUBNETS = ['subnetA', 'subnetB', 'subnetC', 'subnetD', 'subnetE', 'subnetF','sub
 
 os.system('sudo ifconfig {0} 10.0.0.11 netmask 255.255.255.0'.format(IFACE))
 
-# HyperLogLog parameters
-SCALING = 15
-m  = 2**8
-am = 0.7213/(1+ (1.079/m))
-K = am*(m**2)
-down_scale = ( 2**(-(SCALING-1)) )
+# HyperLogLog estimator, bias-corrected with the tables of hll_estimator.py
+estimator = hll_estimator.HyperLogLogEstimator()
 
 
 # Global Variables
-new_row = [np.nan,np.nan,0,0,0,0,0,0,0]
 results_name = ''
-day_cnt = 0
-subnet_cnt = 0
-
+tcp_port = None
+# Row of the job being received: tag (tcp port, job position) of its replies,
+# and its values, None until their reply arrives
+job_tag = None
+job_row = [None] * 7
+# COUNTERS reply waiting for the next tagged reply, and the tag before it
+pending_counters = None
+# Rows of the current port, (date, subnet) -> values, for its CSV file
+port_rows = {}
+dropped_rows = 0
+
+# Rows are buffered and flushed in bulk, keyed by (tcp_port, date, subnet)
+sink = results_sink.ResultsSink('results/results.rec')
+
+
+def export_results_file():
+    # Flush the buffered rows and write the CSV file of the current port
+    sink.flush()
+    if (tcp_port is not None):
+        results_sink.export_csv(results_sink.port_records(tcp_port, port_rows), results_name)
 
 def setup_new_results_file(port):
-    global results_name, day_cnt, subnet_cnt
+    global results_name, tcp_port, port_rows
+    export_results_file()
     results_name = 'results/results_' + str(port) + '.csv'
-    day_cnt = 0
-    subnet_cnt = 0
+    tcp_port = port
+    port_rows = {}
+    # A resumed port keeps the rows of the jobs done before the restart
+    # (campaign journal of SnM_test_send.py)
+    if (campaign.start_position(campaign.JOURNAL, port) > 0):
+        records = results_sink.load(sink.path)
+        for row in records[records['tcp_port'] == port].tolist():
+            port_rows[(row[1], row[2])] = row[3:]
     print("new port to analyse: ", port)
-    with open(results_name, 'w') as f1:
-        header = ['Date','Subnet','Src IP Card', 'Dst IP Card', 'Src Port Card', 'SYN Count', 'Pkt Count', 'Mean Size', 'Size Std Dev']
-        writer = csv.writer(f1)
-        writer.writerow(header)
-        f1.close()
-
-def HyperLogLogResult(result_norm,empty_buckets):
-    result = K / ( result_norm * down_scale )
-    if (result_norm == 4194304 and empty_buckets == 0):
-        # Correct the cardinality = 0 case
-        result = 0
-        empty_buckets = 256
-    elif (result < 2.5*m and empty_buckets != 0):
-        # Linear counting for low cardinalities
-        result = m*math.log(float(m)/empty_buckets)
-    return result
-
-def receive_metric(pkt):
-    global new_row, day_cnt, subnet_cnt
-    if (pkt[SouthboundMetric].metricID == SRC_IP_CARD):
-        # Post-process metrics
-        result_norm = pkt[SouthboundMetric].result1
-        empty_buckets = pkt[SouthboundMetric].result2
-        result = HyperLogLogResult(result_norm,empty_buckets)
-        # Update new_row
-        new_row[2] = result
-    elif (pkt[SouthboundMetric].metricID == DST_IP_CARD):
-        # Post-process metrics
-        result_norm = pkt[SouthboundMetric].result1
-        empty_buckets = pkt[SouthboundMetric].result2
-        result = HyperLogLogResult(result_norm,empty_buckets)
-        # Update new_row
-        new_row[3] = result
-    elif (pkt[SouthboundMetric].metricID == SRC_PORTS_CARD):
-        # Post-process metrics
-        result_norm = pkt[SouthboundMetric].result1
-        empty_buckets = pkt[SouthboundMetric].result2
-        result = HyperLogLogResult(result_norm,empty_buckets)
-        # Update new_row
-        new_row[4] = result
-    elif (pkt[SouthboundMetric].metricID == COUNTERS):
+
+def HyperLogLogResult(result_norm,empty_buckets,datain_width=hll_estimator.hll_model.IP_ADDR_WIDTH):
+    return float(estimator.cardinality(result_norm, empty_buckets, datain_width))
+
+def drop_row(reason):
+    global dropped_rows
+    dropped_rows += 1
+    print("row of port {0} job {1} dropped ({2}), {3} so far".format(job_tag[0], job_tag[1], reason, dropped_rows))
+
+def start_job(tag):
+    # Replies of another job: the row of the previous one never completed
+    global job_tag, job_row
+    if (job_tag is not None) and any(value is not None for value in job_row):
+        drop_row("missing replies")
+    job_tag = tag
+    job_row = [None] * 7
+
+def store_row():
+    # Label the row with the date and subnet of its job, and buffer it
+    port, position = job_tag
+    if not (0 <= position < len(DATES) * len(SUBNETS)):
+        drop_row("bad job position")
+        return
+    date, subnet = DATES[position // len(SUBNETS)], SUBNETS[position % len(SUBNETS)]
+    if (job_row[4] <= 1):
+        # Set the row to 0
+        values = (0,0,0,0,0,0,0)
+    else:
+        values = tuple(job_row)
+    sink.add(port, date, subnet, values)
+    if (port == tcp_port):
+        port_rows[(date, subnet)] = values
+
+def receive_metric(metric):
+    # The HLL replies echo the job tag of their request (result3: job
+    # position, result4: tcp port); the COUNTERS reply, sent between the DST
+    # IP and the SRC PORTS requests of the job, gets the tag of the replies
+    # around it, and is dropped when they differ
+    global pending_counters
+    if (metric['metricID'] == COUNTERS):
         # Post-process metrics
-        synCount = pkt[SouthboundMetric].result1
-        pktCount = pkt[SouthboundMetric].result2
-        mean = pkt[SouthboundMetric].result3
-        m2 = pkt[SouthboundMetric].result4
-        if (pktCount > 1) :
-            std = (m2 / (pktCount-1))**(0.5)
-            # Update new_row
-            new_row[5],new_row[6],new_row[7],new_row[8] = (synCount,pktCount,mean,std)
+        synCount = metric['result1']
+        pktCount = metric['result2']
+        mean = metric['result3']
+        m2 = metric['result4']
+        std = (m2 / (pktCount-1))**(0.5) if (pktCount > 1) else 0
+        pending_counters = (job_tag, (synCount,pktCount,mean,std))
+        return
+    tag = (metric['result4'] & 0xffff, metric['result3'])
+    if (tag != job_tag):
+        start_job(tag)
+    if (pending_counters is not None):
+        counters_tag, counters = pending_counters
+        pending_counters = None
+        if (counters_tag == tag):
+            job_row[3:7] = counters
+    # Post-process metrics
+    result_norm = metric['result1']
+    empty_buckets = metric['result2']
+    if (metric['metricID'] == SRC_IP_CARD):
+        job_row[0] = HyperLogLogResult(result_norm,empty_buckets)
+    elif (metric['metricID'] == DST_IP_CARD):
+        job_row[1] = HyperLogLogResult(result_norm,empty_buckets)
+    elif (metric['metricID'] == SRC_PORTS_CARD):
+        job_row[2] = HyperLogLogResult(result_norm,empty_buckets,hll_estimator.hll_model.TCP_PORT_WIDTH)
+        # Last reply of the job
+        if any(value is None for value in job_row):
+            drop_row("missing replies")
         else:
-            # Set new_row to 0
-            new_row[2],new_row[3],new_row[4],new_row[5],new_row[6],new_row[7],new_row[8] = (0,0,0,0,0,0,0)
-        # Update day and subnet
-        new_row[0] = DATES[day_cnt]
-        new_row[1] = SUBNETS[subnet_cnt]
-        subnet_cnt += 1
-        if (subnet_cnt == 9):
-            day_cnt += 1
-            subnet_cnt = 0
-        # Write new_row to file
-        with open(results_name, 'a') as f1:
-            writer = csv.writer(f1)
-            writer.writerow(new_row)
-            f1.close()
+            store_row()
+        job_row[:] = [None] * 7
 
 
-def parse_SB(pkt):
-    if ( (Southbound in pkt) and (pkt[Southbound].ACK == 1) ):
-        if ( (SouthboundMetric in pkt) and pkt[SouthboundMetric].reset == 0 ):
-            receive_metric(pkt)
-        elif ( SouthboundTCPPort in pkt ):
-            setup_new_results_file(pkt[SouthboundTCPPort].port)
+def parse_message(message):
+    if ( (message is not None) and (message.header['ACK'] == 1) ):
+        if ( (message.layer is SouthboundMetric) and message.fields['reset'] == 0 ):
+            receive_metric(message.fields)
+        elif ( message.layer is SouthboundTCPPort ):
+            setup_new_results_file(message.fields['port'])
     else:
         return             
 
+def parse_SB(pkt):
+    parse_message(FrameCodec.decode(raw(pkt)))
+
 
 def main():
-    sniff(iface=IFACE, prn=parse_SB, count=0, store=0)
+    try:
+        if (CAPTURE_BACKEND == 'mmap'):
+            drops = 0
+            blocks = 0
+            with MmapCapture(IFACE) as capture:
+                for message in capture.messages():
+                    parse_message(message)
+                    # Ring counters once per block, not per message (one syscall each)
+                    if (capture.blocks != blocks):
+                        blocks = capture.blocks
+                        stats = capture.stats()
+                        if (stats['drops'] != drops):
+                            drops = stats['drops']
+                            print("capture ring drops: ", drops)
+        else:
+            sniff(iface=IFACE, prn=parse_SB, count=0, store=0)
+    finally:
+        export_results_file()
 
 if __name__ == "__main__":
     main()
@@ -31,13 +31,13 @@
 #
 
 
-import os, sys, re, cmd, subprocess, shlex, time, csv, pandas, numpy, socket, struct, ipaddress
-from threading import Thread
-from collections import Counter
+import os, sys
 
 sys.path.append(os.path.expandvars('../../testdata/'))
 from southbound_headers import *
 from nf_sim_tools import *
+from sb_transport import *
+import pcap_split, slice_cache, campaign
 
 IFACE = "eth1"
 
@@ -49,136 +49,75 @@ MAC3 = "33:33:33:33:33:33"
 CONTROLLER_ID	= 1
 SWITCH_ID	= 1
 
-METRIC_MAP = {'SRC_IP_CARD':SRC_IP_CARD, 'DST_IP_CARD':DST_IP_CARD, 'SRC_PORTS_CARD':SRC_PORTS_CARD, 'COUNTERS':COUNTERS}
-new_row = [0,0,0,0,0,0,0,0,0]
-
 tcp_replay_fmat_string = "sudo tcpdump -nn -t -r {path_to_pcaps}/{pcap_name}.pcap -w-  '{subnet} and tcp dst port {port}' | tcpreplay -t -i {iface} -"
-
-DATES = ['0331', '0407', '0414', '0421', '0428', '0505', '0512', '0519', '0526', '0602', '0609', '0616', '0622',
-         '0630', '0707', '0714', '0721', '0728', '0804', '0811', '0818', '0825', '0901', '0908', '0915' ,'0922',
-         '0929', '1006', '1013', '1020', '1027', '1103', '1110', '1117', '1124', '1201', '1208', '1215', '1222',
-         '1229']
-
-         
-SUBNET_MAP = {'subnetA':1, 'subnetB':2, 'subnetC':3, 'subnetD':4, 'subnetE':5, 'subnetF':6,'subnetG':7, 'subnetH':8, 'subnetI':9}
-
-ports_done = []
-
-
-def f7(seq):
-    seen = set()
-    seen_add = seen.add
-    return [x for x in seq if not (x in seen or seen_add(x))]
-
-def makeMask(subnet):
-    # Return ntw and mask given the subnet
-    n = ipaddress.ip_network(subnet, False)
-    netw = int(n.network_address)
-    mask = int(n.netmask)
-    return (netw,mask)
-
-def fixSubnet(sub):
-    (netw,mask) = makeMask(sub)
-    netw = netw & mask
-    netw_str = socket.inet_ntoa(struct.pack('!L', netw))
-    mask_str = str(list(bin(mask))[2:].count('1'))
-    return (netw_str + '/' + mask_str)
+tcp_replay_slice_fmat_string = "sudo tcpreplay -t -i {iface} {path}"
+
+# Traces, and the slices written by pcap_split.py
+PATH_TO_PCAPS = "pcaps"
+SLICES_DIR = "slices"
+# Cache of the slices filtered on the fly (None to pipe tcpdump into tcpreplay)
+SLICE_CACHE_DIR = "slice_cache"
+SLICE_CACHE_BUDGET = 200 * 2**30
+
+# Campaign: traces and subnets of YEAR, progress journaled in JOURNAL
+YEAR = 2016
+JOURNAL = campaign.JOURNAL
+
+# One raw socket and prebuilt SBI frames for the whole campaign
+sbi = SBISender(IFACE, MAC3, SERVER_MAC, CONTROLLER_ID, SWITCH_ID)
+slices = slice_cache.SliceCache(SLICE_CACHE_DIR, SLICE_CACHE_BUDGET) if SLICE_CACHE_DIR else None
+
+
+def replay_traffic(pcap_name, subnet, subnet_name, tcp_port):
+    # Replay the pre-filtered slice when the day has been split, otherwise filter the trace on the fly
+    if pcap_split.is_split(SLICES_DIR, pcap_name):
+        path = pcap_split.slice_path(SLICES_DIR, pcap_name, tcp_port, subnet_name)
+        if os.path.exists(path):
+            os.system(tcp_replay_slice_fmat_string.format( path=path, iface=IFACE ))
+    elif (slices is not None):
+        path = slices.get(os.path.join(PATH_TO_PCAPS, str(pcap_name) + '.pcap'), subnet + ' and tcp dst port ' + str(tcp_port))
+        if os.path.getsize(path) > pcap_split.PCAP_GLOBAL_HDR:
+            os.system(tcp_replay_slice_fmat_string.format( path=path, iface=IFACE ))
+    else:
+        os.system(tcp_replay_fmat_string.format( path_to_pcaps=PATH_TO_PCAPS, pcap_name=str(pcap_name), subnet=subnet, port=tcp_port, iface=IFACE ))
 
 def send_new_port_sequence(tcp_port):
-    pkt = Ether(dst=MAC3, src=SERVER_MAC) / Southbound(ControllerID=CONTROLLER_ID , SwitchID=SWITCH_ID) / SouthboundTCPPort(port=tcp_port)
-    sendp(pkt, iface=IFACE)
+    sbi.set_tcp_port(tcp_port)
 
 def metric_reset_all():
-    pkt = Ether(dst=MAC3, src=SERVER_MAC) / Southbound(ControllerID=CONTROLLER_ID , SwitchID=SWITCH_ID) / SouthboundMetric(metricID=SRC_IP_CARD, reset=1)
-    sendp(pkt, iface=IFACE)
-    pkt = Ether(dst=MAC3, src=SERVER_MAC) / Southbound(ControllerID=CONTROLLER_ID , SwitchID=SWITCH_ID) / SouthboundMetric(metricID=DST_IP_CARD, reset=1)
-    sendp(pkt, iface=IFACE)
-    pkt = Ether(dst=MAC3, src=SERVER_MAC) / Southbound(ControllerID=CONTROLLER_ID , SwitchID=SWITCH_ID) / SouthboundMetric(metricID=SRC_PORTS_CARD, reset=1)
-    sendp(pkt, iface=IFACE)
-    pkt = Ether(dst=MAC3, src=SERVER_MAC) / Southbound(ControllerID=CONTROLLER_ID , SwitchID=SWITCH_ID) / SouthboundMetric(metricID=COUNTERS, reset=1)
-    sendp(pkt, iface=IFACE)
+    sbi.metric_reset_all()
 
 def metric_query_all():
-    pkt = Ether(dst=MAC3, src=SERVER_MAC) / Southbound(ControllerID=CONTROLLER_ID , SwitchID=SWITCH_ID) / SouthboundMetric(metricID=SRC_IP_CARD)
-    sendp(pkt, iface=IFACE)
-    pkt = Ether(dst=MAC3, src=SERVER_MAC) / Southbound(ControllerID=CONTROLLER_ID , SwitchID=SWITCH_ID) / SouthboundMetric(metricID=DST_IP_CARD)
-    sendp(pkt, iface=IFACE)
-    pkt = Ether(dst=MAC3, src=SERVER_MAC) / Southbound(ControllerID=CONTROLLER_ID , SwitchID=SWITCH_ID) / SouthboundMetric(metricID=SRC_PORTS_CARD)
-    sendp(pkt, iface=IFACE)
-    pkt = Ether(dst=MAC3, src=SERVER_MAC) / Southbound(ControllerID=CONTROLLER_ID , SwitchID=SWITCH_ID) / SouthboundMetric(metricID=COUNTERS)
-    sendp(pkt, iface=IFACE)
-
-# Get port list data frame
-usedPorts_df = pandas.read_csv('port_list.csv',dtype={'port_list':int,'date':str})
-# Extract port list and filter for those that are used at least three days
-port_list = usedPorts_df['port_list'].tolist()
-port_list = [k for k,v in (Counter(port_list)).items() if v>2]
-port_list_tmp = list(set(port_list))
-# Remove the ports already analysed
-port_list = [x for x in port_list_tmp if (x not in ports_done)]
-# Create a list of days for each port
-date_lists = [[] for i in range(len(port_list))]
-for i in range(len(port_list)):
-    dates = usedPorts_df[usedPorts_df['port_list']==port_list[i]]['date'].tolist()
-    dates_tmp = []
-    for day in DATES:
-        if day in dates:
-            try:
-                dates_tmp.extend(DATES[DATES.index(day):DATES.index(day)+11])
-                dates_tmp = f7(dates_tmp)
-            except:
-                None
-    dates = f7(dates_tmp)
-    date_lists[i] = dates
-
-loop_cnt = 0
-with open("subnets/subnets_2016.csv",'r') as f:
-    df = pandas.read_csv(f)
-    for k in range(len(port_list)):                                     # Loop over the ports
-        tcp_port = port_list[k]
-        results_name = 'results_all/results_' + str(tcp_port) + '.csv'
-        # Set tcp port to analyse
-        send_new_port_sequence(tcp_port) 
-        for i in range(len(DATES)):                                     # Loop over the days
-            date = DATES[i]
-            print(date)
-            if (date in date_lists[k]):
-                send_traffic = True
-            else:
-                send_traffic = False
-                print('No traffic')
-            pcap_name = str(20160000 + int(date)) + "1400"
-            for j in range(1,10):                                       # Loop over the subnets
-                cel = df[df['date']==int(date)].iloc[0,j]
-                print("tcp port : ", tcp_port)
-                print("pcap name : ", pcap_name)
-                print("subnet :", cel)
-                # If the subnet is valid, submit the trace
-                if ( cel == cel ):
-                    cel = cel.split("|")
-                    if ( len(cel) == 1 ):
-                        cel[0] = fixSubnet(cel[0])
-                        subnet = "net " + str(cel[0])
-                    elif ( len(cel) == 2 ):
-                        cel[0] = fixSubnet(cel[0])
-                        cel[1] = fixSubnet(cel[1])
-                        subnet = "net " + str(cel[0]) + " or net " + str(cel[1])
-                    # Reset, submit traffic and query
-                    metric_reset_all()
-                    if (send_traffic):
-                        os.system(tcp_replay_fmat_string.format( pcap_name=str(pcap_name), subnet=subnet, port=tcp_port, iface=IFACE ))
-                    metric_query_all()
-                # Otherwise just query all to trigger the receive program
-                else:
-                    metric_query_all()
-    loop_cnt += 1
-    if (loop_cnt%3==0):
-        time.sleep(5*60)
-
-
-
-
-
-
-
-
+    sbi.metric_query_all()
+
+def metric_read_reset_all():
+    sbi.metric_read_reset_all()
+
+def metric_read_reset_job(tcp_port, position):
+    sbi.metric_read_reset_job(tcp_port, position)
+
+# Compile the jobs of the campaign, and resume it from the first job not done
+jobs = campaign.compile_jobs('port_list.csv', "subnets/subnets_{0}.csv".format(YEAR), YEAR)
+journal = campaign.Journal(JOURNAL, jobs)
+print("jobs done: {0}/{1}".format(*journal.progress()))
+for tcp_port, port_jobs in journal.pending():                          # Loop over the ports
+    # Tell the receiver where the port starts (not at its first job after a
+    # crash), set tcp port to analyse, and start from clean metrics: every
+    # query below also resets them for the next job, and carries the port
+    # and the job position the receiver labels the row with
+    journal.start_port(tcp_port, port_jobs[0]['position'])
+    send_new_port_sequence(tcp_port)
+    metric_reset_all()
+    for job in port_jobs:                                               # Loop over the days and subnets
+        print("tcp port : ", tcp_port)
+        print("pcap name : ", job['pcap_name'])
+        print("subnet :", job['filter'])
+        # Submit traffic when the port is active and the subnet is valid, then
+        # query all (which also triggers the receive program)
+        if (job['replay']):
+            replay_traffic(job['pcap_name'], job['filter'], job['subnet'], tcp_port)
+        metric_read_reset_job(tcp_port, job['position'])
+        journal.done(job['seq'])
+    if (slices is not None):
+        slices.report()
+journal.close()
@@ -0,0 +1,222 @@
+#
+# Copyright (c) 2022 Mario Patetta, Conservatoire National des Arts et Metiers
+# All rights reserved.
+#
+# SBI_engine is free software: you can redistribute it and/or modify it under the terms of
+# the GNU Affero General Public License as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# SBI_engine is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+#
+# Resumable measurement campaign of SnM_test_send.py.
+#
+# compile_jobs() turns port_list.csv and subnets_20xx.csv into the job table of
+# the campaign in one vectorized pass: one job per (tcp port, date, subnet),
+# ports used on at least MIN_DAYS rows of port_list.csv, in the order the
+# switch is driven (port, then DATES, then SUBNETS). A job replays its slice
+# when the port was used on one of the WINDOW dates up to its date and the
+# subnet cell is not empty; every job ends with a metric READ_AND_RESET, so
+# that the receiver gets len(DATES) * len(SUBNETS) replies per port.
+#
+# Journal keeps the job table and the progress in a SQLite file: a job is
+# marked done once its READ_AND_RESET is sent, and pending() gives the jobs
+# left, so a campaign that stopped (crash, Ctrl-C) starts again with the
+# first job not done. The journal refuses a job table other than the one it
+# was created with. The READ_AND_RESET of a job carries its port and position,
+# which the receiver labels the reply rows with. Resuming a port in the middle
+# records the position of its first pending job: the receiver reads it with
+# start_position() to reload the rows the port already has.
+#
+#   journal = Journal('campaign.db', compile_jobs('port_list.csv', 'subnets/subnets_2016.csv', 2016))
+#   for port, jobs in journal.pending():
+#       journal.start_port(port, jobs[0]['position'])
+#       ...
+#       journal.done(job['seq'])
+#
+# Usage: python campaign.py [--journal campaign.db] [--year Y] <port_list.csv> <subnets_20xx.csv>
+#
+
+import os, csv, time, sqlite3, hashlib, argparse, itertools
+import numpy as np
+
+import pcap_split
+
+DATES = ['0331', '0407', '0414', '0421', '0428', '0505', '0512', '0519', '0526', '0602', '0609', '0616', '0622',
+         '0630', '0707', '0714', '0721', '0728', '0804', '0811', '0818', '0825', '0901', '0908', '0915' ,'0922',
+         '0929', '1006', '1013', '1020', '1027', '1103', '1110', '1117', '1124', '1201', '1208', '1215', '1222',
+         '1229']
+
+JOURNAL     = 'campaign.db'
+MIN_DAYS    = 3
+WINDOW      = 11                                                    # a port use covers its date and the next 10
+
+JOB_DTYPE = np.dtype([
+    ('seq',         np.int64),
+    ('port',        np.int64),
+    ('position',    np.int64),                                      # index of the job among the ones of its port
+    ('date',        'U4'),
+    ('subnet',      'U8'),
+    ('pcap_name',   'U12'),
+    ('filter',      object),                                        # tcpdump expression, None for an empty cell
+    ('replay',      bool),
+])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS jobs (seq INTEGER PRIMARY KEY, port INTEGER, position INTEGER, date TEXT, subnet TEXT,
+                                 pcap_name TEXT, filter TEXT, replay INTEGER, done_at REAL);
+CREATE TABLE IF NOT EXISTS ports (port INTEGER PRIMARY KEY, position INTEGER, started_at REAL);
+"""
+
+
+class CampaignError(Exception):
+    pass
+
+
+def read_port_list(path):
+    # (ports, dates) columns of port_list.csv
+    with open(path, 'r') as f:
+        rows = [(int(row['port_list']), '{0:04d}'.format(int(row['date']))) for row in csv.DictReader(f)]
+    return np.array([row[0] for row in rows], dtype=np.int64), np.array([row[1] for row in rows], dtype='U4')
+
+
+def active_dates(used_ports, used_dates, dates=DATES, min_days=MIN_DAYS, window=WINDOW):
+    # (ports, active): the ports used on min_days rows at least, and the
+    # (port, date) matrix of the dates they are replayed on
+    ports, counts = np.unique(used_ports, return_counts=True)
+    ports = ports[counts >= min_days]
+    date_index = dict((date, i) for i, date in enumerate(dates))
+    rows = np.array([date in date_index for date in used_dates], dtype=bool) & np.isin(used_ports, ports)
+    port_rows = np.searchsorted(ports, used_ports[rows])
+    date_rows = np.array([date_index[date] for date in used_dates[rows]], dtype=np.int64)
+    # Window start +1, window end -1, then a running sum along the dates
+    edges = np.zeros((len(ports), len(dates) + 1), dtype=np.int64)
+    np.add.at(edges, (port_rows, date_rows), 1)
+    np.add.at(edges, (port_rows, np.minimum(date_rows + window, len(dates))), -1)
+    return ports, np.cumsum(edges, axis=1)[:, :len(dates)] > 0
+
+
+def subnet_filters(subnets_csv, dates=DATES):
+    # (date, subnet) matrix of the tcpdump expressions (None for an empty cell)
+    cells = pcap_split.read_subnets(subnets_csv)
+    missing = [date for date in dates if int(date) not in cells]
+    if missing:
+        raise CampaignError("no subnets for dates {0} in {1}".format(", ".join(missing), subnets_csv))
+    return np.array([[pcap_split.subnet_filter(cell) if cell else None for cell in cells[int(date)]] for date in dates],
+                    dtype=object)
+
+
+def compile_jobs(port_list_csv, subnets_csv, year, dates=DATES, min_days=MIN_DAYS, window=WINDOW):
+    ports, active = active_dates(*read_port_list(port_list_csv), dates=dates, min_days=min_days, window=window)
+    filters = subnet_filters(subnets_csv, dates)
+    subnets = len(pcap_split.SUBNETS)
+    per_port = len(dates) * subnets
+    jobs = np.zeros(len(ports) * per_port, dtype=JOB_DTYPE)
+    jobs['seq'] = np.arange(len(jobs))
+    jobs['port'] = np.repeat(ports, per_port)
+    jobs['position'] = np.tile(np.arange(per_port), len(ports))
+    date_column = np.repeat(np.arange(len(dates)), subnets)
+    jobs['date'] = np.tile(np.array(dates)[date_column], len(ports))
+    jobs['subnet'] = np.tile(pcap_split.SUBNETS, len(ports) * len(dates))
+    jobs['pcap_name'] = np.tile(np.array([str(year * 10000 + int(date)) + "1400" for date in dates])[date_column], len(ports))
+    jobs['filter'] = np.tile(filters.ravel(), len(ports))
+    jobs['replay'] = np.repeat(active, subnets, axis=1).ravel() & (jobs['filter'] != None)
+    return jobs
+
+
+def signature(jobs):
+    # Digest of the job table
+    digest = hashlib.sha1()
+    for name in ('port', 'date', 'subnet', 'pcap_name', 'replay'):
+        digest.update(np.ascontiguousarray(jobs[name]).tobytes())
+    digest.update(repr(jobs['filter'].tolist()).encode())
+    return digest.hexdigest()
+
+
+class Journal(object):
+
+    def __init__(self, path=JOURNAL, jobs=None):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'signature'").fetchone()
+        if jobs is None:
+            if row is None:
+                raise CampaignError("{0} holds no campaign".format(path))
+        elif row is None:
+            with self.db:
+                self.db.executemany("INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, NULL)",
+                                    zip(jobs['seq'].tolist(), jobs['port'].tolist(), jobs['position'].tolist(),
+                                        jobs['date'].tolist(), jobs['subnet'].tolist(), jobs['pcap_name'].tolist(),
+                                        jobs['filter'].tolist(), jobs['replay'].astype(int).tolist()))
+                self.db.execute("INSERT INTO meta VALUES ('signature', ?)", (signature(jobs),))
+                self.db.execute("INSERT INTO meta VALUES ('created_at', ?)", (repr(time.time()),))
+        elif row[0] != signature(jobs):
+            raise CampaignError("{0} was created for another job table (port list or subnets changed)".format(path))
+
+    def pending(self):
+        # (port, jobs) of the ports with jobs left, the jobs as dicts in order
+        cursor = self.db.execute("SELECT seq, port, position, date, subnet, pcap_name, filter, replay FROM jobs "
+                                 "WHERE done_at IS NULL ORDER BY seq")
+        names = [column[0] for column in cursor.description]
+        rows = (dict(zip(names, row)) for row in cursor)
+        return [(port, list(jobs)) for port, jobs in itertools.groupby(rows, key=lambda job: job['port'])]
+
+    def start_port(self, port, position):
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO ports VALUES (?, ?, ?)", (port, position, time.time()))
+
+    def done(self, seq):
+        with self.db:
+            self.db.execute("UPDATE jobs SET done_at = ? WHERE seq = ?", (time.time(), seq))
+
+    def progress(self):
+        # (jobs done, jobs)
+        return self.db.execute("SELECT COUNT(done_at), COUNT(*) FROM jobs").fetchone()
+
+    def close(self):
+        self.db.close()
+
+
+def start_position(path, port):
+    # Position of the first job of the last start of port (0 without a journal)
+    if not os.path.exists(path):
+        return 0
+    db = sqlite3.connect(path)
+    try:
+        row = db.execute("SELECT position FROM ports WHERE port = ?", (port,)).fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    finally:
+        db.close()
+    return row[0] if row else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile the campaign job table and show its progress")
+    parser.add_argument('port_list_csv')
+    parser.add_argument('subnets_csv')
+    parser.add_argument('--journal', default=JOURNAL)
+    parser.add_argument('--year', type=int, default=None, help="default: taken from the subnets file name")
+    args = parser.parse_args()
+
+    year = args.year
+    if year is None:
+        year = int(os.path.splitext(os.path.basename(args.subnets_csv))[0].split('_')[-1])
+    start = time.time()
+    jobs = compile_jobs(args.port_list_csv, args.subnets_csv, year)
+    print("{0} jobs, {1} ports, {2} replays ({3:.2f} s)".format(len(jobs), len(np.unique(jobs['port'])),
+                                                               np.count_nonzero(jobs['replay']), time.time() - start))
+    journal = Journal(args.journal, jobs)
+    done, total = journal.progress()
+    pending = journal.pending()
+    print("{0}/{1} jobs done, next: {2}".format(done, total, "port {0} job {1}".format(pending[0][0], pending[0][1][0]['position'])
+                                                if pending else "none"))
+    journal.close()
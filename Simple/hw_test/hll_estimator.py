@@ -0,0 +1,227 @@
+#
+# Copyright (c) 2022 Mario Patetta, Conservatoire National des Arts et Metiers
+# All rights reserved.
+#
+# SBI_engine is free software: you can redistribute it and/or modify it under the terms of
+# the GNU Affero General Public License as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# SBI_engine is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+#
+# Bias-corrected cardinality estimator of the HyperLogLog replies (HLL++ style).
+#
+# The raw estimate K / (result * down_scale) of the 256-bucket sketch is
+# biased up to ~5m distinct keys, and the extern adds its own quirks (the
+# empty bucket count is truncated: an empty sketch answers 4194304/0).
+# Instead of modelling them, the correction is measured on the bit-accurate
+# model (testdata/hll_model.py):
+#   build_table()   feeds TRIALS random sets of distinct keys to the model,
+#                   reading the sketch at a geometric grid of cardinalities,
+#                   and records for each grid point the mean raw estimate,
+#                   its bias (mean raw estimate - cardinality), and the rms
+#                   relative errors of linear counting and of the
+#                   bias-corrected estimate. One table per key width (IP
+#                   addresses, tcp ports): the extern hash depends on it.
+# The table is written to BIAS_TABLE (CSV) once, offline. The estimate of a
+# reply is then:
+#   - 0 for the reply of a reset sketch (4194304/0, the model's empty reply)
+#   - linear counting m * log(m / empty_buckets), while it stays below the
+#     threshold where it is more accurate than the corrected estimate
+#   - the raw estimate minus the bias interpolated at the raw estimate, up
+#     to the last grid point, the raw estimate above it
+# cardinality() applies it to whole arrays of replies.
+#
+#   estimator = HyperLogLogEstimator()
+#   cards = estimator.cardinality(results, empty_buckets, hll_model.IP_ADDR_WIDTH)
+#
+# Usage: python hll_estimator.py [--build] [--trials N] [--check N] [<hll_bias.csv>]
+#
+
+import os, sys, csv, argparse
+import numpy as np
+
+sys.path.append(os.path.expandvars('../../testdata/'))
+import hll_model
+
+BIAS_TABLE      = 'hll_bias.csv'
+TRIALS          = 64
+GRID_POINTS     = 160
+KEY_WIDTHS      = {hll_model.IP_ADDR_WIDTH: 1 << 22, hll_model.TCP_PORT_WIDTH: 1 << 16}    # key width -> largest cardinality
+TABLE_FIELDS    = ['datain_width', 'bucket_index_width', 'bucket_content_width', 'cardinality',
+                   'raw_estimate', 'bias', 'linear_error', 'corrected_error']
+
+
+def raw_estimate(result, bucket_index_width=hll_model.BUCKET_INDEX_WIDTH,
+                 bucket_content_width=hll_model.BUCKET_CONTENT_WIDTH):
+    # K / (result * down_scale) of an array of results (inf for a 0 result)
+    m = 2 ** bucket_index_width
+    am = 0.7213 / (1 + (1.079 / m))
+    down_scale = 2.0 ** (-(hll_model.rarity_hash_width(bucket_content_width) - 1))
+    result = np.asarray(result, dtype=np.float64)
+    with np.errstate(divide='ignore'):
+        return am * (m ** 2) / (result * down_scale)
+
+
+def linear_counting(empty_buckets, bucket_index_width=hll_model.BUCKET_INDEX_WIDTH):
+    # m * log(m / empty_buckets) (inf without an empty bucket)
+    m = 2 ** bucket_index_width
+    empty_buckets = np.asarray(empty_buckets, dtype=np.float64)
+    with np.errstate(divide='ignore'):
+        return m * np.log(m / empty_buckets)
+
+
+def distinct_keys(rng, count, datain_width):
+    # count distinct random keys of datain_width bits, in random order
+    if datain_width <= 16:
+        return rng.permutation(1 << datain_width)[:count].astype(np.uint64)
+    keys = rng.integers(0, 1 << datain_width, int(count * 1.01) + 16, dtype=np.uint64)
+    unique, first = np.unique(keys, return_index=True)
+    while len(unique) < count:
+        keys = np.concatenate((keys, rng.integers(0, 1 << datain_width, count - len(unique) + 16, dtype=np.uint64)))
+        unique, first = np.unique(keys, return_index=True)
+    return keys[np.sort(first)][:count]
+
+
+def grid(largest, points=GRID_POINTS):
+    return np.unique(np.rint(np.geomspace(1, largest, points)).astype(np.int64))
+
+
+def sample(datain_width, largest, trials=TRIALS, bucket_index_width=hll_model.BUCKET_INDEX_WIDTH,
+           bucket_content_width=hll_model.BUCKET_CONTENT_WIDTH, seed=0):
+    # (cardinalities, results, empty_buckets): the sketch read at every grid
+    # point of every trial, one row per trial
+    cardinalities = grid(largest)
+    results = np.zeros((trials, len(cardinalities)), dtype=np.int64)
+    empty = np.zeros((trials, len(cardinalities)), dtype=np.int64)
+    for trial in range(trials):
+        keys = distinct_keys(np.random.default_rng([seed, datain_width, trial]), cardinalities[-1], datain_width)
+        hll = hll_model.HyperLogLogModel(datain_width, bucket_index_width, bucket_content_width)
+        done = 0
+        for i, cardinality in enumerate(cardinalities):
+            hll.update(keys[done:cardinality])
+            done = cardinality
+            results[trial, i], empty[trial, i] = hll.read()
+    return cardinalities, results, empty
+
+
+def rms(estimates, cardinalities):
+    with np.errstate(invalid='ignore'):
+        return np.sqrt(np.mean(((estimates - cardinalities) / cardinalities.astype(np.float64)) ** 2, axis=0))
+
+
+def build_table(trials=TRIALS, key_widths=KEY_WIDTHS, bucket_index_width=hll_model.BUCKET_INDEX_WIDTH,
+                bucket_content_width=hll_model.BUCKET_CONTENT_WIDTH, seed=0):
+    # Rows (TABLE_FIELDS) of the bias table of every key width
+    rows = []
+    for datain_width in sorted(key_widths):
+        cardinalities, results, empty = sample(datain_width, key_widths[datain_width], trials,
+                                               bucket_index_width, bucket_content_width, seed)
+        raw = raw_estimate(results, bucket_index_width, bucket_content_width)
+        # The interpolation needs increasing raw estimates
+        mean_raw = np.maximum.accumulate(np.mean(raw, axis=0))
+        bias = mean_raw - cardinalities
+        corrected = raw - np.interp(raw, mean_raw, bias)
+        linear = linear_counting(empty, bucket_index_width)
+        for i, cardinality in enumerate(cardinalities):
+            rows.append({'datain_width':            datain_width,
+                         'bucket_index_width':      bucket_index_width,
+                         'bucket_content_width':    bucket_content_width,
+                         'cardinality':             int(cardinality),
+                         'raw_estimate':            float(mean_raw[i]),
+                         'bias':                    float(bias[i]),
+                         'linear_error':            float(rms(linear[:, i], cardinality)),
+                         'corrected_error':         float(rms(corrected[:, i], cardinality))})
+    return rows
+
+
+def write_table(path, rows):
+    with open(path, 'w') as f:
+        writer = csv.DictWriter(f, TABLE_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow(dict((name, '{0:.6g}'.format(value) if isinstance(value, float) else value)
+                                 for name, value in row.items()))
+
+
+def read_table(path):
+    with open(path, 'r') as f:
+        return [dict((name, float(value)) for name, value in row.items()) for row in csv.DictReader(f)]
+
+
+class HyperLogLogEstimator(object):
+
+    def __init__(self, path=BIAS_TABLE, bucket_index_width=hll_model.BUCKET_INDEX_WIDTH,
+                 bucket_content_width=hll_model.BUCKET_CONTENT_WIDTH, rows=None):
+        self.bucket_index_width = bucket_index_width
+        self.bucket_content_width = bucket_content_width
+        self.reset_reply = hll_model.HyperLogLogModel(bucket_index_width=bucket_index_width,
+                                                      bucket_content_width=bucket_content_width).read()
+        if rows is None:
+            rows = read_table(path)
+        # key width -> (raw estimates, biases, linear counting threshold)
+        self.tables = {}
+        for datain_width in set(int(row['datain_width']) for row in rows):
+            table = [row for row in rows if row['datain_width'] == datain_width and
+                     row['bucket_index_width'] == bucket_index_width and row['bucket_content_width'] == bucket_content_width]
+            if not table:
+                continue
+            table.sort(key=lambda row: row['cardinality'])
+            # Linear counting up to the first grid point where it loses
+            # against the corrected estimate (the error of an empty-free
+            # sketch is nan)
+            threshold = 0.0
+            for row in table:
+                if not row['linear_error'] <= row['corrected_error']:
+                    break
+                threshold = row['cardinality']
+            self.tables[datain_width] = (np.array([row['raw_estimate'] for row in table]),
+                                         np.array([row['bias'] for row in table]), threshold)
+
+    def cardinality(self, result, empty_buckets, datain_width=hll_model.IP_ADDR_WIDTH):
+        # Estimates of arrays of (result, empty_buckets) replies
+        result = np.asarray(result)
+        empty_buckets = np.asarray(empty_buckets)
+        raw, bias, threshold = self.tables[datain_width]
+        estimate = raw_estimate(result, self.bucket_index_width, self.bucket_content_width)
+        estimate = np.where(estimate <= raw[-1], estimate - np.interp(estimate, raw, bias), estimate)
+        linear = linear_counting(empty_buckets, self.bucket_index_width)
+        estimate = np.where((empty_buckets != 0) & (linear <= threshold), linear, estimate)
+        reset = (result == self.reset_reply[0]) & (empty_buckets == self.reset_reply[1])
+        return np.where(reset, 0.0, np.maximum(estimate, 0.0))
+
+
+def check(estimator, trials, seed):
+    # rms relative error of the estimate of SnM_test_receive.py (raw, linear
+    # counting below 2.5m) and of the bias-corrected one on fresh key sets
+    for datain_width in sorted(estimator.tables):
+        cardinalities, results, empty = sample(datain_width, KEY_WIDTHS[datain_width], trials,
+                                               estimator.bucket_index_width, estimator.bucket_content_width, seed)
+        raw = raw_estimate(results, estimator.bucket_index_width, estimator.bucket_content_width)
+        raw = np.where((raw < 2.5 * 2 ** estimator.bucket_index_width) & (empty != 0),
+                       linear_counting(empty, estimator.bucket_index_width), raw)
+        corrected = estimator.cardinality(results, empty, datain_width)
+        for i in range(0, len(cardinalities), 8):
+            print("{0:2d}-bit keys {1:>9d}  receiver {2:8.4f}  corrected {3:8.4f}".format(
+                datain_width, cardinalities[i], rms(raw[:, i], cardinalities[i]), rms(corrected[:, i], cardinalities[i])))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HyperLogLog bias tables")
+    parser.add_argument('table', nargs='?', default=BIAS_TABLE)
+    parser.add_argument('--build', action='store_true', help="measure the table on the extern model and write it")
+    parser.add_argument('--trials', type=int, default=TRIALS)
+    parser.add_argument('--check', type=int, default=0, metavar='TRIALS', help="compare the estimators on new key sets")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.build:
+        write_table(args.table, build_table(args.trials, seed=args.seed))
+    if args.check:
+        check(HyperLogLogEstimator(args.table), args.check, args.seed + 1)
@@ -0,0 +1,253 @@
+#
+# Copyright (c) 2022 Mario Patetta, Conservatoire National des Arts et Metiers
+# All rights reserved.
+#
+# SBI_engine is free software: you can redistribute it and/or modify it under the terms of
+# the GNU Affero General Public License as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# SBI_engine is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+#
+# Single-pass pcap splitter.
+#
+# Each day's trace is memory-mapped and walked once. The TCP/IPv4 fields are
+# then gathered for all the packets at once with NumPy, and every packet is
+# classified by (tcp dst port, subnet of subnets_20xx.csv). A packet belongs
+# to a job when its src or dst address is in the subnet and its dst port is the
+# job's port: the same packets as
+#   tcpdump -r <day>.pcap '<subnet> and tcp dst port <port>'
+# The per-job slices are written to <out_dir>/<pcap_name>/<port>_<subnet>.pcap,
+# next to an index of the packet offsets in the source trace (index.npz).
+# The index is written last: a day whose index or one of its slices is
+# missing is split again, and the sender replays a day from the slices only
+# when it is split (a missing slice is then an empty job).
+#
+# Usage: python pcap_split.py <path_to_pcaps> <subnets_20xx.csv> <port_list.csv> <out_dir>
+#
+
+import os, sys, csv, mmap, struct, socket, ipaddress, argparse
+import numpy as np
+
+SUBNETS = ['subnetA', 'subnetB', 'subnetC', 'subnetD', 'subnetE', 'subnetF','subnetG', 'subnetH', 'subnetI']
+
+# pcap file format
+PCAP_MAGIC          = 0xa1b2c3d4
+PCAP_MAGIC_NS       = 0xa1b23c4d
+PCAP_GLOBAL_HDR     = 24
+PCAP_RECORD_HDR     = 16
+LINKTYPE_ETHERNET   = 1
+LINKTYPE_RAW        = (101, 228)
+
+ETH_TYPE_IPV4       = 0x0800
+ETH_TYPE_VLAN       = 0x8100
+TCP_PROTO           = 6
+
+
+def read_subnets(path):
+    # date (int, MMDD) -> list of 9 subnet cells (None when empty). As with
+    # pandas.read_csv, the first line is taken as the header.
+    subnets = {}
+    with open(path, 'r') as f:
+        reader = csv.reader(f)
+        next(reader)
+        for row in reader:
+            cells = [cell if cell else None for cell in row[1:len(SUBNETS) + 1]]
+            subnets[int(row[0])] = cells + [None] * (len(SUBNETS) - len(cells))
+    return subnets
+
+
+def subnet_prefixes(cell):
+    # "a.b.c.d/n|e.f.g.h/m" -> [(network, mask)], host bits cleared as in fixSubnet()
+    prefixes = []
+    for subnet in cell.split("|"):
+        n = ipaddress.ip_network(subnet, False)
+        prefixes.append((int(n.network_address), int(n.netmask)))
+    return prefixes
+
+
+def subnet_filter(cell):
+    # The tcpdump expression of a subnet cell
+    return " or ".join("net " + str(ipaddress.ip_network(subnet, False)) for subnet in cell.split("|"))
+
+
+class PcapIndex(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.buf = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.header = self.buf[:PCAP_GLOBAL_HDR]
+        magic = struct.unpack('<I', self.header[:4])[0]
+        if magic in (PCAP_MAGIC, PCAP_MAGIC_NS):
+            self.endian = '<'
+        elif struct.unpack('>I', self.header[:4])[0] in (PCAP_MAGIC, PCAP_MAGIC_NS):
+            self.endian = '>'
+        else:
+            raise ValueError("{0} is not a pcap file".format(path))
+        self.linktype = struct.unpack(self.endian + 'I', self.header[20:24])[0]
+        self.offsets, self.caplen = self._walk()
+
+    def _walk(self):
+        # Offsets of the record headers and captured lengths
+        record = struct.Struct(self.endian + 'IIII')
+        buf = self.buf
+        end = len(buf) - PCAP_RECORD_HDR
+        offsets = []
+        caplens = []
+        offset = PCAP_GLOBAL_HDR
+        while offset <= end:
+            caplen = record.unpack_from(buf, offset)[2]
+            if offset + PCAP_RECORD_HDR + caplen > len(buf):
+                break                                               # Truncated last record
+            offsets.append(offset)
+            caplens.append(caplen)
+            offset += PCAP_RECORD_HDR + caplen
+        return np.array(offsets, dtype=np.int64), np.array(caplens, dtype=np.int64)
+
+    def tcp_fields(self):
+        # (is_tcp, src, dst, dport) arrays for IPv4/TCP packets (first fragments only)
+        data = np.frombuffer(self.buf, dtype=np.uint8)
+        last = len(data) - 1
+        start = self.offsets + PCAP_RECORD_HDR
+        caplen = self.caplen
+
+        def byte(index):
+            return data[np.minimum(index, last)].astype(np.uint32)
+
+        def be16(index):
+            return (byte(index) << 8) | byte(index + 1)
+
+        def be32(index):
+            return (be16(index) << 16) | be16(index + 2)
+
+        if self.linktype == LINKTYPE_ETHERNET:
+            ether_type = be16(start + 12)
+            vlan = ether_type == ETH_TYPE_VLAN
+            ether_type = np.where(vlan, be16(start + 16), ether_type)
+            l3 = start + np.where(vlan, 18, 14)
+            is_ip = ether_type == ETH_TYPE_IPV4
+        elif self.linktype in LINKTYPE_RAW:
+            l3 = start
+            is_ip = np.ones(len(start), dtype=bool)
+        else:
+            raise ValueError("Unsupported pcap link type {0}".format(self.linktype))
+
+        ihl = (byte(l3) & 0x0f).astype(np.int64) * 4
+        is_tcp = (is_ip & ((byte(l3) >> 4) == 4) & (byte(l3 + 9) == TCP_PROTO)
+                  & ((be16(l3 + 6) & 0x1fff) == 0)
+                  & (l3 - start + ihl + 4 <= caplen))
+        src = be32(l3 + 12)
+        dst = be32(l3 + 16)
+        dport = be16(l3 + ihl + 2)
+        return is_tcp, src, dst, dport
+
+    def write_slice(self, path, records):
+        with open(path, 'wb') as f:
+            f.write(self.header)
+            buf = self.buf
+            for offset, caplen in zip(self.offsets[records].tolist(), self.caplen[records].tolist()):
+                f.write(buf[offset:offset + PCAP_RECORD_HDR + caplen])
+
+    def close(self):
+        self.buf.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def match_prefixes(src, dst, prefixes):
+    # src or dst in any of the (network, mask) prefixes
+    match = np.zeros(len(src), dtype=bool)
+    for network, mask in prefixes:
+        mask = np.uint32(mask)
+        network = np.uint32(network & mask)
+        match |= ((src & mask) == network) | ((dst & mask) == network)
+    return match
+
+
+def classify(pcap, ports, subnet_cells):
+    # {(port, subnet name): record indices}, indices in capture order
+    is_tcp, src, dst, dport = pcap.tcp_fields()
+    candidates = is_tcp & np.isin(dport, np.asarray(list(ports), dtype=np.uint32))
+    jobs = {}
+    for name, cell in zip(SUBNETS, subnet_cells):
+        if cell is None:
+            continue
+        selected = np.nonzero(candidates & match_prefixes(src, dst, subnet_prefixes(cell)))[0]
+        if not len(selected):
+            continue
+        order = np.argsort(dport[selected], kind='stable')
+        selected = selected[order]
+        port_values, first = np.unique(dport[selected], return_index=True)
+        for port, records in zip(port_values.tolist(), np.split(selected, first[1:])):
+            jobs[(port, name)] = records
+    return jobs
+
+
+def day_dir(out_dir, pcap_name):
+    return os.path.join(out_dir, pcap_name)
+
+
+def slice_path(out_dir, pcap_name, port, subnet):
+    return os.path.join(day_dir(out_dir, pcap_name), '{0}_{1}.pcap'.format(port, subnet))
+
+
+def is_split(out_dir, pcap_name):
+    # The index is written after the slices, and lists the non-empty jobs: a
+    # day is split when it has an index and every slice the index lists
+    path = os.path.join(day_dir(out_dir, pcap_name), 'index.npz')
+    if not os.path.exists(path):
+        return False
+    with np.load(path) as index:
+        return all(os.path.exists(os.path.join(day_dir(out_dir, pcap_name), job + '.pcap')) for job in index.files)
+
+
+def split_day(pcap_path, pcap_name, ports, subnet_cells, out_dir):
+    with PcapIndex(pcap_path) as pcap:
+        jobs = classify(pcap, ports, subnet_cells)
+        os.makedirs(day_dir(out_dir, pcap_name), exist_ok=True)
+        for (port, subnet), records in jobs.items():
+            pcap.write_slice(slice_path(out_dir, pcap_name, port, subnet), records)
+        # Offsets of the record headers in the source pcap, per job
+        index = dict(('{0}_{1}'.format(port, subnet), pcap.offsets[records]) for (port, subnet), records in jobs.items())
+        np.savez(os.path.join(day_dir(out_dir, pcap_name), 'index.npz'), **index)
+    return jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split MAWI traces by (tcp dst port, subnet) in one pass")
+    parser.add_argument('path_to_pcaps')
+    parser.add_argument('subnets_csv')
+    parser.add_argument('port_list_csv')
+    parser.add_argument('out_dir')
+    parser.add_argument('--year', type=int, default=None, help="default: taken from the subnets file name")
+    args = parser.parse_args()
+
+    year = args.year
+    if year is None:
+        year = int(os.path.splitext(os.path.basename(args.subnets_csv))[0].split('_')[-1])
+    with open(args.port_list_csv, 'r') as f:
+        ports = sorted(set(int(row['port_list']) for row in csv.DictReader(f)))
+
+    for date, cells in sorted(read_subnets(args.subnets_csv).items()):
+        pcap_name = str(year * 10000 + date) + "1400"
+        pcap_path = os.path.join(args.path_to_pcaps, pcap_name + '.pcap')
+        if not os.path.exists(pcap_path) or is_split(args.out_dir, pcap_name):
+            continue
+        jobs = split_day(pcap_path, pcap_name, ports, cells, args.out_dir)
+        print(pcap_name, ":", len(jobs), "non-empty jobs,", sum(len(r) for r in jobs.values()), "packets")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+#
+# Copyright (c) 2022 Mario Patetta, Conservatoire National des Arts et Metiers
+# All rights reserved.
+#
+# SBI_engine is free software: you can redistribute it and/or modify it under the terms of
+# the GNU Affero General Public License as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# SBI_engine is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+#
+# Batched columnar sink for the metric results.
+#
+# Rows are keyed by (tcp_port, date, subnet), buffered in memory and flushed
+# in bulk as NumPy structured records appended to a single .rec file, or as
+# Parquet parts when pyarrow is available and asked for. load() reads back
+# every flush in one pass (last row wins for a given key) and export_csv()
+# writes the per-port CSV files of SnM_test_receive.py; port_records() gives
+# the records of the rows a receiver kept for its current port, so that the
+# CSV file of a port is written without reading the whole .rec file back.
+#
+# Usage: python results_sink.py <results.rec> <csv_dir>
+#
+
+import os, sys, csv, glob
+import numpy as np
+
+try:
+    import pyarrow, pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+RESULTS_DTYPE = np.dtype([
+    ('tcp_port',        np.uint16),
+    ('date',            'U4'),
+    ('subnet',          'U8'),
+    ('src_ip_card',     np.float64),
+    ('dst_ip_card',     np.float64),
+    ('src_port_card',   np.float64),
+    ('syn_count',       np.uint32),
+    ('pkt_count',       np.uint32),
+    ('mean_size',       np.uint32),
+    ('size_std',        np.float64),
+])
+KEY_FIELDS = ('tcp_port', 'date', 'subnet')
+VALUE_FIELDS = RESULTS_DTYPE.names[len(KEY_FIELDS):]
+
+CSV_HEADER = ['Date','Subnet','Src IP Card', 'Dst IP Card', 'Src Port Card', 'SYN Count', 'Pkt Count', 'Mean Size', 'Size Std Dev']
+
+
+class ResultsSink(object):
+
+    def __init__(self, path, flush_rows=512, parquet=False):
+        if parquet and pyarrow is None:
+            raise ImportError("Parquet output requires pyarrow")
+        self.path = path
+        self.flush_rows = flush_rows
+        self.parquet = parquet
+        # key -> values, in the order the keys were first seen
+        self.rows = {}
+        self.flushed_rows = 0
+        self.flushes = 0
+
+    def add(self, tcp_port, date, subnet, values):
+        # values: (src_ip_card, dst_ip_card, src_port_card, syn_count, pkt_count, mean_size, size_std)
+        self.rows[(int(tcp_port), str(date), str(subnet))] = tuple(values)
+        if len(self.rows) >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        records = np.array([key + values for key, values in self.rows.items()], dtype=RESULTS_DTYPE)
+        if self.parquet:
+            os.makedirs(self.path, exist_ok=True)
+            table = pyarrow.table(dict((name, records[name]) for name in RESULTS_DTYPE.names))
+            pyarrow.parquet.write_table(table, os.path.join(self.path, 'part-{0:06d}-{1}.parquet'.format(self.flushes, os.getpid())))
+        else:
+            with open(self.path, 'ab') as f:
+                records.tofile(f)
+        self.flushed_rows += len(records)
+        self.flushes += 1
+        self.rows.clear()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def load(path):
+    # All the flushed rows, one per key (the last one written), sorted by key
+    if os.path.isdir(path):
+        if pyarrow is None:
+            raise ImportError("Reading Parquet results requires pyarrow")
+        parts = sorted(glob.glob(os.path.join(path, '*.parquet')))
+        if not parts:
+            return np.zeros(0, dtype=RESULTS_DTYPE)
+        table = pyarrow.concat_tables([pyarrow.parquet.read_table(part) for part in parts])
+        records = np.zeros(table.num_rows, dtype=RESULTS_DTYPE)
+        for name in RESULTS_DTYPE.names:
+            records[name] = table.column(name).to_numpy()
+    elif os.path.exists(path):
+        records = np.fromfile(path, dtype=RESULTS_DTYPE)
+    else:
+        return np.zeros(0, dtype=RESULTS_DTYPE)
+    # Keep the last occurrence of every key
+    keys = records[list(KEY_FIELDS)]
+    unique_keys, last = np.unique(keys[::-1], return_index=True)
+    return records[len(records) - 1 - last]
+
+
+def port_records(tcp_port, rows):
+    # Records of the rows {(date, subnet): values} of one port, sorted by key
+    return np.array([(tcp_port,) + key + tuple(values) for key, values in sorted(rows.items())], dtype=RESULTS_DTYPE)
+
+
+def export_csv(records, path, tcp_port=None):
+    if tcp_port is not None:
+        records = records[records['tcp_port'] == tcp_port]
+    with open(path, 'w') as f1:
+        writer = csv.writer(f1)
+        writer.writerow(CSV_HEADER)
+        for row in records.tolist():
+            writer.writerow(row[1:])
+
+
+if __name__ == "__main__":
+    records = load(sys.argv[1])
+    os.makedirs(sys.argv[2], exist_ok=True)
+    for tcp_port in np.unique(records['tcp_port']):
+        export_csv(records, os.path.join(sys.argv[2], 'results_' + str(tcp_port) + '.csv'), tcp_port)
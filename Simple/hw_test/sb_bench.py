@@ -0,0 +1,275 @@
+#
+# Copyright (c) 2022 Mario Patetta, Conservatoire National des Arts et Metiers
+# All rights reserved.
+#
+# SBI_engine is free software: you can redistribute it and/or modify it under the terms of
+# the GNU Affero General Public License as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# SBI_engine is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+#
+# Control plane benchmark.
+#
+# Every Southbound message type bound in southbound_headers.py, plus ALIVE,
+# is sent to a responder running in its own process on the other end of a
+# veth pair, through three paths:
+#   scapy       the frame is built with scapy and sent with sendp(), the ACK
+#               is parsed with scapy (the original SnM_test_send.py path)
+#   codec       sb_codec frames on a persistent raw socket (SBISender)
+#   controller  SBIController requests, CONCURRENCY of them in flight
+# and each (path, message) gets one JSON line: p50/p99 RTT, ops/s, and the
+# CPU time per operation of the controller process.
+#
+# The responder is the emulated switch of sb_switch.py when the headers are
+# the Simple ones, otherwise (or with --echo) a plain bouncer that sets the
+# ACK. Types the responder drops (ALIVE on the Simple switch) are reported
+# with "acked": 0. --baseline compares ops/s against a previous output and
+# exits with 1 on a regression.
+#
+# Usage: sudo python3 sb_bench.py [--create] [--count N] [--baseline results.jsonl] <iface> <peer_iface>
+#
+
+import os, sys, time, json, socket, asyncio, argparse, subprocess, collections, multiprocessing
+import numpy as np
+
+from sb_controller import *
+import sb_switch
+
+SERVER_MAC      = "11:11:11:11:11:11"
+MAC3            = "33:33:33:33:33:33"
+CONTROLLER_ID   = 1
+SWITCH_ID       = 1
+
+PATHS           = ('scapy', 'codec', 'controller')
+COUNT           = 1000
+WARMUP          = 20
+CONCURRENCY     = 32
+TIMEOUT         = 0.1
+REGRESSION      = 0.2                                               # ops/s drop flagged by --baseline
+
+
+class EchoSwitch(object):
+    # Bounces every Southbound frame with the ACK set
+
+    def __init__(self):
+        self.stats = collections.Counter()
+
+    def process(self, frames):
+        replies = []
+        for frame in frames:
+            offset = southbound_offset(frame)
+            if offset is None:
+                continue
+            reply = bytearray(frame)
+            word = int.from_bytes(reply[offset:offset + SOUTHBOUND_SIZE], 'big')
+            reply[offset:offset + SOUTHBOUND_SIZE] = SOUTHBOUND.pack_word({'ACK': 1}, word).to_bytes(SOUTHBOUND_SIZE, 'big')
+            reply[0:6], reply[6:12] = frame[6:12], frame[0:6]
+            replies.append(bytes(reply))
+        return replies
+
+
+def responder(iface, echo):
+    switch = EchoSwitch() if echo else sb_switch.SimpleSwitch()
+    sb_switch.SwitchDaemon(sb_switch.PacketSocketPort(iface), switch).run()
+
+
+def messages():
+    # (name, layer, fields): every bound layer with its default fields, and ALIVE
+    rows = [(BINDINGS[layer].get('SBtype'), layer.__name__, layer, dict(LAYOUTS[layer].defaults)) for layer in LAYOUTS]
+    rows.sort(key=lambda row: row[0])
+    return [(name, layer, fields) for sbtype, name, layer, fields in rows] + [('ALIVE', None, {})]
+
+
+def lower_layers():
+    lower = Ether(dst=MAC3, src=SERVER_MAC)
+    if SB_IP_PROTO is not None:
+        lower = lower / IP()
+    return lower
+
+
+def scapy_packet(layer, fields):
+    pkt = lower_layers() / Southbound(ControllerID=CONTROLLER_ID, SwitchID=SWITCH_ID)
+    if layer is not None:
+        pkt = pkt / layer(**fields)
+    return pkt
+
+
+class AckSocket(object):
+    # Blocking receive of the ACK matching a request
+
+    def __init__(self, iface):
+        proto = SB_ETHER_TYPE if SB_ETHER_TYPE is not None else 0x0800
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(proto))
+        self.sock.bind((iface, proto))
+
+    def drain(self):
+        self.sock.setblocking(False)
+        try:
+            while True:
+                self.sock.recv(2048)
+        except (BlockingIOError, InterruptedError):
+            pass
+        self.sock.setblocking(True)
+
+    def wait(self, key, parse, timeout=TIMEOUT):
+        deadline = time.perf_counter() + timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return None
+            self.sock.settimeout(remaining)
+            try:
+                frame, address = self.sock.recvfrom(2048)
+            except socket.timeout:
+                return None
+            if address[2] == PACKET_OUTGOING:
+                continue
+            message = parse(frame)
+            if message is not None and message.header['ACK'] == 1 and \
+               match_key(message.header['SwitchID'], message.layer, message.fields) == key:
+                return message
+
+    def close(self):
+        self.sock.close()
+
+
+def scapy_parse(frame):
+    # ACK parsed with scapy, returned as an SBMessage
+    pkt = Ether(frame)
+    if Southbound not in pkt:
+        return None
+    sb = pkt[Southbound]
+    header = dict((name, sb.getfieldval(name)) for name in SOUTHBOUND.index)
+    payload = sb.payload
+    if payload is None or type(payload) not in LAYOUTS:
+        return SBMessage(header, None, None)
+    return SBMessage(header, type(payload), dict((name, payload.getfieldval(name)) for name in LAYOUTS[type(payload)].index))
+
+
+def run_sequential(path, iface, layer, fields, count):
+    # One request at a time: returns the RTT of every acknowledged request
+    acks = AckSocket(iface)
+    acks.drain()
+    key = match_key(SWITCH_ID, layer, fields)
+    if path == 'scapy':
+        def send():
+            sendp(scapy_packet(layer, fields), iface=iface, verbose=False)
+        parse = scapy_parse
+    else:
+        transport = RawSocketTransport.get(iface)
+        frame = FrameCodec(lower_layers()).encode(layer, {'ControllerID': CONTROLLER_ID, 'SwitchID': SWITCH_ID}, fields)
+        def send():
+            transport.send(frame)
+        parse = FrameCodec.decode
+    rtts = []
+    try:
+        for i in range(count):
+            start = time.perf_counter()
+            send()
+            if acks.wait(key, parse) is not None:
+                rtts.append(time.perf_counter() - start)
+    finally:
+        acks.close()
+    return rtts
+
+
+async def run_controller(iface, layer, fields, count, concurrency):
+    rtts = []
+    # The RTT starts once the request holds one of the concurrency slots
+    slots = asyncio.Semaphore(concurrency)
+    async with SBIController(iface, MAC3, SERVER_MAC, CONTROLLER_ID, SWITCH_ID, timeout=TIMEOUT, retries=0,
+                             max_in_flight=count) as sbi:
+        async def one():
+            async with slots:
+                start = time.perf_counter()
+                try:
+                    await sbi.request(layer, **fields)
+                except SBITimeout:
+                    return
+                rtts.append(time.perf_counter() - start)
+        await asyncio.gather(*[one() for i in range(count)])
+    return rtts
+
+
+def measure(path, iface, name, layer, fields, count, concurrency):
+    def run(n):
+        if path == 'controller':
+            return asyncio.run(run_controller(iface, layer, fields, n, concurrency))
+        return run_sequential(path, iface, layer, fields, n)
+    run(WARMUP)
+    wall, cpu = time.perf_counter(), time.process_time()
+    rtts = run(count)
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    record = {'path': path, 'message': name, 'count': count, 'acked': len(rtts),
+              'concurrency': concurrency if path == 'controller' else 1}
+    if rtts:
+        rtts = np.array(rtts) * 1e6
+        record.update({'rtt_p50_us': round(float(np.percentile(rtts, 50)), 1),
+                       'rtt_p99_us': round(float(np.percentile(rtts, 99)), 1),
+                       'ops_per_s': round(len(rtts) / wall, 1),
+                       'cpu_us_per_op': round(cpu / len(rtts) * 1e6, 1)})
+    return record
+
+
+def regressions(records, baseline_path, threshold=REGRESSION):
+    # (record, baseline ops/s) of the records slower than the baseline by more than threshold
+    with open(baseline_path, 'r') as f:
+        baseline = dict(((row['path'], row['message']), row) for row in map(json.loads, f) if 'ops_per_s' in row)
+    slow = []
+    for record in records:
+        reference = baseline.get((record['path'], record['message']))
+        if reference is not None and record.get('ops_per_s', 0) < (1 - threshold) * reference['ops_per_s']:
+            slow.append((record, reference['ops_per_s']))
+    return slow
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SBI round-trip and throughput benchmark")
+    parser.add_argument('iface', help="controller side of the veth pair")
+    parser.add_argument('peer', help="responder side of the veth pair")
+    parser.add_argument('--create', action='store_true', help="create the veth pair, and delete it at the end")
+    parser.add_argument('--echo', action='store_true', help="bounce the frames instead of emulating the switch")
+    parser.add_argument('--count', type=int, default=COUNT)
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY)
+    parser.add_argument('--paths', default=','.join(PATHS))
+    parser.add_argument('--output', default=None, help="JSON lines file (default: stdout)")
+    parser.add_argument('--baseline', default=None, help="previous output to compare ops/s against")
+    args = parser.parse_args()
+
+    if args.create:
+        subprocess.check_call(['ip', 'link', 'add', args.iface, 'type', 'veth', 'peer', 'name', args.peer])
+        for iface in (args.iface, args.peer):
+            subprocess.check_call(['ip', 'link', 'set', iface, 'up'])
+    echo = args.echo or 'SouthboundRouting' not in globals()
+    server = multiprocessing.Process(target=responder, args=(args.peer, echo), daemon=True)
+    server.start()
+    time.sleep(0.5)
+    records = []
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        for path in args.paths.split(','):
+            for name, layer, fields in messages():
+                record = measure(path, args.iface, name, layer, fields, args.count, args.concurrency)
+                record['responder'] = 'echo' if echo else 'switch'
+                records.append(record)
+                out.write(json.dumps(record, sort_keys=True) + "\n")
+                out.flush()
+    finally:
+        server.terminate()
+        if out is not sys.stdout:
+            out.close()
+        if args.create:
+            subprocess.call(['ip', 'link', 'del', args.iface])
+    if args.baseline:
+        slow = regressions(records, args.baseline)
+        for record, reference in slow:
+            print("REGRESSION {path} {message}: {ops_per_s} ops/s".format(**record),
+                  "(baseline {0})".format(reference), file=sys.stderr)
+        sys.exit(1 if slow else 0)
@@ -0,0 +1,161 @@
+#
+# Copyright (c) 2022 Mario Patetta, Conservatoire National des Arts et Metiers
+# All rights reserved.
+#
+# SBI_engine is free software: you can redistribute it and/or modify it under the terms of
+# the GNU Affero General Public License as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# SBI_engine is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+#
+# TPACKET_V3 (PACKET_MMAP) capture of SBI ACKs.
+#
+# A classic BPF program attached to the socket lets through only Southbound
+# frames with ACK = 1, so the replayed data traffic never leaves the kernel.
+# The accepted frames are read in place from the mmap'ed ring, block by block,
+# and decoded with sb_codec. stats() returns the ring counters, drops included;
+# it costs a getsockopt() call, so readers poll it when blocks (the count of
+# blocks handed back to the kernel) changes rather than after every frame.
+#
+
+import os, sys, socket, struct, mmap, select, ctypes
+
+sys.path.append(os.path.expandvars('../../testdata/'))
+from sb_codec import *
+
+# linux/if_packet.h, linux/filter.h
+ETH_P_ALL           = 0x0003
+SOL_PACKET          = 263
+SO_ATTACH_FILTER    = 26
+PACKET_RX_RING      = 5
+PACKET_STATISTICS   = 6
+PACKET_VERSION      = 10
+TPACKET_V3          = 2
+TP_STATUS_KERNEL    = 0
+TP_STATUS_USER      = 1
+
+# tpacket_block_desc / tpacket_hdr_v1 and tpacket3_hdr offsets
+BLOCK_STATUS        = 8
+BLOCK_NUM_PKTS      = 12
+TPACKET3_HDR        = struct.Struct('IIIIIIH')                  # next_offset, sec, nsec, snaplen, len, status, mac
+
+# BPF opcodes
+BPF_LD_H_ABS        = 0x28
+BPF_LD_B_ABS        = 0x30
+BPF_LD_B_IND        = 0x50
+BPF_LDX_B_MSH       = 0xb1
+BPF_JEQ_K           = 0x15
+BPF_JSET_K          = 0x45
+BPF_RET_K           = 0x06
+
+
+def sb_ack_filter(snaplen=0xffff):
+    # BPF program accepting only Southbound frames with ACK = 1
+    ack_shift = SOUTHBOUND.index['ACK'][0]
+    ack_byte = (SOUTHBOUND_SIZE * 8 - 1 - ack_shift) // 8
+    ack_mask = 1 << (ack_shift % 8)
+    if SB_ETHER_TYPE is not None:
+        program = [
+            (BPF_LD_H_ABS, 0, 0, 12),
+            (BPF_JEQ_K, 0, 3, SB_ETHER_TYPE),
+            (BPF_LD_B_ABS, 0, 0, 14 + ack_byte),
+            (BPF_JSET_K, 0, 1, ack_mask),
+            (BPF_RET_K, 0, 0, snaplen),
+            (BPF_RET_K, 0, 0, 0),
+        ]
+    else:
+        program = [
+            (BPF_LD_H_ABS, 0, 0, 12),
+            (BPF_JEQ_K, 0, 6, 0x0800),
+            (BPF_LD_B_ABS, 0, 0, 23),
+            (BPF_JEQ_K, 0, 4, SB_IP_PROTO),
+            (BPF_LDX_B_MSH, 0, 0, 14),                          # X = IP header length
+            (BPF_LD_B_IND, 0, 0, 14 + ack_byte),
+            (BPF_JSET_K, 0, 1, ack_mask),
+            (BPF_RET_K, 0, 0, snaplen),
+            (BPF_RET_K, 0, 0, 0),
+        ]
+    return b''.join(struct.pack('HBBI', *insn) for insn in program)
+
+
+class MmapCapture(object):
+
+    def __init__(self, iface, block_size=1 << 20, block_nr=16, frame_size=2048, block_timeout_ms=8, bpf=None):
+        self.iface = iface
+        self.block_size = block_size
+        self.block_nr = block_nr
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, 0)
+
+        # The filter is attached before binding, so no unfiltered frame is queued
+        program = bpf if bpf is not None else sb_ack_filter()
+        self._bpf = ctypes.create_string_buffer(program)
+        fprog = struct.pack('HL', len(program) // 8, ctypes.addressof(self._bpf))
+        self.sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+        self.sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+        # tpacket_req3: block_size, block_nr, frame_size, frame_nr, retire_blk_tov, sizeof_priv, feature_req_word
+        req = struct.pack('IIIIIII', block_size, block_nr, frame_size, (block_size // frame_size) * block_nr,
+                          block_timeout_ms, 0, 0)
+        self.sock.setsockopt(SOL_PACKET, PACKET_RX_RING, req)
+        self.ring = mmap.mmap(self.sock.fileno(), block_size * block_nr, mmap.MAP_SHARED,
+                              mmap.PROT_READ | mmap.PROT_WRITE)
+        self.sock.bind((iface, ETH_P_ALL))
+
+        self.poller = select.poll()
+        self.poller.register(self.sock.fileno(), select.POLLIN | select.POLLERR)
+        self.block = 0
+        self.blocks = 0
+        self.counters = {'packets': 0, 'drops': 0, 'freeze_q_cnt': 0}
+
+    def frames(self, poll_timeout_ms=100, stop=None):
+        # Yields the captured frames as bytes, until stop() returns True
+        ring = self.ring
+        while stop is None or not stop():
+            base = self.block * self.block_size
+            if not struct.unpack_from('I', ring, base + BLOCK_STATUS)[0] & TP_STATUS_USER:
+                self.poller.poll(poll_timeout_ms)
+                continue
+            num_pkts, offset = struct.unpack_from('II', ring, base + BLOCK_NUM_PKTS)
+            offset += base
+            for i in range(num_pkts):
+                next_offset, sec, nsec, snaplen, length, status, mac = TPACKET3_HDR.unpack_from(ring, offset)
+                yield ring[offset + mac:offset + mac + snaplen]
+                offset += next_offset
+            # Hand the block back to the kernel
+            struct.pack_into('I', ring, base + BLOCK_STATUS, TP_STATUS_KERNEL)
+            self.block = (self.block + 1) % self.block_nr
+            self.blocks += 1
+
+    def messages(self, poll_timeout_ms=100, stop=None):
+        # Yields the decoded ACKs (sb_codec.SBMessage)
+        for frame in self.frames(poll_timeout_ms, stop):
+            message = FrameCodec.decode(frame)
+            if message is not None:
+                yield message
+
+    def stats(self):
+        # Running totals of tpacket_stats_v3 (the kernel clears them at every read)
+        packets, drops, freeze_q_cnt = struct.unpack('III', self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, 12))
+        self.counters['packets'] += packets
+        self.counters['drops'] += drops
+        self.counters['freeze_q_cnt'] += freeze_q_cnt
+        return dict(self.counters)
+
+    def close(self):
+        if self.sock is not None:
+            self.ring.close()
+            self.sock.close()
+            self.sock = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,228 @@
+#
+# Copyright (c) 2022 Mario Patetta, Conservatoire National des Arts et Metiers
+# All rights reserved.
+#
+# SBI_engine is free software: you can redistribute it and/or modify it under the terms of
+# the GNU Affero General Public License as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# SBI_engine is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+#
+# Asyncio SBI controller.
+#
+# The switch bounces every SBI frame back to the controller with ACK = 1,
+# rewriting only the metric results and, for routing checks, the port and
+# check_match fields. An ACK is therefore matched to its request on
+# (SwitchID, SBtype, all the other layer fields), e.g. metricID + reset for a
+# metric query. Requests are retransmitted on timeout and any number of them
+# can be in flight at once. RESET and READ_AND_RESET are not: when only the
+# ACK was lost, the switch already cleared the metric, and a retransmitted
+# READ_AND_RESET would return the results of the cleared sketch as if they
+# were the interval's (a late RESET would clear the next interval). They are
+# sent once and raise SBITimeout without an ACK; the caller decides, e.g. a
+# plain query() tells whether the metric was cleared.
+#
+#   async with SBIController(IFACE, MAC3, SERVER_MAC, CONTROLLER_ID, SWITCH_ID) as sbi:
+#       results = await asyncio.gather(*[sbi.query(m) for m in METRICS])
+#
+
+import asyncio, collections, socket
+
+from sb_transport import *
+
+# Fields the switch writes into the ACK
+REPLY_FIELDS = ('result1', 'result2', 'result3', 'result4', 'check_match')
+
+# The layer that sets the target TCP port
+if 'SouthboundSetSnmPort' in globals():
+    SNM_PORT_LAYER = SouthboundSetSnmPort
+else:
+    SNM_PORT_LAYER = SouthboundTCPPort
+
+PACKET_OUTGOING = 4
+
+
+class SBITimeout(Exception):
+    pass
+
+
+def match_fields(layer):
+    if layer is None:
+        return ()
+    names = [name for name, shift, mask, is_ip in LAYOUTS[layer].fields if name not in REPLY_FIELDS]
+    # Routing checks return the port of the matching entry
+    if 'check' in names:
+        names.remove('port')
+    return tuple(names)
+
+
+def match_key(switch_id, layer, fields):
+    if layer is None:
+        return (switch_id, SOUTHBOUND.defaults['SBtype'])
+    return (switch_id, BINDINGS[layer]['SBtype']) + tuple(fields[name] for name in MATCH_FIELDS[layer])
+
+
+MATCH_FIELDS = dict((layer, match_fields(layer)) for layer in LAYOUTS)
+
+
+class SBIController(object):
+
+    def __init__(self, iface, dst_mac, src_mac, controller_id, switch_id, lower=None,
+                 timeout=0.05, retries=3, max_in_flight=64):
+        if lower is None:
+            lower = Ether(dst=dst_mac, src=src_mac)
+            if SB_IP_PROTO is not None:
+                lower = lower / IP()
+        self.iface = iface
+        self.codec = FrameCodec(lower)
+        self.controller_id = controller_id
+        self.switch_id = switch_id
+        self.timeout = timeout
+        self.retries = retries
+        self.max_in_flight = max_in_flight
+        self.transport = None
+        # match key -> FIFO of futures waiting for that ACK
+        self.pending = collections.defaultdict(collections.deque)
+        self.stats = collections.Counter()
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.in_flight = asyncio.Semaphore(self.max_in_flight)
+        proto = SB_ETHER_TYPE if SB_ETHER_TYPE is not None else 0x0800
+        self.transport = RawSocketTransport(self.iface, proto)
+        self.transport.sock.setblocking(False)
+        self.loop.add_reader(self.transport.fileno(), self._receive)
+        return self
+
+    def close(self):
+        if self.transport is not None:
+            self.loop.remove_reader(self.transport.fileno())
+            self.transport.close()
+            self.transport = None
+        for waiters in self.pending.values():
+            for future in waiters:
+                future.cancel()
+        self.pending.clear()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def _receive(self):
+        sock = self.transport.sock
+        while True:
+            try:
+                frame, address = sock.recvfrom(2048)
+            except (BlockingIOError, InterruptedError):
+                return
+            if address[2] == PACKET_OUTGOING:
+                continue
+            message = FrameCodec.decode(frame)
+            if message is None or message.header['ACK'] != 1:
+                continue
+            self.stats['acks'] += 1
+            if message.layer is None and message.header['SBtype'] != SOUTHBOUND.defaults['SBtype']:
+                self.stats['unknown'] += 1
+                continue
+            key = match_key(message.header['SwitchID'], message.layer, message.fields)
+            waiters = self.pending.get(key)
+            while waiters:
+                future = waiters.popleft()
+                if not future.done():
+                    future.set_result(message)
+                    break
+            else:
+                # Late ACK of a retransmitted request, or not ours
+                self.stats['unmatched'] += 1
+
+    async def request(self, layer=None, switch_id=None, retries=None, **fields):
+        # Sends a SBI frame and returns the decoded ACK (an sb_codec.SBMessage),
+        # retransmitted up to retries times (0 for the non-idempotent requests)
+        if switch_id is None:
+            switch_id = self.switch_id
+        if retries is None:
+            retries = self.retries
+        header = {'ControllerID': self.controller_id, 'SwitchID': switch_id}
+        if layer is not None:
+            values = dict(LAYOUTS[layer].defaults)
+            values.update(fields)
+            if 'key' in values and LAYOUTS[layer].index['key'][2]:
+                values['key'] = int2ip(ip2int(values['key']))
+        else:
+            values = {}
+        key = match_key(switch_id, layer, values)
+        frame = self.codec.encode(layer, header, values)
+
+        async with self.in_flight:
+            future = self.loop.create_future()
+            self.pending[key].append(future)
+            try:
+                for attempt in range(retries + 1):
+                    self.transport.send(frame)
+                    self.stats['sent'] += 1
+                    if attempt:
+                        self.stats['retransmits'] += 1
+                    try:
+                        return await asyncio.wait_for(asyncio.shield(future), self.timeout)
+                    except asyncio.TimeoutError:
+                        continue
+                self.stats['timeouts'] += 1
+                raise SBITimeout("No ACK for {0} {1} from switch {2}".format(
+                    layer.__name__ if layer is not None else 'ALIVE', values, switch_id))
+            finally:
+                waiters = self.pending.get(key)
+                if waiters is not None:
+                    if future in waiters:
+                        waiters.remove(future)
+                    if not waiters:
+                        del self.pending[key]
+
+    async def query(self, metric_id, **kwargs):
+        # Returns the metric results (result1, result2, ...)
+        message = await self.request(SouthboundMetric, metricID=metric_id, reset=0, **kwargs)
+        return tuple(message.fields[name] for name in REPLY_FIELDS if name in message.fields)
+
+    async def reset(self, metric_id, **kwargs):
+        # Never retransmitted (see above)
+        await self.request(SouthboundMetric, metricID=metric_id, reset=1, retries=0, **kwargs)
+
+    async def read_reset(self, metric_id, **kwargs):
+        # Returns the metric results and clears the metric in the same request,
+        # never retransmitted (see above)
+        message = await self.request(SouthboundMetric, metricID=metric_id, reset=0, read_reset=1, retries=0, **kwargs)
+        return tuple(message.fields[name] for name in REPLY_FIELDS if name in message.fields)
+
+    async def query_all(self, **kwargs):
+        return await asyncio.gather(*[self.query(metric_id, **kwargs) for metric_id in METRICS])
+
+    async def reset_all(self, **kwargs):
+        await asyncio.gather(*[self.reset(metric_id, **kwargs) for metric_id in METRICS])
+
+    async def read_reset_all(self, **kwargs):
+        return await asyncio.gather(*[self.read_reset(metric_id, **kwargs) for metric_id in METRICS])
+
+    async def set_snm_port(self, port, **kwargs):
+        await self.request(SNM_PORT_LAYER, port=port, **kwargs)
+
+    async def write_route(self, layer, **fields):
+        # e.g. write_route(SouthboundDstIPRouting, key="10.0.0.0", mask=0xff000000, port=NF1, address=3)
+        fields['check'] = 0
+        return await self.request(layer, **fields)
+
+    async def check_route(self, layer, key, **kwargs):
+        # Returns (port, check_match) of the entry matching key; check_match is
+        # None on the layers that do not carry it
+        message = await self.request(layer, key=key, check=1, **kwargs)
+        return (message.fields['port'], message.fields.get('check_match'))
+
+    async def alive(self, **kwargs):
+        await self.request(None, **kwargs)
@@ -0,0 +1,346 @@
+#
+# Copyright (c) 2022 Mario Patetta, Conservatoire National des Arts et Metiers
+# All rights reserved.
+#
+# SBI_engine is free software: you can redistribute it and/or modify it under the terms of
+# the GNU Affero General Public License as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# SBI_engine is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+#
+# Emulated switch: a software stand-in for split_and_merge_simple.p4.
+#
+# SimpleSwitch keeps the switch state (routing tcam, target tcp port register,
+# HLL and welford externs through the bit-accurate models of testdata/) and
+# processes frames the way TopParser / TopPipe / TopDeparser do. Southbound
+# frames are bounced back with ACK = 1, the MAC addresses swapped and the
+# metric results or the routing check port written in place, everything
+# else (padding included) untouched. Data plane frames are routed through the
+# tcam and update the metrics when their tcp dst port is the target one.
+# Frames the parser rejects (unknown Southbound type, ALIVE, non IPv4) are
+# dropped. The data frames between two Southbound frames are processed as one
+# vectorized batch, which keeps the order the externs see.
+#
+# SwitchDaemon attaches a SimpleSwitch to a veth (AF_PACKET socket) or to a TAP
+# device, so that SnM_test_send.py / SnM_test_receive.py / sb_controller.py
+# can run on any Linux box, e.g.
+#
+#   sudo ip link add eth1 type veth peer name sume0
+#   sudo ip link set eth1 up; sudo ip link set sume0 up
+#   sudo python3 sb_switch.py sume0                 # then run the tools on eth1
+#
+# Usage: python3 sb_switch.py [--tap] [--stats SECONDS] <iface>
+#
+
+import os, sys, time, socket, select, fcntl, struct, argparse, collections
+import numpy as np
+
+sys.path.append(os.path.expandvars('../../testdata/'))
+from sb_codec import *
+import hll_model, welford_model
+
+# linux/if_ether.h, linux/if_packet.h, linux/if_tun.h
+ETH_P_ALL           = 0x0003
+PACKET_OUTGOING     = 4
+TUNSETIFF           = 0x400454ca
+IFF_TAP             = 0x0002
+IFF_NO_PI           = 0x1000
+
+# TopParser
+ETH_HDR             = 14
+IP_HDR              = 20
+TCP_HDR             = 20
+IPV4_TYPE           = 0x0800
+TCP_TYPE            = 6
+SYN_MASK            = 0x02
+DATA_HDR            = ETH_HDR + IP_HDR + TCP_HDR
+
+# ipv4_lut_tcam (SBI_engine.p4)
+KEY_WIDTH           = 32
+ADDRESS_WIDTH       = 8
+# RoutingStage: LUT result -> SUME port
+EGRESS              = {NF0: 'nf0', NF1: 'nf1', NF2: 'nf2', NF3: 'nf3'}
+
+RECV_SIZE           = 16384
+BATCH_SIZE          = 1024
+
+HLL_METRICS         = (SRC_IP_CARD, DST_IP_CARD, SRC_PORTS_CARD)
+EMPTY_BUCKETS_MASK  = 2**hll_model.BUCKET_INDEX_WIDTH - 1
+
+# Southbound type -> layout, as TopParser selects on the type only
+LAYOUTS_BY_SBTYPE = dict((BINDINGS[cls]['SBtype'], LAYOUTS[cls]) for cls in LAYOUTS)
+
+
+class LutTcam(object):
+    # ipv4_lut_tcam extern: mask bits are don't care (tcam_line_array.v),
+    # the highest matching address wins, the result is 0 without a match
+
+    def __init__(self, key_width=KEY_WIDTH, address_width=ADDRESS_WIDTH):
+        self.key_width = key_width
+        self.address_width = address_width
+        size = 1 << address_width
+        self.key = np.zeros(size, dtype=np.uint64)
+        self.xmask = np.zeros(size, dtype=np.uint64)
+        self.port = np.zeros(size, dtype=np.uint8)
+        self.active = np.zeros(size, dtype=bool)
+
+    # LUT_UPDATE
+    def update(self, address, key, port, mask=0):
+        address &= (1 << self.address_width) - 1
+        self.key[address] = key & ((1 << self.key_width) - 1)
+        self.xmask[address] = mask & ((1 << self.key_width) - 1)
+        self.port[address] = port
+        self.active[address] = True
+
+    # LUT_READ on an array of keys: returns (match, port)
+    def lookup(self, keys):
+        keys = np.asarray(keys, dtype=np.uint64)
+        match = np.zeros(keys.shape, dtype=bool)
+        port = np.zeros(keys.shape, dtype=np.uint8)
+        for entry in np.nonzero(self.active)[0]:
+            hit = ((keys ^ self.key[entry]) & ~self.xmask[entry]) == 0
+            match |= hit
+            port[hit] = self.port[entry]
+        return match, port
+
+
+class SimpleSwitch(object):
+
+    def __init__(self):
+        self.routing_table = LutTcam()
+        self.target_tcp_port = 0
+        self.src_ip_hll = hll_model.HyperLogLogModel(datain_width=hll_model.IP_ADDR_WIDTH)
+        self.dst_ip_hll = hll_model.HyperLogLogModel(datain_width=hll_model.IP_ADDR_WIDTH)
+        self.src_port_hll = hll_model.HyperLogLogModel(datain_width=hll_model.TCP_PORT_WIDTH)
+        self.welford = welford_model.WelfordModel()
+        self.hlls = {SRC_IP_CARD: self.src_ip_hll, DST_IP_CARD: self.dst_ip_hll, SRC_PORTS_CARD: self.src_port_hll}
+        self.stats = collections.Counter()
+
+    # Frames received in order: returns the frames sent back on the ingress port
+    def process(self, frames):
+        replies = []
+        data = []
+        for frame in frames:
+            ether_type = (frame[12] << 8) | frame[13] if len(frame) >= ETH_HDR else None
+            if ether_type == SB_ETHER_TYPE:
+                if data:
+                    self.data_plane(data)
+                    data = []
+                reply = self.control_plane(frame)
+                if reply is not None:
+                    replies.append(reply)
+            elif ether_type == IPV4_TYPE:
+                data.append(frame)
+            else:
+                self.stats['rejected'] += 1
+        if data:
+            self.data_plane(data)
+        return replies
+
+    # Southbound frame: returns the ACK, None when the parser rejects the frame
+    def control_plane(self, frame):
+        layout = None
+        if len(frame) >= ETH_HDR + SOUTHBOUND_SIZE:
+            header = SOUTHBOUND.unpack(frame, ETH_HDR)
+            layout = LAYOUTS_BY_SBTYPE.get(header['SBtype'])
+        offset = ETH_HDR + SOUTHBOUND_SIZE
+        if layout is None or len(frame) < offset + layout.size:
+            self.stats['rejected'] += 1
+            return None
+        reply = bytearray(frame)
+        fields = layout.unpack(reply, offset)
+        if layout.cls is SouthboundRouting:
+            changes = self.routing(fields)
+        elif layout.cls is SouthboundMetric:
+            changes = self.metric(fields)
+        else:
+            # DstPort_Stage: SouthboundTCPPort writes the target tcp port register
+            self.target_tcp_port = fields['port']
+            changes = {}
+        if changes:
+            word = int.from_bytes(reply[offset:offset + layout.size], 'big')
+            reply[offset:offset + layout.size] = layout.pack_word(changes, word).to_bytes(layout.size, 'big')
+        # Bounce to the controller with the ACK set
+        word = int.from_bytes(reply[ETH_HDR:offset], 'big')
+        reply[ETH_HDR:offset] = SOUTHBOUND.pack_word({'ACK': 1}, word).to_bytes(SOUTHBOUND_SIZE, 'big')
+        reply[0:6], reply[6:12] = frame[6:12], frame[0:6]
+        self.stats[layout.name] += 1
+        return bytes(reply)
+
+    # RoutingStage on a SouthboundRouting: returns the fields written in the ACK
+    def routing(self, fields):
+        key = ip2int(fields['key'])
+        if fields['check'] == 0:
+            self.routing_table.update(fields['address'], key, fields['port'], fields['mask'])
+            return {}
+        match, port = self.routing_table.lookup([key])
+        return {'port': int(port[0])}
+
+    # Metric stages on a SouthboundMetric: returns the fields written in the ACK
+    def metric(self, fields):
+        metric_id = fields['metricID']
+        if metric_id in self.hlls:
+            hll = self.hlls[metric_id]
+            if fields['reset']:
+                hll.reset()
+                result, empty_buckets = 0, 0
+            elif fields['read_reset']:
+                result, empty_buckets = hll.read_reset()
+            else:
+                result, empty_buckets = hll.read()
+            return {'result1': result, 'result2': (fields['result2'] & ~EMPTY_BUCKETS_MASK) | empty_buckets}
+        if metric_id == COUNTERS:
+            if fields['reset']:
+                self.welford.reset()
+                results = (0, 0, 0, 0)
+            elif fields['read_reset']:
+                results = self.welford.read_reset()
+            else:
+                results = self.welford.read()
+            return dict(zip(('result1', 'result2', 'result3', 'result4'), results))
+        return {}
+
+    # TopPipe on consecutive IPv4 frames
+    def data_plane(self, frames):
+        n = len(frames)
+        length = np.fromiter((len(frame) for frame in frames), dtype=np.int64, count=n)
+        hdr = np.frombuffer(b''.join(bytes(frame[:DATA_HDR]).ljust(DATA_HDR, b'\0') for frame in frames),
+                            dtype=np.uint8).reshape(n, DATA_HDR).astype(np.uint32)
+
+        def field(offset, size):
+            value = np.zeros(n, dtype=np.uint32)
+            for i in range(size):
+                value = (value << 8) | hdr[:, offset + i]
+            return value
+
+        is_tcp = hdr[:, ETH_HDR + 9] == TCP_TYPE
+        # The parser rejects the frames too short for the headers it extracts
+        valid = (length >= ETH_HDR + IP_HDR) & (~is_tcp | (length >= DATA_HDR))
+        self.stats['rejected'] += int(n - np.count_nonzero(valid))
+        self.stats['data'] += int(np.count_nonzero(valid))
+        total_len = field(ETH_HDR + 2, 2)
+        src = field(ETH_HDR + 12, 4)
+        dst = field(ETH_HDR + 16, 4)
+        sport = field(ETH_HDR + IP_HDR, 2)
+        dport = field(ETH_HDR + IP_HDR + 2, 2)
+        flags = hdr[:, ETH_HDR + IP_HDR + 13]
+
+        # RoutingStage: the packets without a matching entry are dropped
+        match, port = self.routing_table.lookup(dst[valid])
+        for value, name in EGRESS.items():
+            self.stats[name] += int(np.count_nonzero(match & (port == value)))
+        self.stats['dropped'] += int(np.count_nonzero(~match | ~np.isin(port, list(EGRESS))))
+
+        # S&M stages
+        selected = valid & is_tcp & (dport == self.target_tcp_port)
+        if np.any(selected):
+            self.src_ip_hll.update(src[selected])
+            self.dst_ip_hll.update(dst[selected])
+            self.src_port_hll.update(sport[selected])
+            # payload_len = ip.totalLen - 40 on 16 bits
+            self.welford.update((total_len[selected].astype(np.int64) - 40) & 0xffff,
+                                (flags[selected] & SYN_MASK) != 0)
+            self.stats['measured'] += int(np.count_nonzero(selected))
+
+
+class PacketSocketPort(object):
+    # veth (or any interface) through an AF_PACKET socket
+
+    def __init__(self, iface):
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        self.sock.bind((iface, ETH_P_ALL))
+        self.sock.setblocking(False)
+
+    def recv(self):
+        # Returns None when no frame is waiting
+        while True:
+            try:
+                frame, address = self.sock.recvfrom(RECV_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return None
+            # Our own ACKs
+            if address[2] != PACKET_OUTGOING:
+                return frame
+
+    def send(self, frame):
+        self.sock.send(frame)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        self.sock.close()
+
+
+class TapPort(object):
+    # TAP device: the frames written by the kernel side are the switch ingress
+
+    def __init__(self, iface):
+        self.fd = os.open('/dev/net/tun', os.O_RDWR | os.O_NONBLOCK)
+        fcntl.ioctl(self.fd, TUNSETIFF, struct.pack('16sH', iface.encode(), IFF_TAP | IFF_NO_PI))
+
+    def recv(self):
+        try:
+            return os.read(self.fd, RECV_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return None
+
+    def send(self, frame):
+        os.write(self.fd, frame)
+
+    def fileno(self):
+        return self.fd
+
+    def close(self):
+        os.close(self.fd)
+
+
+class SwitchDaemon(object):
+
+    def __init__(self, port, switch=None):
+        self.port = port
+        self.switch = switch if switch is not None else SimpleSwitch()
+
+    # Wait for frames and drain up to BATCH_SIZE of them
+    def receive(self, timeout=None):
+        if not select.select([self.port], [], [], timeout)[0]:
+            return []
+        frames = []
+        while len(frames) < BATCH_SIZE:
+            frame = self.port.recv()
+            if frame is None:
+                break
+            frames.append(frame)
+        return frames
+
+    def run(self, stats_period=None):
+        last = time.monotonic()
+        while True:
+            for reply in self.switch.process(self.receive(stats_period)):
+                self.port.send(reply)
+            if stats_period is not None and time.monotonic() - last >= stats_period:
+                last = time.monotonic()
+                print(dict(self.switch.stats))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Emulated Split-and-Merge switch answering the SBI")
+    parser.add_argument('iface')
+    parser.add_argument('--tap', action='store_true', help="create/attach the TAP device iface")
+    parser.add_argument('--stats', type=float, default=None, help="print the counters every SECONDS")
+    args = parser.parse_args()
+    port = TapPort(args.iface) if args.tap else PacketSocketPort(args.iface)
+    daemon = SwitchDaemon(port)
+    try:
+        daemon.run(args.stats)
+    except KeyboardInterrupt:
+        print(dict(daemon.switch.stats))
+    finally:
+        port.close()
@@ -0,0 +1,142 @@
+#
+# Copyright (c) 2022 Mario Patetta, Conservatoire National des Arts et Metiers
+# All rights reserved.
+#
+# SBI_engine is free software: you can redistribute it and/or modify it under the terms of
+# the GNU Affero General Public License as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# SBI_engine is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+#
+# Persistent raw-socket transport for the SBI.
+#
+# RawSocketTransport keeps one AF_PACKET socket open per interface, instead of
+# the socket scapy sendp() opens and closes at every call. SBISender builds its
+# frames with sb_codec: the fixed reset/query sequences are encoded once, and
+# are then sent as a batch with a single call.
+#
+# metric_read_reset_job() tags the READ_AND_RESET of a campaign job: the HLL
+# requests carry the job position in result3 and the tcp port in result4,
+# which the HLL stages echo unchanged in their replies. COUNTERS overwrites
+# all its results, so its request is sent between two tagged ones
+# (JOB_METRICS): the receiver attributes a COUNTERS reply to the job only
+# when the replies around it carry the same tag.
+#
+
+import os, sys, socket
+
+sys.path.append(os.path.expandvars('../../testdata/'))
+from sb_codec import *
+
+METRICS = (SRC_IP_CARD, DST_IP_CARD, SRC_PORTS_CARD, COUNTERS)
+JOB_METRICS = (SRC_IP_CARD, DST_IP_CARD, COUNTERS, SRC_PORTS_CARD)
+
+
+class RawSocketTransport(object):
+
+    # Interface name -> open transport
+    _open = {}
+
+    def __init__(self, iface, proto=0):
+        self.iface = iface
+        # With proto=0 the socket only transmits, it never queues received frames
+        self.sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(proto))
+        self.sock.bind((iface, proto))
+        self.sent_frames = 0
+        self.sent_bytes = 0
+
+    @classmethod
+    def get(cls, iface):
+        # Share one socket per interface
+        transport = cls._open.get(iface)
+        if transport is None or transport.sock is None:
+            transport = cls._open[iface] = cls(iface)
+        return transport
+
+    def send(self, frame):
+        self.sent_bytes += self.sock.send(frame)
+        self.sent_frames += 1
+
+    def send_batch(self, frames):
+        send = self.sock.send
+        sent_bytes = 0
+        for frame in frames:
+            sent_bytes += send(frame)
+        self.sent_bytes += sent_bytes
+        self.sent_frames += len(frames)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        if RawSocketTransport._open.get(self.iface) is self:
+            del RawSocketTransport._open[self.iface]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class SBISender(object):
+
+    def __init__(self, iface, dst_mac, src_mac, controller_id, switch_id, transport=None):
+        self.transport = transport if transport is not None else RawSocketTransport.get(iface)
+        self.codec = FrameCodec(Ether(dst=dst_mac, src=src_mac))
+        self.header = {'ControllerID': controller_id, 'SwitchID': switch_id}
+        # Prebuilt frames for the fixed sequences
+        self.reset_frames = self.codec.encode_batch(SouthboundMetric, [{'metricID': m, 'reset': 1} for m in METRICS], self.header)
+        self.query_frames = self.codec.encode_batch(SouthboundMetric, [{'metricID': m} for m in METRICS], self.header)
+        self.read_reset_frames = self.codec.encode_batch(SouthboundMetric, [{'metricID': m, 'read_reset': 1} for m in METRICS], self.header)
+        self.tcp_port_frames = {}
+
+    def frame(self, layer=None, **fields):
+        return self.codec.encode(layer, self.header, fields)
+
+    def send(self, layer=None, **fields):
+        self.transport.send(self.frame(layer, **fields))
+
+    def set_tcp_port(self, tcp_port):
+        frame = self.tcp_port_frames.get(tcp_port)
+        if frame is None:
+            frame = self.tcp_port_frames[tcp_port] = self.frame(SouthboundTCPPort, port=tcp_port)
+        self.transport.send(frame)
+
+    def metric_reset_all(self):
+        self.transport.send_batch(self.reset_frames)
+
+    def metric_query_all(self):
+        self.transport.send_batch(self.query_frames)
+
+    def metric_read_reset_all(self):
+        # Query and start the next interval: one frame per metric instead of two
+        self.transport.send_batch(self.read_reset_frames)
+
+    def metric_read_reset_job(self, tcp_port, position):
+        # READ_AND_RESET of all the metrics, the replies tagged with the job
+        rows = [{'metricID': m, 'read_reset': 1} if m == COUNTERS else
+                {'metricID': m, 'read_reset': 1, 'result3': position, 'result4': tcp_port} for m in JOB_METRICS]
+        self.transport.send_batch(self.codec.encode_batch(SouthboundMetric, rows, self.header))
+
+    def metric_reset(self, metric_id):
+        self.transport.send(self.reset_frames[METRICS.index(metric_id)])
+
+    def metric_query(self, metric_id):
+        self.transport.send(self.query_frames[METRICS.index(metric_id)])
+
+    def metric_read_reset(self, metric_id):
+        self.transport.send(self.read_reset_frames[METRICS.index(metric_id)])
+
+    def close(self):
+        self.transport.close()
@@ -0,0 +1,142 @@
+#
+# Copyright (c) 2022 Mario Patetta, Conservatoire National des Arts et Metiers
+# All rights reserved.
+#
+# SBI_engine is free software: you can redistribute it and/or modify it under the terms of
+# the GNU Affero General Public License as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# SBI_engine is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+#
+# Content-addressed on-disk cache of filtered trace slices.
+#
+# An entry is <cache_dir>/<sha256(sha256(source pcap), filter)>.pcap, so a
+# slice is reused whatever the path or the name of the trace it was cut from.
+# The digest of a source trace is computed once and remembered in
+# sources.json, keyed by path, size and mtime. The mtime of an entry is its
+# last use: when the cache grows over its size budget, the least recently
+# used entries are evicted.
+#
+
+import os, json, hashlib, subprocess
+
+HASH_CHUNK = 1 << 24
+
+tcpdump_fmat_string = "tcpdump -nn -t -r {pcap} -w - '{filter}'"
+
+
+def tcpdump_slice(pcap_path, filter_expr, out_path):
+    # Default producer: the same filter the replay pipeline applies. tcpdump
+    # writes to stdout, and the entry is opened here: tcpdump may drop its
+    # privileges (-Z) and not be allowed to create files in the cache
+    with open(out_path, 'wb') as out:
+        subprocess.check_call(tcpdump_fmat_string.format(pcap=pcap_path, filter=filter_expr),
+                              shell=True, stdout=out, stderr=subprocess.DEVNULL)
+
+
+class SliceCache(object):
+
+    def __init__(self, cache_dir, max_bytes=100 * 2**30, produce=tcpdump_slice, verbose=True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.produce = produce
+        self.verbose = verbose
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self.sources_path = os.path.join(cache_dir, 'sources.json')
+        self.sources = {}
+        if os.path.exists(self.sources_path):
+            with open(self.sources_path, 'r') as f:
+                self.sources = json.load(f)
+
+    def source_digest(self, pcap_path):
+        path = os.path.realpath(pcap_path)
+        st = os.stat(path)
+        known = self.sources.get(path)
+        if known is not None and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+            return known[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                digest.update(chunk)
+        self.sources[path] = [st.st_size, st.st_mtime_ns, digest.hexdigest()]
+        tmp_path = self.sources_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.sources, f)
+        os.replace(tmp_path, self.sources_path)
+        return self.sources[path][2]
+
+    def key(self, pcap_path, filter_expr):
+        filter_expr = " ".join(filter_expr.split())
+        return hashlib.sha256((self.source_digest(pcap_path) + '\0' + filter_expr).encode()).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key + '.pcap')
+
+    def get(self, pcap_path, filter_expr):
+        # Path of the slice of pcap_path selected by filter_expr, produced on a miss
+        path = self.entry_path(self.key(pcap_path, filter_expr))
+        if os.path.exists(path):
+            self.hits += 1
+            os.utime(path, None)
+            if self.verbose:
+                print("slice cache hit  :", os.path.basename(pcap_path), filter_expr)
+            return path
+        self.misses += 1
+        if self.verbose:
+            print("slice cache miss :", os.path.basename(pcap_path), filter_expr)
+        tmp_path = path + '.{0}.tmp'.format(os.getpid())
+        try:
+            self.produce(pcap_path, filter_expr, tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict(keep=path)
+        return path
+
+    def entries(self):
+        # [(mtime, size, path)] of the cached slices, least recently used first
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.pcap'):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return sorted(entries)
+
+    def evict(self, keep=None):
+        entries = self.entries()
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            os.remove(path)
+            total -= size
+            self.evictions += 1
+        return total
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+                'bytes': sum(size for mtime, size, path in self.entries())}
+
+    def report(self):
+        stats = self.stats()
+        print("slice cache : {0} hits, {1} misses ({2:.1%} hit rate), {3} evictions, {4:.1f} MB".format(
+            stats['hits'], stats['misses'], stats['hit_rate'], stats['evictions'], stats['bytes'] / 2.0**20))
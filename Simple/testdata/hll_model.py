@@ -0,0 +1,139 @@
+#
+# Copyright (c) 2022 Mario Patetta, Conservatoire National des Arts et Metiers
+# All rights reserved.
+#
+# SBI_engine is free software: you can redistribute it and/or modify it under the terms of
+# the GNU Affero General Public License as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# SBI_engine is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+#
+# Bit-accurate reference model of the hyperloglog extern
+# (extern/hyperloglog/hdl/EXTERN_hyperloglog_template.v).
+#
+# Every stage works on NumPy arrays, so a whole trace is hashed and merged
+# into the buckets in a single call. The model assumes the extern request
+# FIFO is drained between two data plane updates (i.e. at most one update in
+# flight), which always holds for packets longer than 64B.
+#
+# A READ sums the 2**BUCKET_INDEX_WIDTH buckets once: this is what the
+# reference replies of this tree give (gen_testdata.py expects 3253888/169
+# and 1061504/17, and an empty sketch answers 4194304/0). The Full model adds
+# the bucket addressed before the READ as an extra first term, which its own
+# reference replies need; the Simple ones do not, so this model does not.
+#
+
+import numpy as np
+
+# Default parameters, as set in SnM_metrics.p4 / SBI_engine.p4
+IP_ADDR_WIDTH           = 32
+TCP_PORT_WIDTH          = 16
+BUCKET_INDEX_WIDTH      = 8
+BUCKET_CONTENT_WIDTH    = 4
+RESULT_WIDTH            = 24
+
+# hash_function.v
+MULT_WORD_SIZE          = 24                                        # DSP48E1 has a 24x18 multiplier
+MULT_WORD_MASK          = (1 << MULT_WORD_SIZE) - 1
+HASH_SEEDS              = (0x041a7, 0x23af1)
+
+
+def rarity_hash_width(bucket_content_width):
+    return (1 << bucket_content_width) - 1
+
+
+def hash_function(keys, datain_width=IP_ADDR_WIDTH, bucket_index_width=BUCKET_INDEX_WIDTH,
+                  bucket_content_width=BUCKET_CONTENT_WIDTH):
+    # Returns the (address_hash, rarity_hash) arrays computed by hash_function.v
+    rarity_width = rarity_hash_width(bucket_content_width)
+    hash_width = bucket_index_width + rarity_width
+    half_width = datain_width // 2
+    if hash_width > MULT_WORD_SIZE:
+        raise ValueError("HASH_WIDTH = {0} exceeds the {1}-bit multiplier word".format(hash_width, MULT_WORD_SIZE))
+    if half_width > MULT_WORD_SIZE:
+        raise ValueError("DATAIN_WIDTH = {0} does not fit in two multiplier words".format(datain_width))
+
+    keys = np.asarray(keys, dtype=np.uint64)
+    half_mask = np.uint64((1 << half_width) - 1)
+    key_slice = (keys & half_mask,
+                 (keys >> np.uint64(half_width)) & half_mask)
+
+    # The product is evaluated on MULT_WORD_SIZE bits before being shifted
+    shift = np.uint64(MULT_WORD_SIZE - hash_width)
+    mult_result = [((key_slice[i] * np.uint64(HASH_SEEDS[i])) & np.uint64(MULT_WORD_MASK)) >> shift for i in range(2)]
+    hash_result = mult_result[0] ^ mult_result[1]
+
+    rarity_hash = hash_result & np.uint64((1 << rarity_width) - 1)
+    address_hash = hash_result >> np.uint64(rarity_width)
+    return address_hash.astype(np.intp), rarity_hash
+
+
+def leading_one(rarity_hash, bucket_content_width=BUCKET_CONTENT_WIDTH):
+    # leading_one.v: INPUT_WIDTH + 1 - (bit length of the input), truncated to
+    # $clog2(INPUT_WIDTH) bits, so an all-zero input gives a rarity of 0
+    rarity_width = rarity_hash_width(bucket_content_width)
+    out_width = int(np.ceil(np.log2(rarity_width)))
+    # frexp returns the exact bit length of integers below 2**53 (0 for 0)
+    bit_length = np.frexp(np.asarray(rarity_hash, dtype=np.float64))[1]
+    return ((rarity_width + 1 - bit_length) & ((1 << out_width) - 1)).astype(np.uint8)
+
+
+class HyperLogLogModel(object):
+
+    def __init__(self, datain_width=IP_ADDR_WIDTH, bucket_index_width=BUCKET_INDEX_WIDTH,
+                 bucket_content_width=BUCKET_CONTENT_WIDTH, result_width=RESULT_WIDTH):
+        self.datain_width = datain_width
+        self.bucket_index_width = bucket_index_width
+        self.bucket_content_width = bucket_content_width
+        self.result_width = result_width
+        self.num_buckets = 1 << bucket_index_width
+        self.default_reciprocal = 1 << (rarity_hash_width(bucket_content_width) - 1)
+        self.buckets = np.zeros(self.num_buckets, dtype=np.uint8)
+
+    # HLL_OP_UPDATE on a whole array of keys
+    def update(self, keys):
+        keys = np.atleast_1d(np.asarray(keys))
+        if keys.size == 0:
+            return
+        address, rarity_hash = hash_function(keys, self.datain_width, self.bucket_index_width, self.bucket_content_width)
+        rarity = leading_one(rarity_hash, self.bucket_content_width)
+        # Per-bucket max through a (bucket, rarity) presence map: cheaper than np.maximum.at
+        depth = 1 << self.bucket_content_width
+        present = np.zeros((self.num_buckets, depth), dtype=bool)
+        present[address, rarity] = True
+        present[np.arange(self.num_buckets), self.buckets] = True
+        self.buckets = (depth - 1 - np.argmax(present[:, ::-1], axis=1)).astype(np.uint8)
+
+    # HLL_OP_READ: returns (result, empty_buckets)
+    def read(self):
+        # One term per bucket, the count of empty buckets truncated to
+        # BUCKET_INDEX_WIDTH bits (an empty sketch counts 0)
+        result = int(np.sum(self.default_reciprocal >> self.buckets.astype(np.int64)))
+        empty_buckets = int(np.count_nonzero(self.buckets == 0))
+        return (result & ((1 << self.result_width) - 1),
+                empty_buckets & (self.num_buckets - 1))
+
+    # HLL_OP_READ_RESET: the READ sweep clears every bucket after reading it
+    def read_reset(self):
+        reply = self.read()
+        self.buckets[:] = 0
+        return reply
+
+    # HLL_OP_RESET
+    def reset(self):
+        self.buckets[:] = 0
+
+
+# Expected reply to a query issued after resetting the sketch and applying keys
+def hll_reply(keys, datain_width=IP_ADDR_WIDTH, bucket_index_width=BUCKET_INDEX_WIDTH,
+              bucket_content_width=BUCKET_CONTENT_WIDTH, result_width=RESULT_WIDTH):
+    hll = HyperLogLogModel(datain_width, bucket_index_width, bucket_content_width, result_width)
+    hll.update(keys)
+    return hll.read()
@@ -0,0 +1,277 @@
+#
+# Copyright (c) 2022 Mario Patetta, Conservatoire National des Arts et Metiers
+# All rights reserved.
+#
+# SBI_engine is free software: you can redistribute it and/or modify it under the terms of
+# the GNU Affero General Public License as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# SBI_engine is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+#
+# Precompiled Southbound codec.
+#
+# The bit layouts are compiled once, at import time, from the scapy classes of
+# southbound_headers.py (fields_desc and bind_layers), which remain the source
+# of truth. Messages are then packed into and unpacked from bytes/memoryview
+# with precomputed shifts and masks, without building any scapy object.
+#
+# test_sb_codec.py cross-checks the codec against the scapy layers (pytest);
+# run this file to time the codec against scapy as well.
+#
+
+import socket, struct
+from collections import namedtuple
+from southbound_headers import *
+
+
+# Decoded message: Southbound header fields, bound layer class (None for a bare
+# Southbound header) and layer fields
+SBMessage = namedtuple('SBMessage', ['header', 'layer', 'fields'])
+
+
+def ip2int(ip):
+    if isinstance(ip, str):
+        return struct.unpack('!I', socket.inet_aton(ip))[0]
+    return int(ip)
+
+
+def int2ip(value):
+    return socket.inet_ntoa(struct.pack('!I', value))
+
+
+class Layout(object):
+
+    def __init__(self, cls):
+        self.cls = cls
+        self.name = cls.__name__
+        widths = []
+        for field in cls.fields_desc:
+            # BitField/BitEnumField carry their size in bits, the others in bytes
+            width = field.size if hasattr(field, 'size') else int(field.sz * 8)
+            widths.append((field, width))
+        total = sum(width for field, width in widths)
+        if total % 8:
+            raise ValueError("{0} is not byte aligned ({1} bits)".format(self.name, total))
+        self.size = total // 8
+
+        # (name, shift from the LSB, mask, is an IPField)
+        self.fields = []
+        position = total
+        for field, width in widths:
+            position -= width
+            self.fields.append((field.name, position, (1 << width) - 1, isinstance(field, IPField)))
+        self.fields = tuple(self.fields)
+        self.index = dict((name, (shift, mask, is_ip)) for name, shift, mask, is_ip in self.fields)
+
+        self.defaults = {}
+        for field in cls.fields_desc:
+            default = field.default
+            if isinstance(field, IPField):
+                self.defaults[field.name] = default
+            else:
+                self.defaults[field.name] = int(default) if default is not None else 0
+        self.default_word = self.pack_word(self.defaults, 0)
+
+    def pack_word(self, values, word=None):
+        if word is None:
+            word = self.default_word
+        index = self.index
+        for name, value in values.items():
+            shift, mask, is_ip = index[name]
+            if is_ip:
+                value = ip2int(value)
+            word = (word & ~(mask << shift)) | ((value & mask) << shift)
+        return word
+
+    def pack(self, values):
+        return self.pack_word(values).to_bytes(self.size, 'big')
+
+    def unpack(self, buf, offset=0):
+        word = int.from_bytes(buf[offset:offset + self.size], 'big')
+        values = {}
+        for name, shift, mask, is_ip in self.fields:
+            value = (word >> shift) & mask
+            values[name] = int2ip(value) if is_ip else value
+        return values
+
+
+SOUTHBOUND = Layout(Southbound)
+SOUTHBOUND_SIZE = SOUTHBOUND.size
+
+# Southbound layers and the header fields they are bound with
+LAYOUTS = {}
+BINDINGS = {}
+LAYOUTS_BY_TYPE = {}
+for bound, cls in Southbound.payload_guess:
+    LAYOUTS[cls] = Layout(cls)
+    BINDINGS[cls] = dict(bound)
+    LAYOUTS_BY_TYPE[(bound['SBtype'], bound.get('length'))] = LAYOUTS[cls]
+
+# How Southbound is carried: directly over Ethernet or over IP
+SB_ETHER_TYPE = None
+SB_IP_PROTO = None
+for bound, cls in Ether.payload_guess:
+    if cls is Southbound:
+        SB_ETHER_TYPE = bound['type']
+for bound, cls in IP.payload_guess:
+    if cls is Southbound:
+        SB_IP_PROTO = bound['proto']
+
+
+def pack(layer=None, header=None, fields=None):
+    # Southbound header + layer, as bytes
+    values = dict(BINDINGS[layer]) if layer is not None else {}
+    if header:
+        values.update(header)
+    data = SOUTHBOUND.pack(values)
+    if layer is not None:
+        data += LAYOUTS[layer].pack(fields or {})
+    return data
+
+
+def unpack(buf, offset=0):
+    header = SOUTHBOUND.unpack(buf, offset)
+    layout = LAYOUTS_BY_TYPE.get((header['SBtype'], header['length']))
+    if layout is None or len(buf) < offset + SOUTHBOUND_SIZE + layout.size:
+        return SBMessage(header, None, None)
+    return SBMessage(header, layout.cls, layout.unpack(buf, offset + SOUTHBOUND_SIZE))
+
+
+def southbound_offset(frame):
+    # Offset of the Southbound header in an Ethernet frame, None if it is not a SB frame
+    if len(frame) < 14:
+        return None
+    ether_type = (frame[12] << 8) | frame[13]
+    if ether_type == SB_ETHER_TYPE:
+        return 14
+    if SB_IP_PROTO is not None and ether_type == 0x0800 and len(frame) >= 34 and frame[23] == SB_IP_PROTO:
+        return 14 + (frame[14] & 0x0f) * 4
+    return None
+
+
+class FrameCodec(object):
+    # Encodes/decodes whole frames. The layers below Southbound (e.g.
+    # Ether()/IP()) are built once per message type with scapy and then reused.
+
+    def __init__(self, lower, pad_to=0):
+        self.lower = lower
+        self.pad_to = pad_to
+        self.templates = {}
+
+    def template(self, layer):
+        if layer not in self.templates:
+            if layer is None:
+                pkt = self.lower.copy() / Southbound()
+                body_size = 0
+            else:
+                pkt = self.lower.copy() / Southbound() / layer(**LAYOUTS[layer].defaults)
+                body_size = LAYOUTS[layer].size
+            frame = bytes(pkt)
+            offset = southbound_offset(frame)
+            end = offset + SOUTHBOUND_SIZE + body_size
+            suffix = frame[end:] + b'\x00' * max(0, self.pad_to - len(frame))
+            self.templates[layer] = (frame[:offset], suffix)
+        return self.templates[layer]
+
+    def encode(self, layer=None, header=None, fields=None):
+        prefix, suffix = self.template(layer)
+        return prefix + pack(layer, header, fields) + suffix
+
+    def encode_batch(self, layer, rows, header=None):
+        # rows: iterable of layer field dicts, all sent with the same header
+        prefix, suffix = self.template(layer)
+        sb_header = dict(BINDINGS[layer]) if layer is not None else {}
+        if header:
+            sb_header.update(header)
+        header_bytes = SOUTHBOUND.pack(sb_header)
+        layout = LAYOUTS[layer]
+        return [prefix + header_bytes + layout.pack(row) + suffix for row in rows]
+
+    @staticmethod
+    def decode(frame):
+        offset = southbound_offset(frame)
+        if offset is None or len(frame) < offset + SOUTHBOUND_SIZE:
+            return None
+        return unpack(frame, offset)
+
+    @staticmethod
+    def decode_batch(frames):
+        # One entry per frame, None for frames that do not carry a SB header
+        return [FrameCodec.decode(frame) for frame in frames]
+
+
+# Scapy representation of a decoded message, for debugging
+def to_scapy(message):
+    pkt = Southbound(**message.header)
+    if message.layer is not None:
+        pkt = pkt / message.layer(**message.fields)
+    return pkt
+
+
+def random_fields(layout, rng):
+    values = {}
+    for name, shift, mask, is_ip in layout.fields:
+        value = rng.randint(0, mask)
+        values[name] = int2ip(value) if is_ip else value
+    return values
+
+
+def reference_lower():
+    # Layers below Southbound of the frames of this tree
+    if SB_IP_PROTO is not None:
+        return Ether(dst="33:33:33:33:33:33", src="d0:50:99:d8:4a:91") / IP(dst="128.0.0.2", src="127.0.0.1")
+    return Ether(dst="33:33:33:33:33:33", src="d0:50:99:d8:4a:91")
+
+
+def cross_check(cls, rng, rounds=200, lower=None):
+    # Encodes and decodes random messages of cls with the codec and with scapy,
+    # asserting they agree; returns the last (header, fields)
+    lower = lower if lower is not None else reference_lower()
+    codec = FrameCodec(lower)
+    layout = LAYOUTS[cls]
+    for i in range(rounds):
+        header = {'ControllerID': rng.randint(0, SOUTHBOUND.index['ControllerID'][1]),
+                  'SwitchID': rng.randint(0, SOUTHBOUND.index['SwitchID'][1]),
+                  'ACK': rng.randint(0, 1)}
+        fields = random_fields(layout, rng)
+        reference = bytes(lower.copy() / Southbound(**header) / cls(**fields))
+        frame = codec.encode(cls, header, fields)
+        assert frame == reference, "{0}: encoded frame differs from scapy".format(layout.name)
+        message = codec.decode(memoryview(reference))
+        dissected = lower.__class__(reference)
+        assert message.layer is cls, "{0}: decoded as {1}".format(layout.name, message.layer)
+        for name in SOUTHBOUND.index:
+            assert message.header[name] == dissected[Southbound].getfieldval(name), "{0}: header field {1}".format(layout.name, name)
+        for name in layout.index:
+            assert message.fields[name] == dissected[cls].getfieldval(name), "{0}: field {1}".format(layout.name, name)
+    return header, fields
+
+
+def self_check(rounds=200):
+    import random, time
+    rng = random.Random(0)
+    lower = reference_lower()
+    codec = FrameCodec(lower)
+    for cls, layout in sorted(LAYOUTS.items(), key=lambda item: item[0].__name__):
+        header, fields = cross_check(cls, rng, rounds, lower)
+        # Timing: codec vs scapy
+        start = time.time()
+        for i in range(rounds):
+            codec.decode(codec.encode(cls, header, fields))
+        codec_time = (time.time() - start) / rounds
+        start = time.time()
+        for i in range(rounds):
+            lower.__class__(bytes(lower.copy() / Southbound(**header) / cls(**fields)))[cls]
+        scapy_time = (time.time() - start) / rounds
+        print("{0:<28} OK  codec {1:7.2f} us  scapy {2:8.2f} us".format(layout.name, codec_time * 1e6, scapy_time * 1e6))
+
+
+if __name__ == "__main__":
+    self_check()
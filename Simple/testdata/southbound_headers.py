@@ -74,14 +74,15 @@ class SouthboundMetric(Packet):
     name = "SouthboundMetric"                                       	    # Target dependant
     fields_desc = [
         BitField("reset",0,1),
-        BitEnumField("metricID", 0, 7, {SRC_IP_CARD:"SRC_IP_CARD", DST_IP_CARD:"DST_IP_CARD", SRC_PORTS_CARD:"SRC_PORTS_CARD", COUNTERS:"COUNTERS"}),
+        BitField("read_reset",0,1),                                          # Read and reset in one request
+        BitEnumField("metricID", 0, 6, {SRC_IP_CARD:"SRC_IP_CARD", DST_IP_CARD:"DST_IP_CARD", SRC_PORTS_CARD:"SRC_PORTS_CARD", COUNTERS:"COUNTERS"}),
         BitField("result1",0,24),
         BitField("result2",0,24),
         BitField("result3",0,24),
         BitField("result4",0,40),
     ]
     def mysummary(self):
-        return self.sprintf("reset=%reset% metricID=%metricID% result1=%result1% result2=%result2% result3=%result3% result4=%result4%")
+        return self.sprintf("reset=%reset% read_reset=%read_reset% metricID=%metricID% result1=%result1% result2=%result2% result3=%result3% result4=%result4%")
 
 bind_layers(Southbound, SouthboundMetric, SBtype=METRIC_TYPE, length=19)
 
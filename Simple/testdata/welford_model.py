@@ -0,0 +1,155 @@
+#
+# Copyright (c) 2022 Mario Patetta, Conservatoire National des Arts et Metiers
+# All rights reserved.
+#
+# SBI_engine is free software: you can redistribute it and/or modify it under the terms of
+# the GNU Affero General Public License as published by the Free Software Foundation, either
+# version 3 of the License, or any later version.
+#
+# SBI_engine is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License along with this program.
+# If not, see <https://www.gnu.org/licenses/>.
+#
+
+#
+# Bit-accurate reference model of the welford + SYN counter extern
+# (extern/welford/hdl/EXTERN_welford_template.v, bitwise_log2.v, multiply.v).
+#
+# The counters, the log2 shifts and the M2 increments are computed on whole
+# NumPy arrays; only the fixed-point mean recurrence is iterated. As for the
+# hyperloglog model, the extern request FIFO is assumed to be drained between
+# two data plane updates.
+#
+# Replies follow concatenate.v:
+#   result_mean = integer part of the running mean
+#   result_m2   = sum of squared differences, i.e. std = sqrt(result_m2 / (pkt_count-1))
+#
+
+import numpy as np
+
+# Default parameters, as set in SnM_metrics.p4 / SBI_engine.p4
+PKT_SIZE_WIDTH          = 11
+RESULT_SHORT            = 24
+RESULT_LONG             = 40
+
+MULT_WORD_SMALL_SIZE    = 18                                        # DSP48E1 has a 24x18 multiplier
+
+
+def bitwise_log2(pkt_count, input_width=RESULT_SHORT):
+    # bitwise_log2.v: log2(pkt_count) rounded on the bit after the leading one,
+    # 0 when pkt_count <= 1
+    pkt_count = np.asarray(pkt_count, dtype=np.int64)
+    hamming_weight = np.frexp(pkt_count.astype(np.float64))[1].astype(np.int64)
+    round_up = (pkt_count >> np.maximum(hamming_weight - 2, 0)) & 1
+    shift = np.where(hamming_weight > 1, hamming_weight - 1 + round_up, 0)
+    return shift & ((1 << int(np.ceil(np.log2(input_width)))) - 1)
+
+
+class WelfordModel(object):
+
+    def __init__(self, datain_width=PKT_SIZE_WIDTH, result_short_width=RESULT_SHORT, result_long_width=RESULT_LONG):
+        self.datain_width = datain_width
+        self.result_short_width = result_short_width
+        self.result_long_width = result_long_width
+        self.scaling = result_short_width - 9                       # Should be on the order of the maximum traffic we expect
+        self.delta_scaling = MULT_WORD_SMALL_SIZE - datain_width - 1
+        # delta1 and delta2 are sampled on their MULT_WORD_SMALL_SIZE MSBs
+        self.delta_sampling = datain_width + self.scaling + 1 - MULT_WORD_SMALL_SIZE
+        if self.delta_scaling < 0 or self.delta_sampling < 0:
+            raise ValueError("DATAIN_WIDTH = {0} does not fit in the {1}-bit multiplier word".format(datain_width, MULT_WORD_SMALL_SIZE))
+        self.m2_width = result_long_width + 2 * self.delta_scaling + 1
+        self.reset()
+
+    # WELF_OP_RESET
+    def reset(self):
+        self.syn_count = 0
+        self.pkt_count = 0
+        self.mean = 0                                               # signed [DATAIN_WIDTH+SCALING:0]
+        self.m2 = 0                                                 # signed [RES_LONG_WIDTH+2*DELTA_SCALING:0]
+
+    # WELF_OP_UPDATE on arrays of payload lengths (ip.totalLen - 40) and SYN flags
+    def update(self, payload_len, syn_flag=None):
+        payload_len = np.atleast_1d(np.asarray(payload_len, dtype=np.int64))
+        if payload_len.size == 0:
+            return
+        if syn_flag is None:
+            syn_flag = np.zeros(payload_len.size, dtype=bool)
+        syn_flag = np.atleast_1d(np.asarray(syn_flag, dtype=bool))
+        if syn_flag.size != payload_len.size:
+            raise ValueError("payload_len and syn_flag must have the same length")
+
+        cnt_mask = (1 << self.result_short_width) - 1
+        # newVal = payload_len[10:0], upscaled by SCALING
+        scaled_val = (payload_len & ((1 << self.datain_width) - 1)) << self.scaling
+        # The shift only depends on the (already incremented) pkt counter
+        pkt_count = (self.pkt_count + np.arange(1, payload_len.size + 1, dtype=np.int64)) & cnt_mask
+        shift = bitwise_log2(pkt_count, self.result_short_width)
+
+        # The mean stays within [0, 2**(DATAIN_WIDTH+SCALING)): the signed register never wraps
+        mean = self.mean
+        mean_trace = []
+        for x, s in zip(scaled_val.tolist(), shift.tolist()):
+            mean += (x - mean) >> s
+            mean_trace.append(mean)
+        mean_new = np.array(mean_trace, dtype=np.int64)
+        mean_old = np.concatenate(([self.mean], mean_new[:-1]))
+        self.mean = mean
+
+        # m2_increment = delta1[MSBs] * delta2[MSBs], accumulated on the m2 register
+        delta1 = (scaled_val - mean_old) >> self.delta_sampling
+        delta2 = (scaled_val - mean_new) >> self.delta_sampling
+        self.m2 += int(np.sum(delta1 * delta2, dtype=np.int64))
+
+        self.syn_count = (self.syn_count + int(np.count_nonzero(syn_flag))) & cnt_mask
+        self.pkt_count = int(pkt_count[-1])
+
+    # WELF_OP_READ: returns (result_syn_count, result_pkt_count, result_mean, result_m2)
+    def read(self):
+        # m2 is a two's complement register of m2_width bits
+        m2 = self.m2 & ((1 << self.m2_width) - 1)
+        mean_out = (self.mean >> self.scaling) & ((1 << self.datain_width) - 1)
+        m2_out = (m2 >> (2 * self.delta_scaling)) & ((1 << self.result_long_width) - 1)
+        return (self.syn_count, self.pkt_count, mean_out, m2_out)
+
+    # WELF_OP_READ_RESET
+    def read_reset(self):
+        reply = self.read()
+        self.reset()
+        return reply
+
+
+# Expected COUNTERS reply to a query issued after resetting the extern and applying the packets
+def welford_reply(payload_len, syn_flag=None, datain_width=PKT_SIZE_WIDTH, result_short_width=RESULT_SHORT,
+                  result_long_width=RESULT_LONG):
+    welford = WelfordModel(datain_width, result_short_width, result_long_width)
+    welford.update(payload_len, syn_flag)
+    return welford.read()
+
+
+# Exact floating point statistics of the same (truncated) values: (count, mean, std)
+def exact_welford(payload_len, datain_width=PKT_SIZE_WIDTH):
+    values = np.asarray(payload_len, dtype=np.int64) & ((1 << datain_width) - 1)
+    if values.size < 2:
+        return (values.size, float(np.mean(values)) if values.size else 0.0, 0.0)
+    return (values.size, float(np.mean(values)), float(np.std(values, ddof=1)))
+
+
+# Mean and standard deviation carried by a COUNTERS reply (as in SnM_test_receive.py)
+def reply_statistics(reply):
+    pkt_count, mean, m2 = reply[1], reply[2], reply[3]
+    if pkt_count > 1:
+        return (float(mean), (float(m2) / (pkt_count - 1)) ** 0.5)
+    return (float(mean), 0.0)
+
+
+# Absolute and relative error of a COUNTERS reply against exact statistics
+def reply_error(reply, payload_len, datain_width=PKT_SIZE_WIDTH):
+    count, mean, std = exact_welford(payload_len, datain_width)
+    hw_mean, hw_std = reply_statistics(reply)
+    error = {'mean_abs': hw_mean - mean, 'std_abs': hw_std - std}
+    error['mean_rel'] = error['mean_abs'] / mean if mean else 0.0
+    error['std_rel'] = error['std_abs'] / std if std else 0.0
+    return error